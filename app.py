@@ -1,17 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import os
 import logging
 import io
 import csv
+import json
+import sys
+import tempfile
+import threading
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-# Caminho absoluto do banco de dados SQLite (evita problemas com diretórios relativos no Windows)
-data_dir = os.path.join(basedir, 'data')
+# módulos compartilhados (versão dos dados etc.) ficam em ml/
+sys.path.append(os.path.join(basedir, 'ml'))
+from versao_dados import versao_dados, condicional
+from banco import configurar_engine
+from cache_lru import CacheLRU
+from classificador import limpar_texto
+from modelo_em_cache import ModeloEmCache
+
+# Caminho absoluto do banco de dados SQLite (evita problemas com diretórios relativos no Windows).
+# DADOS_DIR troca o diretório do banco e dos modelos (os testes usam um diretório temporário)
+data_dir = os.path.abspath(os.environ.get('DADOS_DIR') or os.path.join(basedir, 'data'))
 # garantir que o diretório de dados exista o quanto antes
 os.makedirs(data_dir, exist_ok=True)
 db_file = os.path.join(data_dir, 'financas.db')
@@ -19,6 +32,9 @@ app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_file.replace('\\','/')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
+with app.app_context():
+    # WAL, synchronous=NORMAL, mmap e cache em todas as conexões do pool
+    configurar_engine(db.engine)
 
 # configurar logging básico para capturar requisições e erros
 logging.basicConfig(level=logging.INFO)
@@ -115,9 +131,136 @@ def get_model_paths():
     return vec_path, model_path
 
 
-def train_classifier(force: bool = False) -> dict:
+def get_checkpoint_path():
+    """Checkpoint do treino incremental, ao lado do modelo salvo."""
+    return os.path.join(data_dir, 'classifier_checkpoint.json')
+
+
+# Treino incremental: o HashingVectorizer não tem vocabulário (não precisa de
+# fit), então o MultinomialNB pode receber só as transações novas via partial_fit
+N_FEATURES_INCREMENTAL = 2 ** 15
+LOTE_TREINO = 5000
+
+
+def _gravar_atomico(caminho, gravar):
+    """Grava num temporário e troca de uma vez para que quem estiver lendo
+    nunca veja um arquivo pela metade."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+    os.close(fd)
+    try:
+        gravar(tmp_path)
+        os.replace(tmp_path, caminho)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _ler_checkpoint():
+    try:
+        with open(get_checkpoint_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _gravar_checkpoint(checkpoint):
+    def gravar(caminho):
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+    _gravar_atomico(get_checkpoint_path(), gravar)
+
+
+def _remover_checkpoint():
+    try:
+        os.remove(get_checkpoint_path())
+    except FileNotFoundError:
+        pass
+
+
+def _lotes_rotulados(depois_do_id):
+    """(ids, descrições, categorias) das transações rotuladas com id maior que
+    `depois_do_id`, em ordem de id e em lotes de LOTE_TREINO."""
+    while True:
+        linhas = (db.session.query(Transacao.id, Transacao.descricao, Transacao.categoria)
+                  .filter(Transacao.id > depois_do_id)
+                  .order_by(Transacao.id)
+                  .limit(LOTE_TREINO)
+                  .all())
+        if not linhas:
+            return
+        depois_do_id = linhas[-1].id
+        rotuladas = [(d, c) for _, d, c in linhas if d and c]
+        yield depois_do_id, [d for d, _ in rotuladas], [c for _, c in rotuladas]
+
+
+def _treinar_incremental(force: bool) -> dict:
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.pipeline import make_pipeline
+    from joblib import dump
+
+    _, model_path = get_model_paths()
+    checkpoint = None if force else _ler_checkpoint()
+    pipeline = None
+    if checkpoint and checkpoint.get('modo') == 'incremental':
+        try:
+            # Cópia própria: o modelo servido pelo ModeloEmCache não é alterado,
+            # o arquivo novo é que será recarregado
+            pipeline = _carregar_pipeline(model_path)
+        except Exception:
+            logger.exception("Falha ao carregar o modelo salvo; refazendo o treino")
+
+    if pipeline is None:
+        # Reconstrução: o partial_fit exige conhecer todas as classes na primeira chamada
+        ultimo_id, n_samples = 0, 0
+        classes = sorted(c for (c,) in db.session.query(Transacao.categoria)
+                         .filter(Transacao.categoria != None, Transacao.categoria != '',
+                                 Transacao.descricao != None, Transacao.descricao != '')
+                         .distinct())
+        if not classes:
+            return {'status': 'error', 'message': 'Poucos dados rotulados para treinar (min 5).', 'n_samples': 0}
+        pipeline = make_pipeline(
+            HashingVectorizer(n_features=N_FEATURES_INCREMENTAL, alternate_sign=False),
+            MultinomialNB()
+        )
+        reconstruido = True
+    else:
+        ultimo_id, n_samples = checkpoint['ultimo_id'], checkpoint['n_samples']
+        classes = pipeline[-1].classes_.tolist()
+        reconstruido = False
+
+    vetorizador, modelo = pipeline[0], pipeline[-1]
+    novas = 0
+    for ultimo_lote, descricoes, categorias in _lotes_rotulados(ultimo_id):
+        if set(categorias) - set(classes):
+            # Categoria que o modelo nunca viu: o NB não aceita classes novas no partial_fit
+            return _treinar_incremental(force=True)
+        if descricoes:
+            modelo.partial_fit(vetorizador.transform(descricoes), categorias, classes=classes)
+            novas += len(descricoes)
+        ultimo_id = ultimo_lote
+
+    n_samples += novas
+    if n_samples < 5:
+        return {'status': 'error', 'message': 'Poucos dados rotulados para treinar (min 5).', 'n_samples': n_samples}
+    if novas or reconstruido:
+        _gravar_atomico(model_path, lambda caminho: dump(pipeline, caminho))
+    _gravar_checkpoint({'modo': 'incremental', 'ultimo_id': ultimo_id, 'n_samples': n_samples})
+    return {'status': 'ok', 'modo': 'incremental', 'n_samples': n_samples,
+            'novas_amostras': novas, 'reconstruido': reconstruido}
+
+
+def train_classifier(force: bool = False, incremental: bool = False) -> dict:
     """Treina um classificador simples (TF-IDF + MultinomialNB) usando transações existentes.
-    Retorna um dicionário com status e números de amostras usadas."""
+    Retorna um dicionário com status e números de amostras usadas.
+
+    Com `incremental`, usa HashingVectorizer + MultinomialNB.partial_fit e lê só
+    as transações com id acima do checkpoint salvo em classifier_checkpoint.json.
+    Transações antigas editadas ou excluídas não são revistas: `force` refaz o
+    treino incremental desde o início."""
+    if incremental:
+        return _treinar_incremental(force)
+
     import pandas as pd
     from sklearn.model_selection import train_test_split
     from sklearn.feature_extraction.text import TfidfVectorizer
@@ -139,31 +282,108 @@ def train_classifier(force: bool = False) -> dict:
     pipeline.fit(X, y)
 
     vec_path, model_path = get_model_paths()
-    # salva o pipeline inteiro
-    dump(pipeline, model_path)
+    # salva o pipeline inteiro; o checkpoint incremental não vale para este modelo
+    _gravar_atomico(model_path, lambda caminho: dump(pipeline, caminho))
+    _remover_checkpoint()
     return {'status': 'ok', 'n_samples': len(df)}
 
 
-def predict_with_model(descricao: str) -> str:
-    """Prediz categoria usando o modelo salvo; se não existir, tenta treinar.
-    Se tudo falhar, usa o classificador heurístico."""
+def _treinar_em_segundo_plano():
+    with app.app_context():
+        try:
+            res = train_classifier()
+            logger.info("Treino em segundo plano: %s", res)
+        except Exception:
+            logger.exception("Falha ao treinar o classificador em segundo plano")
+
+
+_treino_lock = threading.Lock()
+_treino = {'thread': None, 'versao_dados': None}
+
+
+def agendar_treino() -> bool:
+    """Dispara o treino numa thread, uma execução por vez. Uma tentativa sem
+    sucesso só é repetida depois que os dados mudarem."""
+    with _treino_lock:
+        thread = _treino['thread']
+        if thread is not None and thread.is_alive():
+            return False
+        if _treino['versao_dados'] == versao_dados.numero:
+            return False
+        _treino['versao_dados'] = versao_dados.numero
+        _treino['thread'] = threading.Thread(target=_treinar_em_segundo_plano, daemon=True)
+        _treino['thread'].start()
+        return True
+
+
+def aguardar_treino(timeout=None):
+    """Espera o treino em segundo plano em andamento, se houver."""
+    thread = _treino['thread']
+    if thread is not None:
+        thread.join(timeout)
+
+
+# Previsões por descrição normalizada (mesma limpeza do ClassificadorCategorias).
+# Os vetorizadores (TF-IDF ou hashing) geram os mesmos tokens para o texto limpo e para o original.
+cache_previsoes = CacheLRU()
+
+
+def _carregar_pipeline(caminho):
     from joblib import load
+    return load(caminho)
+
+
+# O pipeline é lido do disco uma vez e só de novo quando o arquivo muda;
+# as previsões guardadas vieram do modelo anterior e são descartadas
+modelo_em_cache = ModeloEmCache(_carregar_pipeline, ao_recarregar=cache_previsoes.limpar)
+
+
+def carregar_modelo():
+    """Modelo atual em memória; sem modelo salvo, agenda o treino e devolve None."""
     vec_path, model_path = get_model_paths()
     try:
-        if not os.path.exists(model_path):
-            res = train_classifier()
-            if res.get('status') != 'ok':
-                return classify_categoria(descricao)
-        model = load(model_path)
-        pred = model.predict([descricao])[0]
-        return pred
+        model = modelo_em_cache.obter(model_path)
     except Exception:
-        return classify_categoria(descricao)
+        logger.exception("Falha ao carregar o modelo salvo")
+        model = None
+    if model is None:
+        agendar_treino()
+    return model
+
+
+def predict_with_model(descricao: str) -> str:
+    """Prediz categoria usando o modelo salvo, com cache por descrição normalizada."""
+    return predict_lote_with_model([descricao])[0]
+
+
+def predict_lote_with_model(descricoes: list) -> list:
+    """Prediz as categorias de várias descrições, na ordem de entrada.
+    Cada texto normalizado distinto fora do cache é previsto uma única vez,
+    todos numa única chamada vetorizada a model.predict. Enquanto não houver
+    modelo, usa o classificador heurístico."""
+    # Antes do cache: se o arquivo do modelo mudou, o cache é limpo aqui
+    model = carregar_modelo()
+
+    def prever(textos):
+        if model is not None:
+            try:
+                return model.predict(textos).tolist()
+            except Exception:
+                logger.exception("Falha ao prever com o modelo salvo")
+        return [classify_categoria(texto) for texto in textos]
+
+    limpas = [limpar_texto(descricao or '') for descricao in descricoes]
+    por_texto = cache_previsoes.obter_varios(list(dict.fromkeys(limpas)), prever)
+    return [por_texto[texto] for texto in limpas]
 
 
 @app.route('/treinar_classificador', methods=['GET'])
 def treinar_classificador():
-    res = train_classifier()
+    """Treino completo (TF-IDF); ?modo=incremental consome só as transações novas
+    e ?modo=incremental&completo=1 refaz o modelo incremental do zero."""
+    incremental = request.args.get('modo') == 'incremental'
+    completo = request.args.get('completo', '').lower() in ('1', 'true', 'sim')
+    res = train_classifier(force=completo, incremental=incremental)
     return jsonify(res)
 
 
@@ -177,6 +397,21 @@ def classificar_endpoint():
     return jsonify({'status': 'ok', 'categoria': cat})
 
 
+@app.route('/classificar_lote', methods=['POST'])
+def classificar_lote_endpoint():
+    data = request.get_json() or {}
+    descricoes = data.get('descricoes')
+    if not isinstance(descricoes, list) or not all(isinstance(d, str) for d in descricoes):
+        return jsonify({'status': 'error', 'message': 'descricoes deve ser uma lista de textos'}), 400
+    return jsonify({'status': 'ok', 'categorias': predict_lote_with_model(descricoes)})
+
+
+@app.route('/classificar_stats', methods=['GET'])
+def classificar_stats():
+    """Uso do cache de previsões (acertos, falhas, tamanho) para ajustar a capacidade."""
+    return jsonify(cache_previsoes.estatisticas())
+
+
 # ------------------------------
 # (inicialização movida para o final do arquivo)
 # ------------------------------
@@ -226,6 +461,7 @@ def adicionar():
 
     db.session.add(nova)
     db.session.commit()
+    versao_dados.incrementar()
 
     return redirect("/")
 
@@ -237,6 +473,7 @@ def excluir(id):
     transacao = Transacao.query.get(id)
     db.session.delete(transacao)
     db.session.commit()
+    versao_dados.incrementar()
     return redirect(url_for('index'))
 
 # ------------------------------
@@ -273,6 +510,7 @@ def previsao():
 
 
 @app.route('/dados_despesas')
+@condicional
 def dados_despesas():
     """Retorna JSON com despesas acumuladas por mês para alimentar gráficos no frontend."""
     transacoes = Transacao.query.filter_by(tipo='Despesa').order_by(Transacao.data.asc()).all()
@@ -306,6 +544,7 @@ def inserir_exemplo():
         for t in exemplo:
             db.session.add(t)
         db.session.commit()
+        versao_dados.incrementar()
     return redirect(url_for('index'))
 
 
@@ -315,6 +554,7 @@ def health():
 
 
 @app.route('/debug_stats')
+@condicional
 def debug_stats():
     """Retorna contagens e últimas transações para depuração do frontend."""
     total = Transacao.query.count()
@@ -326,6 +566,7 @@ def debug_stats():
 
 
 @app.route('/transacoes_json')
+@condicional
 def transacoes_json():
     """Retorna todas as transações em JSON (para carregamento no frontend)."""
     transacoes = Transacao.query.order_by(Transacao.data.desc()).all()
@@ -345,22 +586,127 @@ def transacoes_json():
 # ------------------------------
 # CSV Export / Import
 # ------------------------------
-@app.route('/exportar_csv')
-def exportar_csv():
-    transacoes = Transacao.query.order_by(Transacao.data.asc()).all()
+CSV_CABECALHO = ['id', 'tipo', 'categoria', 'valor', 'data', 'descricao']
+CSV_LINHAS_POR_BLOCO = 1000
+
+
+def filtrar_exportacao(query, args):
+    """Filtros opcionais do export: data_inicio, data_fim (AAAA-MM-DD) e tipo."""
+    if args.get('data_inicio'):
+        query = query.filter(Transacao.data >= datetime.strptime(args['data_inicio'], '%Y-%m-%d').date())
+    if args.get('data_fim'):
+        query = query.filter(Transacao.data <= datetime.strptime(args['data_fim'], '%Y-%m-%d').date())
+    if args.get('tipo'):
+        query = query.filter(Transacao.tipo == args['tipo'])
+    return query
+
+
+def gerar_csv(linhas):
+    """Gera o CSV em blocos de bytes; só um bloco de linhas fica em memória por vez."""
     si = io.StringIO()
     writer = csv.writer(si)
-    # header
-    writer.writerow(['id', 'tipo', 'categoria', 'valor', 'data', 'descricao'])
-    for t in transacoes:
-        data_str = t.data.strftime('%Y-%m-%d') if t.data else ''
-        writer.writerow([t.id, t.tipo, t.categoria or '', f"{t.valor}", data_str, t.descricao or ''])
-    output = si.getvalue()
-    resp = Response(output, mimetype='text/csv')
+    writer.writerow(CSV_CABECALHO)
+    for n, (id_, tipo, categoria, valor, data, descricao) in enumerate(linhas, 1):
+        data_str = data.strftime('%Y-%m-%d') if data else ''
+        writer.writerow([id_, tipo, categoria or '', f"{valor}", data_str, descricao or ''])
+        if n % CSV_LINHAS_POR_BLOCO == 0:
+            yield si.getvalue().encode('utf-8')
+            si.seek(0)
+            si.truncate(0)
+    yield si.getvalue().encode('utf-8')
+
+
+@app.route('/exportar_csv')
+def exportar_csv():
+    try:
+        query = filtrar_exportacao(db.session.query(
+            Transacao.id, Transacao.tipo, Transacao.categoria,
+            Transacao.valor, Transacao.data, Transacao.descricao
+        ), request.args)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'data inválida (use AAAA-MM-DD)'}), 400
+    # yield_per busca as linhas do cursor em blocos em vez de carregar a tabela inteira
+    linhas = query.order_by(Transacao.data.asc(), Transacao.id.asc()).yield_per(CSV_LINHAS_POR_BLOCO)
+    resp = Response(stream_with_context(gerar_csv(linhas)), mimetype='text/csv')
     resp.headers['Content-Disposition'] = 'attachment; filename=transacoes.csv'
     return resp
 
 
+IMPORTACAO_LOTE = 1000
+IMPORTACAO_MAX_ERROS_DETALHADOS = 1000
+
+
+class DetectorFormatoData:
+    """Converte datas tentando primeiro o último formato que funcionou.
+    Extratos bancários usam um único formato por arquivo, então quase sempre basta um strptime."""
+    FORMATOS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d/%m/%y')
+
+    def __init__(self):
+        self.formato = self.FORMATOS[0]
+
+    def converter(self, texto):
+        try:
+            return datetime.strptime(texto, self.formato)
+        except ValueError:
+            pass
+        for formato in self.FORMATOS:
+            if formato == self.formato:
+                continue
+            try:
+                data = datetime.strptime(texto, formato)
+            except ValueError:
+                continue
+            self.formato = formato
+            return data
+        raise ValueError(f'data inválida: {texto!r}')
+
+
+def linha_para_transacao(row, detector):
+    """Converte uma linha do CSV em um dicionário pronto para inserção; lança ValueError com o motivo."""
+    tipo = row.get('tipo') or row.get('type') or 'Despesa'
+    categoria = row.get('categoria') or row.get('category') or ''
+    valor_raw = row.get('valor') or row.get('value') or 0
+    try:
+        valor = float(valor_raw)
+    except (TypeError, ValueError):
+        raise ValueError(f'valor inválido: {valor_raw!r}')
+    data_raw = (row.get('data') or row.get('date') or '').strip()
+    data_obj = detector.converter(data_raw) if data_raw else datetime.utcnow()
+    descricao = row.get('descricao') or row.get('description') or ''
+    return {'tipo': tipo, 'categoria': categoria, 'valor': valor, 'data': data_obj.date(), 'descricao': descricao}
+
+
+def importar_linhas(reader):
+    """Insere as linhas em lotes (bulk) dentro de uma única transação e devolve o relatório."""
+    detector = DetectorFormatoData()
+    aceitas = 0
+    rejeitadas = 0
+    erros = []
+    lote = []
+    try:
+        # linha 1 é o cabeçalho
+        for numero_linha, row in enumerate(reader, 2):
+            try:
+                lote.append(linha_para_transacao(row, detector))
+            except ValueError as e:
+                rejeitadas += 1
+                if len(erros) < IMPORTACAO_MAX_ERROS_DETALHADOS:
+                    erros.append({'linha': numero_linha, 'motivo': str(e)})
+                continue
+            if len(lote) >= IMPORTACAO_LOTE:
+                db.session.bulk_insert_mappings(Transacao, lote)
+                aceitas += len(lote)
+                lote = []
+        if lote:
+            db.session.bulk_insert_mappings(Transacao, lote)
+            aceitas += len(lote)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {'status': 'ok', 'aceitas': aceitas, 'rejeitadas': rejeitadas, 'erros': erros}
+
+
 @app.route('/importar_csv', methods=['POST'])
 def importar_csv():
     # Expect multipart/form-data with file input named 'file'
@@ -368,34 +714,20 @@ def importar_csv():
     if not f:
         return redirect(url_for('index'))
     filename = secure_filename(f.filename)
-    # read CSV from stream
-    stream = io.StringIO(f.stream.read().decode('utf-8'))
-    reader = csv.DictReader(stream)
-    created = 0
-    for row in reader:
-        try:
-            tipo = row.get('tipo') or row.get('type') or 'Despesa'
-            categoria = row.get('categoria') or row.get('category') or ''
-            valor = float(row.get('valor') or row.get('value') or 0)
-            data_raw = row.get('data') or row.get('date') or ''
-            # try multiple date formats
-            data_obj = None
-            if data_raw:
-                try:
-                    data_obj = datetime.strptime(data_raw, '%Y-%m-%d')
-                except Exception:
-                    try:
-                        data_obj = datetime.strptime(data_raw, '%d/%m/%Y')
-                    except Exception:
-                        data_obj = None
-            descricao = row.get('descricao') or row.get('description') or ''
-            nova = Transacao(tipo, categoria, valor, data_obj or datetime.utcnow(), descricao)
-            db.session.add(nova)
-            created += 1
-        except Exception:
-            # skip bad rows
-            continue
-    db.session.commit()
+    # decodifica o upload aos poucos, sem ler o arquivo inteiro para a memória
+    stream = io.TextIOWrapper(f.stream, encoding='utf-8-sig', newline='')
+    try:
+        relatorio = importar_linhas(csv.DictReader(stream))
+    except (UnicodeDecodeError, csv.Error) as e:
+        logger.warning('Falha ao importar %s: %s', filename, e)
+        relatorio = {'status': 'error', 'message': f'arquivo inválido: {e}', 'aceitas': 0, 'rejeitadas': 0, 'erros': []}
+    if relatorio['aceitas']:
+        versao_dados.incrementar()
+    logger.info('Importação de %s: %s', filename, relatorio)
+
+    # formulário HTML continua sendo redirecionado; clientes de API recebem o relatório
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return jsonify(relatorio), 200 if relatorio['status'] == 'ok' else 400
     return redirect(url_for('index'))
 
 
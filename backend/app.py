@@ -1,17 +1,28 @@
 from flask import Flask, request, jsonify, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from sqlalchemy.dialects.sqlite import insert
+from datetime import datetime
+from functools import lru_cache
 import os
-import json
 import sys
+import base64
 
 # Adicionar o diretório ml ao path para importar os módulos
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ml'))
 
+from versao_dados import VersaoDados
+from banco import url_sqlalchemy, resolver_caminho_db, configurar_engine, devolver_conexoes
+from reclassificacao import JobReclassificacao
+from palavras_chave import EspelhoPalavrasChave
+from cache_revalidacao import CacheRevalidacao
+
 try:
     from previsao_gastos import obter_previsao_gastos, obter_multiplas_previsoes, analisar_padroes
-    from classificador import classificar_automaticamente, obter_sugestoes_categoria
+    from previsao_categorias import obter_previsao_por_categoria
+    from classificador import (classificar_automaticamente, classificar_lote, obter_sugestoes_categoria,
+                               indexar_historico, agendar_indexacao_historico,
+                               obter_estatisticas_classificacao)
 except ImportError as e:
     print(f"Aviso: Módulos ML não encontrados: {e}")
     # Funções fallback
@@ -21,35 +32,70 @@ except ImportError as e:
         return []
     def analisar_padroes():
         return None
+    def obter_previsao_por_categoria():
+        return None
     def classificar_automaticamente(descricao):
         return None
+    def classificar_lote(descricoes, historico=True):
+        return [None] * len(descricoes)
     def obter_sugestoes_categoria(descricao):
         return []
+    def indexar_historico():
+        return 0
+    def agendar_indexacao_historico():
+        return None
+    def obter_estatisticas_classificacao():
+        return None
+
+from migracoes import aplicar_migracoes, SQL_RECONSTRUIR_RESUMO
+
+# Versão dos dados lida da tabela versao_dados (migração 7): a mesma ETag em todos os workers
+versao_dados = VersaoDados(resolver_caminho_db())
+condicional = versao_dados.condicional
 
 app = Flask(__name__, template_folder='frontend/templates', static_folder='frontend/static')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database/controle_gastos.db'
+# Mesmo arquivo usado pelos módulos de ML, com caminho absoluto (DATABASE_URL pode sobrescrever)
+app.config['SQLALCHEMY_DATABASE_URI'] = url_sqlalchemy()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'sua-chave-secreta-aqui'
 
 # Criar diretório do banco se não existir
-os.makedirs('database', exist_ok=True)
+os.makedirs(os.path.dirname(resolver_caminho_db()), exist_ok=True)
 
 db = SQLAlchemy(app)
+with app.app_context():
+    configurar_engine(db.engine)
 CORS(app)
 
+@app.teardown_request
+def devolver_conexoes_ml(exc=None):
+    """Devolve ao pool as conexões sqlite3 usadas pelos módulos de ML nesta requisição"""
+    devolver_conexoes()
+
+# Palavras-chave em memória, relidas só quando categorias ou palavras mudam
+espelho_palavras = EspelhoPalavrasChave()
+
 # Modelos do banco de dados
 class Categoria(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(80), nullable=False)
-    palavras_chave = db.Column(db.Text)  # JSON com palavras-chave para classificação automática
+    palavras_chave = db.Column(db.Text)  # JSON antigo; as palavras ficam em PalavraChave (migração 6)
     
     def to_dict(self):
         return {
             'id': self.id,
             'nome': self.nome,
-            'palavras_chave': json.loads(self.palavras_chave) if self.palavras_chave else []
+            'palavras_chave': list(espelho_palavras.obter().get(self.id, []))
         }
 
+class PalavraChave(db.Model):
+    """Uma palavra-chave de uma categoria; o id crescente dá a ordem da lista"""
+    __tablename__ = 'categoria_palavra'
+    __table_args__ = (db.UniqueConstraint('categoria_id', 'palavra'),)
+    id = db.Column(db.Integer, primary_key=True)
+    categoria_id = db.Column(db.Integer, db.ForeignKey('categoria.id'), nullable=False)
+    palavra = db.Column(db.String(100), nullable=False)
+
 class Transacao(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     descricao = db.Column(db.String(200), nullable=False)
@@ -69,6 +115,84 @@ class Transacao(db.Model):
             'categoria': self.categoria.to_dict() if self.categoria else None
         }
 
+def serializar_transacoes(query, limite=None):
+    """Serializa uma listagem de transações em uma única consulta.
+    
+    Projeta apenas as colunas usadas e faz LEFT JOIN com a categoria, evitando
+    carregar objetos ORM e o lazy load de `categoria` linha a linha. O formato
+    é o mesmo de `Transacao.to_dict`.
+    """
+    linhas = query.outerjoin(Categoria, Transacao.categoria_id == Categoria.id).with_entities(
+        Transacao.id, Transacao.descricao, Transacao.valor, Transacao.data, Transacao.tipo,
+        Categoria.id, Categoria.nome
+    )
+    if limite is not None:
+        linhas = linhas.limit(limite)
+    linhas = linhas.all()
+    
+    # Cada categoria é montada uma vez e compartilhada pelas linhas que a referenciam
+    categorias = {}
+    palavras_chave = espelho_palavras.obter()
+    resultado = []
+    for id_, descricao, valor, data, tipo, categoria_id, nome in linhas:
+        categoria = None
+        if categoria_id is not None:
+            categoria = categorias.get(categoria_id)
+            if categoria is None:
+                categoria = categorias[categoria_id] = {
+                    'id': categoria_id,
+                    'nome': nome,
+                    'palavras_chave': list(palavras_chave.get(categoria_id, []))
+                }
+        resultado.append({
+            'id': id_,
+            'descricao': descricao,
+            'valor': valor,
+            'data': data.strftime('%Y-%m-%d'),
+            'tipo': tipo,
+            'categoria': categoria
+        })
+    return resultado
+
+class ResumoMensal(db.Model):
+    """Totais agregados por mês, tipo e categoria, mantidos junto com cada escrita em transacao"""
+    __tablename__ = 'resumo_mensal'
+    ano_mes = db.Column(db.String(7), primary_key=True)  # 'AAAA-MM'
+    tipo = db.Column(db.String(10), primary_key=True)
+    categoria_id = db.Column(db.Integer, primary_key=True)  # 0 = sem categoria
+    total = db.Column(db.Float, nullable=False, default=0)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+
+def registrar_no_resumo(data, tipo, categoria_id, valor, sinal=1, quantidade=1):
+    """Soma (sinal=1) ou estorna (sinal=-1) uma transação no resumo mensal.
+    Roda na sessão corrente, então entra no mesmo commit da escrita da transação.
+    Para lotes, `valor` e `quantidade` podem trazer a soma de várias transações da mesma chave."""
+    chave = {
+        'ano_mes': data.strftime('%Y-%m'),
+        'tipo': tipo,
+        'categoria_id': categoria_id or 0
+    }
+    comando = insert(ResumoMensal).values(total=valor * sinal, quantidade=quantidade * sinal, **chave)
+    comando = comando.on_conflict_do_update(
+        index_elements=['ano_mes', 'tipo', 'categoria_id'],
+        set_={
+            'total': ResumoMensal.total + valor * sinal,
+            'quantidade': ResumoMensal.quantidade + quantidade * sinal
+        }
+    )
+    db.session.execute(comando)
+    
+    if sinal < 0:
+        db.session.query(ResumoMensal).filter_by(**chave).filter(
+            ResumoMensal.quantidade <= 0
+        ).delete(synchronize_session=False)
+
+def reconstruir_resumo_mensal():
+    """Recalcula o resumo mensal inteiro a partir da tabela transacao (corrige divergências)"""
+    db.session.query(ResumoMensal).delete(synchronize_session=False)
+    db.session.execute(db.text(SQL_RECONSTRUIR_RESUMO))
+    db.session.commit()
+
 # Rotas da API
 @app.route('/')
 def index():
@@ -82,11 +206,79 @@ def dashboard():
 def transacoes():
     return render_template('transacoes.html')
 
+# Paginação por cursor (keyset sobre data, id)
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 500
+
+def codificar_cursor(transacao):
+    """Gera um cursor opaco a partir da posição (data, id) da última transação da página"""
+    bruto = f"{transacao['data']}|{transacao['id']}"
+    return base64.urlsafe_b64encode(bruto.encode()).decode()
+
+def decodificar_cursor(cursor):
+    """Converte o cursor de volta para (data, id); lança ValueError se for inválido"""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor.encode()).decode()
+        data_str, id_str = bruto.split('|')
+        return datetime.strptime(data_str, '%Y-%m-%d').date(), int(id_str)
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+def filtrar_transacoes(query, args):
+    """Aplica os filtros de período, tipo, categoria e faixa de valor vindos da query string"""
+    if args.get('data_inicio'):
+        query = query.filter(Transacao.data >= datetime.strptime(args['data_inicio'], '%Y-%m-%d').date())
+    if args.get('data_fim'):
+        query = query.filter(Transacao.data <= datetime.strptime(args['data_fim'], '%Y-%m-%d').date())
+    if args.get('tipo'):
+        query = query.filter(Transacao.tipo == args['tipo'])
+    if args.get('categoria_id'):
+        query = query.filter(Transacao.categoria_id == int(args['categoria_id']))
+    if args.get('valor_min'):
+        query = query.filter(Transacao.valor >= float(args['valor_min']))
+    if args.get('valor_max'):
+        query = query.filter(Transacao.valor <= float(args['valor_max']))
+    return query
+
 # API Routes
 @app.route('/api/transacoes', methods=['GET'])
+@condicional
 def get_transacoes():
-    transacoes = Transacao.query.order_by(Transacao.data.desc()).all()
-    return jsonify([t.to_dict() for t in transacoes])
+    """Lista transações; com `limite` ou `cursor` responde em páginas com `next_cursor`"""
+    try:
+        query = filtrar_transacoes(Transacao.query, request.args)
+    except ValueError as e:
+        return jsonify({'erro': f'Filtro inválido: {e}'}), 400
+    
+    query = query.order_by(Transacao.data.desc(), Transacao.id.desc())
+    
+    if 'limite' not in request.args and 'cursor' not in request.args:
+        return jsonify(serializar_transacoes(query))
+    
+    limite = request.args.get('limite', LIMITE_PADRAO, type=int)
+    limite = max(1, min(limite, LIMITE_MAXIMO))
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            data_cursor, id_cursor = decodificar_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
+        # Continua exatamente após a última linha entregue, usando o índice em vez de OFFSET
+        query = query.filter(db.or_(
+            Transacao.data < data_cursor,
+            db.and_(Transacao.data == data_cursor, Transacao.id < id_cursor)
+        ))
+    
+    # Busca uma linha a mais para saber se existe próxima página
+    transacoes = serializar_transacoes(query, limite=limite + 1)
+    tem_proxima = len(transacoes) > limite
+    transacoes = transacoes[:limite]
+    
+    return jsonify({
+        'transacoes': transacoes,
+        'next_cursor': codificar_cursor(transacoes[-1]) if tem_proxima else None
+    })
 
 @app.route('/api/transacoes', methods=['POST'])
 def create_transacao():
@@ -104,85 +296,228 @@ def create_transacao():
     )
     
     db.session.add(transacao)
+    registrar_no_resumo(transacao.data, transacao.tipo, transacao.categoria_id, transacao.valor)
     db.session.commit()
+    agendar_indexacao_historico()
     
     return jsonify(transacao.to_dict()), 201
 
+TIPOS_VALIDOS = ('receita', 'despesa')
+LIMITE_LOTE = 50000
+
+@lru_cache(maxsize=4096)
+def converter_data(texto):
+    """'AAAA-MM-DD' -> date; um lote repete poucas datas, então cada uma é convertida uma vez"""
+    return datetime.strptime(texto, '%Y-%m-%d').date()
+
+def validar_transacao(item):
+    """Valida e converte um item de entrada; lança ValueError com o motivo da rejeição"""
+    if not isinstance(item, dict):
+        raise ValueError('Item deve ser um objeto')
+    descricao = item.get('descricao')
+    if not descricao or not isinstance(descricao, str):
+        raise ValueError('Descrição é obrigatória')
+    if item.get('tipo') not in TIPOS_VALIDOS:
+        raise ValueError("Tipo deve ser 'receita' ou 'despesa'")
+    try:
+        valor = float(item['valor'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Valor inválido')
+    try:
+        data = converter_data(item['data'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Data inválida (use AAAA-MM-DD)')
+    return {'descricao': descricao, 'valor': valor, 'data': data, 'tipo': item['tipo']}
+
+@app.route('/api/transacoes/lote', methods=['POST'])
+def create_transacoes_lote():
+    """Cria muitas transações em uma única requisição e uma única transação do banco"""
+    itens = request.get_json(silent=True)
+    if isinstance(itens, dict):
+        itens = itens.get('transacoes')
+    if not isinstance(itens, list):
+        return jsonify({'erro': 'Envie uma lista de transações'}), 400
+    if len(itens) > LIMITE_LOTE:
+        return jsonify({'erro': f'Máximo de {LIMITE_LOTE} transações por lote'}), 400
+    
+    resultados = [None] * len(itens)
+    validos = []
+    indices_validos = []
+    for indice, item in enumerate(itens):
+        try:
+            validos.append(validar_transacao(item))
+            indices_validos.append(indice)
+        except ValueError as e:
+            resultados[indice] = {'indice': indice, 'erro': str(e)}
+    
+    if validos:
+        # Cada descrição distinta é classificada uma única vez, só pelas palavras-chave:
+        # as que ficarem sem categoria passam pelo histórico no job de reclassificação
+        categorias = classificar_categorias_lote([t['descricao'] for t in validos], historico=False)
+        totais_resumo = {}
+        for transacao in validos:
+            transacao['categoria_id'] = categorias[transacao['descricao']]
+            chave = (transacao['data'].replace(day=1), transacao['tipo'], transacao['categoria_id'])
+            total, quantidade = totais_resumo.get(chave, (0.0, 0))
+            totais_resumo[chave] = (total + transacao['valor'], quantidade + 1)
+        
+        # INSERT com executemany; RETURNING devolve os ids na ordem dos parâmetros.
+        # Pela tabela (Core): o insert do ORM separa as linhas em grupos a cada troca
+        # entre categoria_id None e preenchido e junta os RETURNING de todos os grupos
+        tabela = Transacao.__table__
+        ids = db.session.execute(
+            insert(tabela).returning(tabela.c.id, sort_by_parameter_order=True),
+            validos
+        ).scalars().all()
+        
+        for (data_mes, tipo, categoria_id), (total, quantidade) in totais_resumo.items():
+            registrar_no_resumo(data_mes, tipo, categoria_id, total, quantidade=quantidade)
+        
+        db.session.commit()
+        agendar_indexacao_historico()
+        if any(transacao['categoria_id'] is None for transacao in validos):
+            job_reclassificacao.iniciar(continuar=True)
+        
+        for indice, id_ in zip(indices_validos, ids):
+            resultados[indice] = {'indice': indice, 'id': id_}
+    
+    return jsonify({
+        'inseridas': len(validos),
+        'rejeitadas': len(itens) - len(validos),
+        'resultados': resultados
+    }), 201 if validos else 400
+
 @app.route('/api/transacoes/<int:id>', methods=['PUT'])
 def update_transacao(id):
     transacao = Transacao.query.get_or_404(id)
     data = request.get_json()
     
+    # Classifica antes de escrever: o classificador usa outra conexão e não
+    # deve esperar pelo lock de escrita desta sessão
+    categoria_id = classificar_categoria(data['descricao'])
+    
+    # Estorna os valores antigos antes de aplicar os novos
+    registrar_no_resumo(transacao.data, transacao.tipo, transacao.categoria_id, transacao.valor, sinal=-1)
+    
     transacao.descricao = data['descricao']
     transacao.valor = float(data['valor'])
     transacao.data = datetime.strptime(data['data'], '%Y-%m-%d').date()
     transacao.tipo = data['tipo']
-    transacao.categoria_id = classificar_categoria(data['descricao'])
+    transacao.categoria_id = categoria_id
+    registrar_no_resumo(transacao.data, transacao.tipo, transacao.categoria_id, transacao.valor)
     
     db.session.commit()
+    agendar_indexacao_historico()
     
     return jsonify(transacao.to_dict())
 
 @app.route('/api/transacoes/<int:id>', methods=['DELETE'])
 def delete_transacao(id):
     transacao = Transacao.query.get_or_404(id)
+    registrar_no_resumo(transacao.data, transacao.tipo, transacao.categoria_id, transacao.valor, sinal=-1)
     db.session.delete(transacao)
     db.session.commit()
     
     return '', 204
 
 @app.route('/api/categorias', methods=['GET'])
+@condicional
 def get_categorias():
     categorias = Categoria.query.all()
     return jsonify([c.to_dict() for c in categorias])
 
-@app.route('/api/dashboard/resumo', methods=['GET'])
-def get_resumo():
-    # Total de receitas e despesas do mês atual
-    hoje = datetime.now().date()
-    primeiro_dia_mes = hoje.replace(day=1)
-    
-    receitas_mes = db.session.query(db.func.sum(Transacao.valor)).filter(
-        Transacao.tipo == 'receita',
-        Transacao.data >= primeiro_dia_mes
-    ).scalar() or 0
+def calcular_resumo_mes():
+    """Total de receitas e despesas do mês atual, lido do resumo mensal"""
+    ano_mes_atual = datetime.now().strftime('%Y-%m')
     
-    despesas_mes = db.session.query(db.func.sum(Transacao.valor)).filter(
-        Transacao.tipo == 'despesa',
-        Transacao.data >= primeiro_dia_mes
-    ).scalar() or 0
+    totais = dict(db.session.query(
+        ResumoMensal.tipo,
+        db.func.sum(ResumoMensal.total)
+    ).filter(
+        ResumoMensal.ano_mes >= ano_mes_atual
+    ).group_by(ResumoMensal.tipo).all())
     
-    saldo_mes = receitas_mes - despesas_mes
+    receitas_mes = totais.get('receita') or 0
+    despesas_mes = totais.get('despesa') or 0
     
-    return jsonify({
+    return {
         'receitas_mes': receitas_mes,
         'despesas_mes': despesas_mes,
-        'saldo_mes': saldo_mes
-    })
+        'saldo_mes': receitas_mes - despesas_mes
+    }
 
-@app.route('/api/dashboard/gastos-por-categoria', methods=['GET'])
-def get_gastos_por_categoria():
-    hoje = datetime.now().date()
-    primeiro_dia_mes = hoje.replace(day=1)
+def calcular_gastos_por_categoria():
+    """Despesas do mês atual agrupadas por nome de categoria"""
+    ano_mes_atual = datetime.now().strftime('%Y-%m')
     
     gastos = db.session.query(
         Categoria.nome,
-        db.func.sum(Transacao.valor).label('total')
-    ).join(Transacao).filter(
-        Transacao.tipo == 'despesa',
-        Transacao.data >= primeiro_dia_mes
+        db.func.sum(ResumoMensal.total).label('total')
+    ).join(ResumoMensal, ResumoMensal.categoria_id == Categoria.id).filter(
+        ResumoMensal.tipo == 'despesa',
+        ResumoMensal.ano_mes >= ano_mes_atual
     ).group_by(Categoria.nome).all()
     
-    return jsonify([{'categoria': g.nome, 'total': g.total} for g in gastos])
+    return [{'categoria': g.nome, 'total': g.total} for g in gastos]
+
+def calcular_gastos_mensais(meses=12):
+    """Série das despesas totais dos últimos `meses` meses com movimento, em ordem cronológica"""
+    serie = db.session.query(
+        ResumoMensal.ano_mes,
+        db.func.sum(ResumoMensal.total)
+    ).filter(
+        ResumoMensal.tipo == 'despesa'
+    ).group_by(ResumoMensal.ano_mes).order_by(ResumoMensal.ano_mes.desc()).limit(meses).all()
+    
+    return [{'mes': ano_mes, 'total': total} for ano_mes, total in reversed(serie)]
+
+@app.route('/api/dashboard/resumo', methods=['GET'])
+@condicional
+def get_resumo():
+    return jsonify(calcular_resumo_mes())
+
+@app.route('/api/dashboard/gastos-por-categoria', methods=['GET'])
+@condicional
+def get_gastos_por_categoria():
+    return jsonify(calcular_gastos_por_categoria())
+
+@app.route('/api/dashboard/snapshot', methods=['GET'])
+@condicional
+def get_dashboard_snapshot():
+    """Retorna tudo que o dashboard precisa em uma única requisição"""
+    ultimas = max(1, min(request.args.get('ultimas', 5, type=int), LIMITE_MAXIMO))
+    meses = max(1, min(request.args.get('meses', 12, type=int), 120))
+    
+    recentes = Transacao.query.order_by(Transacao.data.desc(), Transacao.id.desc())
+    
+    return jsonify({
+        'resumo': calcular_resumo_mes(),
+        'gastos_por_categoria': calcular_gastos_por_categoria(),
+        'ultimas_transacoes': serializar_transacoes(recentes, limite=ultimas),
+        'gastos_mensais': calcular_gastos_mensais(meses)
+    })
+
+# Previsões e padrões servidos do cache; recalculados em segundo plano quando os dados mudam
+resultados_ml = CacheRevalidacao(versao_dados.etag)
+
+def resultado_ml(chave, calcular):
+    """(valor, cabeçalhos): Age com a idade do valor e, se ele for de uma
+    versão anterior dos dados, X-Resultado-Desatualizado"""
+    valor, idade, atualizado = resultados_ml.obter(chave, calcular)
+    cabecalhos = {'Age': str(int(idade))}
+    if not atualizado:
+        cabecalhos['X-Resultado-Desatualizado'] = '1'
+    return valor, cabecalhos
 
 # Novas rotas para Machine Learning
 @app.route('/api/ml/previsao', methods=['GET'])
+@condicional
 def get_previsao_gastos():
     """Retorna previsão de gastos para o próximo mês"""
     try:
-        previsao = obter_previsao_gastos()
+        previsao, cabecalhos = resultado_ml('previsao', obter_previsao_gastos)
         if previsao:
-            return jsonify(previsao)
+            return jsonify(previsao), cabecalhos
         else:
             return jsonify({
                 'erro': 'Dados insuficientes para previsão',
@@ -190,32 +525,78 @@ def get_previsao_gastos():
                 'minimo': 0,
                 'maximo': 0,
                 'confianca': 0
-            })
+            }), cabecalhos
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
 @app.route('/api/ml/previsao-multipla', methods=['GET'])
+@condicional
 def get_previsao_multipla():
     """Retorna previsões para múltiplos meses"""
     try:
         meses = request.args.get('meses', 3, type=int)
-        previsoes = obter_multiplas_previsoes(meses)
-        return jsonify(previsoes)
+        previsoes, cabecalhos = resultado_ml(('previsao-multipla', meses), lambda: obter_multiplas_previsoes(meses))
+        return jsonify(previsoes), cabecalhos
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/ml/previsao-por-categoria', methods=['GET'])
+@condicional
+def get_previsao_por_categoria():
+    """Retorna a previsão do próximo mês para cada categoria"""
+    try:
+        previsao = obter_previsao_por_categoria()
+        if previsao:
+            return jsonify(previsao)
+        else:
+            return jsonify({'erro': 'Dados insuficientes para previsão', 'categorias': []})
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
 @app.route('/api/ml/padroes', methods=['GET'])
+@condicional
 def get_padroes_gastos():
     """Retorna análise de padrões de gastos"""
     try:
-        padroes = analisar_padroes()
+        padroes, cabecalhos = resultado_ml('padroes', analisar_padroes)
         if padroes:
-            return jsonify(padroes)
+            return jsonify(padroes), cabecalhos
+        else:
+            return jsonify({'erro': 'Dados insuficientes para análise'}), cabecalhos
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/ml/estatisticas-classificacao', methods=['GET'])
+def get_estatisticas_classificacao():
+    """Retorna estatísticas da classificação automática e do cache de classificações"""
+    try:
+        estatisticas = obter_estatisticas_classificacao()
+        if estatisticas:
+            return jsonify(estatisticas)
         else:
-            return jsonify({'erro': 'Dados insuficientes para análise'})
+            return jsonify({'erro': 'Estatísticas indisponíveis'}), 500
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
+@app.route('/api/ml/classificar-lote', methods=['POST'])
+def classificar_descricoes_lote():
+    """Classifica uma lista de descrições; os resultados voltam na ordem de entrada"""
+    descricoes = request.get_json(silent=True)
+    if isinstance(descricoes, dict):
+        descricoes = descricoes.get('descricoes')
+    if not isinstance(descricoes, list) or not all(isinstance(d, str) for d in descricoes):
+        return jsonify({'erro': 'Envie uma lista de descrições'}), 400
+    if len(descricoes) > LIMITE_LOTE:
+        return jsonify({'erro': f'Máximo de {LIMITE_LOTE} descrições por lote'}), 400
+    
+    categorias = classificar_categorias_lote(descricoes)
+    return jsonify({
+        'resultados': [
+            {'descricao': descricao, 'categoria_id': categorias[descricao]}
+            for descricao in descricoes
+        ]
+    })
+
 @app.route('/api/ml/sugestoes-categoria', methods=['POST'])
 def get_sugestoes_categoria():
     """Retorna sugestões de categoria para uma descrição"""
@@ -242,10 +623,10 @@ def treinar_classificador(categoria_id):
             return jsonify({'erro': 'Descrição é obrigatória'}), 400
         
         # Importar aqui para evitar erro se módulo não estiver disponível
-        from classificador import ClassificadorCategorias
-        classificador = ClassificadorCategorias()
+        from classificador import treinar_categoria
         
-        sucesso = classificador.treinar_classificador(descricao, categoria_id)
+        # Treina a instância compartilhada, sem reconstruí-la na próxima requisição
+        sucesso = treinar_categoria(descricao, categoria_id)
         
         if sucesso:
             return jsonify({'mensagem': 'Classificador treinado com sucesso'})
@@ -257,6 +638,18 @@ def treinar_classificador(categoria_id):
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
+def carregar_palavras_chave():
+    """Lista (categoria_id, palavras em minúsculas) usada no fallback de classificação"""
+    return espelho_palavras.obter_para_busca()
+
+def buscar_por_palavras_chave(descricao, palavras_por_categoria):
+    descricao_lower = descricao.lower()
+    for categoria_id, palavras in palavras_por_categoria:
+        for palavra in palavras:
+            if palavra in descricao_lower:
+                return categoria_id
+    return None
+
 def classificar_categoria(descricao):
     """Classifica automaticamente a categoria baseada na descrição"""
     # Usar o sistema de ML para classificação
@@ -265,21 +658,57 @@ def classificar_categoria(descricao):
         return categoria_id
     
     # Fallback para o sistema anterior
-    descricao_lower = descricao.lower()
-    
-    categorias = Categoria.query.all()
-    for categoria in categorias:
-        if categoria.palavras_chave:
-            palavras = json.loads(categoria.palavras_chave)
-            for palavra in palavras:
-                if palavra.lower() in descricao_lower:
-                    return categoria.id
+    return buscar_por_palavras_chave(descricao, carregar_palavras_chave())
+
+def classificar_categorias_lote(descricoes, historico=True):
+    """Classifica várias descrições de uma vez; retorna {descricao: categoria_id}.
+    O classificador recebe o lote inteiro e passa cada descrição normalizada
+    distinta uma única vez pelos seus estágios."""
+    unicas = list(dict.fromkeys(descricoes))
     
-    return None  # Sem categoria definida
+    palavras_por_categoria = None
+    resultado = {}
+    for descricao, categoria_id in zip(unicas, classificar_lote(unicas, historico)):
+        if not categoria_id:
+            if palavras_por_categoria is None:
+                palavras_por_categoria = carregar_palavras_chave()
+            categoria_id = buscar_por_palavras_chave(descricao, palavras_por_categoria)
+        resultado[descricao] = categoria_id
+    return resultado
+
+def reclassificar_descricoes(descricoes):
+    """Classificação usada pelo job de reclassificação (roda fora de requisição)"""
+    with app.app_context():
+        categorias = classificar_categorias_lote(descricoes)
+    return [categorias[descricao] for descricao in descricoes]
+
+job_reclassificacao = JobReclassificacao(reclassificar_descricoes, apos_lote=agendar_indexacao_historico)
+
+@app.route('/api/ml/reclassificacao', methods=['POST'])
+def iniciar_reclassificacao():
+    """Classifica em segundo plano as transações sem categoria.
+    Continua do checkpoint; {"reiniciar": true} recomeça do início."""
+    data = request.get_json(silent=True) or {}
+    if not job_reclassificacao.iniciar(reiniciar=bool(data.get('reiniciar'))):
+        return jsonify({'erro': 'Reclassificação já em andamento', **job_reclassificacao.status()}), 409
+    return jsonify(job_reclassificacao.status()), 202
+
+@app.route('/api/ml/reclassificacao', methods=['GET'])
+def get_reclassificacao():
+    """Progresso da reclassificação: estado, último id, linhas processadas e pendentes"""
+    return jsonify(job_reclassificacao.status())
+
+@app.route('/api/ml/reclassificacao', methods=['DELETE'])
+def cancelar_reclassificacao():
+    """Pede a parada após o lote atual; o checkpoint permite continuar depois"""
+    if not job_reclassificacao.cancelar():
+        return jsonify({'erro': 'Nenhuma reclassificação em andamento'}), 409
+    return jsonify(job_reclassificacao.status()), 202
 
 def init_database():
     """Inicializa o banco com dados básicos"""
     db.create_all()
+    aplicar_migracoes(db.engine)
     
     # Criar categorias padrão se não existirem
     if Categoria.query.count() == 0:
@@ -295,13 +724,18 @@ def init_database():
         ]
         
         for cat_data in categorias_default:
-            categoria = Categoria(
-                nome=cat_data['nome'],
-                palavras_chave=json.dumps(cat_data['palavras_chave'])
-            )
+            categoria = Categoria(nome=cat_data['nome'])
             db.session.add(categoria)
+            db.session.flush()
+            db.session.add_all(
+                PalavraChave(categoria_id=categoria.id, palavra=palavra)
+                for palavra in cat_data['palavras_chave']
+            )
         
         db.session.commit()
+    
+    # Trigramas do histórico pendentes (ex.: logo após a migração 4)
+    indexar_historico()
 
 if __name__ == '__main__':
     init_database()
@@ -0,0 +1,244 @@
+"""
+Migrações versionadas do banco de dados
+Sistema Web de Controle de Gastos Pessoais
+
+A versão do esquema é guardada em `PRAGMA user_version`; cada migração roda
+uma única vez e só acrescenta estruturas, sem tocar nos dados existentes.
+"""
+
+# Recalcula o resumo mensal (tabela resumo_mensal) a partir das transações
+SQL_RECONSTRUIR_RESUMO = """
+    INSERT INTO resumo_mensal (ano_mes, tipo, categoria_id, total, quantidade)
+    SELECT strftime('%Y-%m', data), tipo, IFNULL(categoria_id, 0), SUM(valor), COUNT(*)
+    FROM transacao
+    GROUP BY strftime('%Y-%m', data), tipo, IFNULL(categoria_id, 0)
+"""
+
+# (versão, descrição, comandos SQL)
+MIGRACOES = [
+    (1, 'Índices compostos para as consultas mais frequentes', [
+        "CREATE INDEX IF NOT EXISTS ix_transacao_tipo_data ON transacao (tipo, data)",
+        "CREATE INDEX IF NOT EXISTS ix_transacao_categoria_data ON transacao (categoria_id, data)",
+        "CREATE INDEX IF NOT EXISTS ix_transacao_descricao_categoria ON transacao (descricao, categoria_id)",
+        "CREATE INDEX IF NOT EXISTS ix_transacao_data_id ON transacao (data, id)",
+    ]),
+    (2, 'Resumo mensal materializado para o dashboard', [
+        """CREATE TABLE IF NOT EXISTS resumo_mensal (
+            ano_mes VARCHAR(7) NOT NULL,
+            tipo VARCHAR(10) NOT NULL,
+            categoria_id INTEGER NOT NULL,
+            total FLOAT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            PRIMARY KEY (ano_mes, tipo, categoria_id)
+        )""",
+        "DELETE FROM resumo_mensal",
+        SQL_RECONSTRUIR_RESUMO,
+    ]),
+    (3, 'Carimbo de versão das categorias para invalidar o classificador', [
+        """CREATE TABLE IF NOT EXISTS versao_categorias (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            versao INTEGER NOT NULL
+        )""",
+        "INSERT OR IGNORE INTO versao_categorias (id, versao) VALUES (1, 0)",
+        """CREATE TRIGGER IF NOT EXISTS tg_categoria_insert AFTER INSERT ON categoria
+           BEGIN UPDATE versao_categorias SET versao = versao + 1 WHERE id = 1; END""",
+        """CREATE TRIGGER IF NOT EXISTS tg_categoria_update AFTER UPDATE ON categoria
+           BEGIN UPDATE versao_categorias SET versao = versao + 1 WHERE id = 1; END""",
+        """CREATE TRIGGER IF NOT EXISTS tg_categoria_delete AFTER DELETE ON categoria
+           BEGIN UPDATE versao_categorias SET versao = versao + 1 WHERE id = 1; END""",
+    ]),
+    (4, 'Histórico de descrições categorizadas com índice de trigramas', [
+        # Frequência de cada (descrição, categoria), mantida pelos triggers abaixo.
+        # descricao_limpa/tamanho ficam NULL até o classificador indexar a linha.
+        """CREATE TABLE IF NOT EXISTS historico_descricao (
+            id INTEGER PRIMARY KEY,
+            descricao VARCHAR(200) NOT NULL,
+            categoria_id INTEGER NOT NULL,
+            frequencia INTEGER NOT NULL,
+            descricao_limpa TEXT,
+            tamanho INTEGER,
+            UNIQUE (descricao, categoria_id)
+        )""",
+        # tamanho repetido na chave: o filtro de tamanho vira busca por faixa no índice
+        """CREATE TABLE IF NOT EXISTS historico_trigrama (
+            trigrama TEXT NOT NULL,
+            tamanho INTEGER NOT NULL,
+            historico_id INTEGER NOT NULL,
+            PRIMARY KEY (trigrama, tamanho, historico_id)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS ix_historico_trigrama_id ON historico_trigrama (historico_id)",
+        # Em quantas descrições cada trigrama aparece: a busca começa pelos mais raros
+        """CREATE TABLE IF NOT EXISTS trigrama_frequencia (
+            trigrama TEXT PRIMARY KEY,
+            documentos INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+        """CREATE TRIGGER IF NOT EXISTS tg_trigrama_delete AFTER DELETE ON historico_trigrama
+           BEGIN
+               UPDATE trigrama_frequencia SET documentos = documentos - 1 WHERE trigrama = OLD.trigrama;
+           END""",
+        """CREATE INDEX IF NOT EXISTS ix_historico_pendente ON historico_descricao (id)
+           WHERE descricao_limpa IS NULL""",
+        """CREATE TRIGGER IF NOT EXISTS tg_historico_delete AFTER DELETE ON historico_descricao
+           BEGIN DELETE FROM historico_trigrama WHERE historico_id = OLD.id; END""",
+        """CREATE TRIGGER IF NOT EXISTS tg_transacao_historico_insert AFTER INSERT ON transacao
+           WHEN NEW.categoria_id IS NOT NULL
+           BEGIN
+               INSERT INTO historico_descricao (descricao, categoria_id, frequencia)
+               VALUES (NEW.descricao, NEW.categoria_id, 1)
+               ON CONFLICT (descricao, categoria_id) DO UPDATE SET frequencia = frequencia + 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS tg_transacao_historico_delete AFTER DELETE ON transacao
+           WHEN OLD.categoria_id IS NOT NULL
+           BEGIN
+               UPDATE historico_descricao SET frequencia = frequencia - 1
+               WHERE descricao = OLD.descricao AND categoria_id = OLD.categoria_id;
+               DELETE FROM historico_descricao
+               WHERE descricao = OLD.descricao AND categoria_id = OLD.categoria_id AND frequencia <= 0;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS tg_transacao_historico_update
+           AFTER UPDATE OF descricao, categoria_id ON transacao
+           BEGIN
+               UPDATE historico_descricao SET frequencia = frequencia - 1
+               WHERE descricao = OLD.descricao AND categoria_id = OLD.categoria_id;
+               DELETE FROM historico_descricao
+               WHERE descricao = OLD.descricao AND categoria_id = OLD.categoria_id AND frequencia <= 0;
+               INSERT INTO historico_descricao (descricao, categoria_id, frequencia)
+               SELECT NEW.descricao, NEW.categoria_id, 1 WHERE NEW.categoria_id IS NOT NULL
+               ON CONFLICT (descricao, categoria_id) DO UPDATE SET frequencia = frequencia + 1;
+           END""",
+        "DELETE FROM historico_trigrama",
+        "DELETE FROM trigrama_frequencia",
+        "DELETE FROM historico_descricao",
+        """INSERT INTO historico_descricao (descricao, categoria_id, frequencia)
+           SELECT descricao, categoria_id, COUNT(*) FROM transacao
+           WHERE categoria_id IS NOT NULL
+           GROUP BY descricao, categoria_id""",
+    ]),
+    (5, 'Checkpoint da reclassificação em lote de transações sem categoria', [
+        """CREATE INDEX IF NOT EXISTS ix_transacao_sem_categoria ON transacao (id)
+           WHERE categoria_id IS NULL""",
+        """CREATE TABLE IF NOT EXISTS reclassificacao_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            ultimo_id INTEGER NOT NULL,
+            estado VARCHAR(20) NOT NULL,
+            processadas INTEGER NOT NULL,
+            classificadas INTEGER NOT NULL,
+            atualizado_em VARCHAR(19) NOT NULL
+        )""",
+        "DELETE FROM reclassificacao_checkpoint",
+    ]),
+    (6, 'Palavras-chave das categorias em tabela própria', [
+        """CREATE TABLE IF NOT EXISTS categoria_palavra (
+            id INTEGER PRIMARY KEY,
+            categoria_id INTEGER NOT NULL REFERENCES categoria (id),
+            palavra VARCHAR(100) NOT NULL,
+            UNIQUE (categoria_id, palavra)
+        )""",
+        # Mantém a ordem das listas JSON: o id crescente é a ordem de cada categoria
+        """INSERT OR IGNORE INTO categoria_palavra (categoria_id, palavra)
+           SELECT c.id, j.value FROM categoria c, json_each(c.palavras_chave) j
+           WHERE json_valid(c.palavras_chave) AND j.type = 'text'
+           ORDER BY c.id, j.key""",
+        """CREATE TRIGGER IF NOT EXISTS tg_categoria_palavra_insert AFTER INSERT ON categoria_palavra
+           BEGIN UPDATE versao_categorias SET versao = versao + 1 WHERE id = 1; END""",
+        """CREATE TRIGGER IF NOT EXISTS tg_categoria_palavra_update AFTER UPDATE ON categoria_palavra
+           BEGIN UPDATE versao_categorias SET versao = versao + 1 WHERE id = 1; END""",
+        """CREATE TRIGGER IF NOT EXISTS tg_categoria_palavra_delete AFTER DELETE ON categoria_palavra
+           BEGIN UPDATE versao_categorias SET versao = versao + 1 WHERE id = 1; END""",
+        """CREATE TRIGGER IF NOT EXISTS tg_categoria_delete_palavras AFTER DELETE ON categoria
+           BEGIN DELETE FROM categoria_palavra WHERE categoria_id = OLD.id; END""",
+    ]),
+    (7, 'Versão dos dados no banco, compartilhada entre processos (ETags)', [
+        # token aleatório por banco: ETags de um banco recriado nunca coincidem
+        """CREATE TABLE IF NOT EXISTS versao_dados (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            token VARCHAR(16) NOT NULL,
+            versao INTEGER NOT NULL,
+            modificado_em VARCHAR(19) NOT NULL
+        )""",
+        """INSERT OR IGNORE INTO versao_dados (id, token, versao, modificado_em)
+           VALUES (1, lower(hex(randomblob(8))), 0, datetime('now'))""",
+        *[
+            f"""CREATE TRIGGER IF NOT EXISTS tg_versao_dados_{tabela}_{operacao.lower()}
+                AFTER {operacao} ON {tabela}
+                BEGIN
+                    UPDATE versao_dados SET versao = versao + 1, modificado_em = datetime('now') WHERE id = 1;
+                END"""
+            for tabela in ('transacao', 'categoria', 'categoria_palavra')
+            for operacao in ('INSERT', 'UPDATE', 'DELETE')
+        ],
+    ]),
+]
+
+# Nomes (e apelidos) pelos quais a tabela transacao aparece nos planos
+NOMES_TRANSACAO = ('transacao', 't')
+
+# Consultas que não podem cair em varredura completa da tabela transacao nem
+# ordenar todas as linhas encontradas antes do LIMIT
+CONSULTAS_FREQUENTES = {
+    'resumo_mes': (
+        "SELECT SUM(valor) FROM transacao WHERE tipo = ? AND data >= ?",
+        ('despesa', '2025-01-01')
+    ),
+    'gastos_por_categoria': (
+        """SELECT c.nome, SUM(t.valor) FROM categoria c JOIN transacao t ON c.id = t.categoria_id
+           WHERE t.tipo = ? AND t.data >= ? GROUP BY c.nome""",
+        ('despesa', '2025-01-01')
+    ),
+    'carregar_dados_previsao': (
+        """SELECT strftime('%Y-%m', data) AS ano_mes, SUM(valor), COUNT(*) FROM transacao
+           WHERE tipo = ? GROUP BY strftime('%Y-%m', data) ORDER BY ano_mes""",
+        ('despesa',)
+    ),
+    'padroes_por_categoria': (
+        """SELECT c.nome, AVG(t.valor), SUM(t.valor), COUNT(t.id) FROM transacao t
+           JOIN categoria c ON t.categoria_id = c.id WHERE t.tipo = ? GROUP BY c.nome""",
+        ('despesa',)
+    ),
+    'reclassificacao_pendentes': (
+        """SELECT id, descricao FROM transacao INDEXED BY ix_transacao_sem_categoria
+           WHERE categoria_id IS NULL AND id > ? ORDER BY id LIMIT ?""",
+        (0, 500)
+    ),
+    'listagem_paginada': (
+        "SELECT id FROM transacao WHERE data < ? OR (data = ? AND id < ?) ORDER BY data DESC, id DESC LIMIT 50",
+        ('2025-01-01', '2025-01-01', 1000)
+    ),
+}
+
+
+def versao_esquema(conn):
+    """Retorna a versão atual do esquema gravada no banco"""
+    return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def aplicar_migracoes(engine):
+    """Aplica, em ordem, as migrações ainda não executadas. Retorna as versões aplicadas"""
+    aplicadas = []
+    for versao, descricao, comandos in MIGRACOES:
+        with engine.begin() as conn:
+            if versao_esquema(conn) >= versao:
+                continue
+            for comando in comandos:
+                conn.exec_driver_sql(comando)
+            conn.exec_driver_sql(f'PRAGMA user_version = {int(versao)}')
+        aplicadas.append(versao)
+    return aplicadas
+
+
+def verificar_planos_consulta(engine):
+    """Roda EXPLAIN QUERY PLAN nas consultas frequentes.
+    Retorna a lista de consultas que fazem varredura completa em transacao
+    ou que precisam de uma B-tree temporária para o ORDER BY."""
+    problemas = []
+    with engine.connect() as conn:
+        for nome, (sql, parametros) in CONSULTAS_FREQUENTES.items():
+            plano = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', parametros).fetchall()
+            for linha in plano:
+                detalhe = linha[-1]
+                partes = detalhe.split()
+                if partes[0] == 'SCAN' and partes[1] in NOMES_TRANSACAO and 'INDEX' not in detalhe:
+                    problemas.append({'consulta': nome, 'plano': detalhe})
+                elif detalhe.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in detalhe:
+                    problemas.append({'consulta': nome, 'plano': detalhe})
+    return problemas
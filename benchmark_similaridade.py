@@ -0,0 +1,67 @@
+"""
+Micro-benchmark da busca por similaridade de palavras-chave
+Compara a varredura com SequenceMatcher em todas as palavras com o IndiceSimilaridade.
+
+Uso: python benchmark_similaridade.py
+"""
+
+import os
+import random
+import string
+import sys
+import time
+from difflib import SequenceMatcher
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'ml'))
+
+from indice_similaridade import IndiceSimilaridade
+
+MINIMO = 0.6
+QUANTIDADES = (50, 200, 1000, 5000)
+CONSULTAS = 200
+
+
+def varredura(palavras, texto):
+    melhor_razao, melhor = 0, None
+    for palavra, valor in palavras:
+        razao = SequenceMatcher(None, texto, palavra).ratio()
+        if razao > melhor_razao and razao > MINIMO:
+            melhor_razao, melhor = razao, valor
+    return melhor
+
+
+def gerar_palavra(aleatorio):
+    return ''.join(aleatorio.choice(string.ascii_lowercase) for _ in range(aleatorio.randint(3, 12)))
+
+
+def cronometrar(funcao, consultas):
+    inicio = time.perf_counter()
+    resultados = [funcao(texto) for texto in consultas]
+    return (time.perf_counter() - inicio) / len(consultas) * 1000, resultados
+
+
+def main():
+    aleatorio = random.Random(42)
+    print(f"{'palavras':>9} {'varredura (ms)':>15} {'índice (ms)':>12} {'ganho':>7}")
+    for quantidade in QUANTIDADES:
+        # Até 50 palavras por categoria, como após vários treinamentos
+        palavras = [(gerar_palavra(aleatorio), i // 50) for i in range(quantidade)]
+        indice = IndiceSimilaridade(palavras)
+
+        # Metade das consultas são descrições de transação, metade palavras com erro de digitação
+        consultas = []
+        for _ in range(CONSULTAS // 2):
+            consultas.append(' '.join(gerar_palavra(aleatorio) for _ in range(aleatorio.randint(2, 4))))
+            palavra = list(aleatorio.choice(palavras)[0])
+            palavra[aleatorio.randrange(len(palavra))] = aleatorio.choice(string.ascii_lowercase)
+            consultas.append(''.join(palavra))
+
+        tempo_varredura, esperado = cronometrar(lambda texto: varredura(palavras, texto), consultas)
+        tempo_indice, obtido = cronometrar(lambda texto: indice.melhor(texto, MINIMO), consultas)
+        assert obtido == esperado, 'índice divergiu da varredura'
+
+        print(f"{quantidade:>9} {tempo_varredura:>15.3f} {tempo_indice:>12.3f} {tempo_varredura / tempo_indice:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Automato de Aho-Corasick para busca de várias palavras-chave de uma vez
+Sistema Web de Controle de Gastos Pessoais
+"""
+
+from collections import deque
+
+
+class AutomatoAhoCorasick:
+    """Encontra, em uma única passada pelo texto, quais padrões aparecem como substring.
+    
+    Equivale a testar `padrao in texto` para cada padrão, mas com custo
+    proporcional ao tamanho do texto em vez de padrões × texto.
+    """
+    
+    def __init__(self, padroes=()):
+        self._transicoes = [{}]
+        self._falha = [0]
+        self._saidas = [()]
+        self._construido = False
+        for padrao in padroes:
+            self.adicionar(padrao)
+    
+    def adicionar(self, padrao):
+        if not padrao:
+            raise ValueError('Padrão vazio não pode ser adicionado ao automato')
+        estado = 0
+        for caractere in padrao:
+            proximo = self._transicoes[estado].get(caractere)
+            if proximo is None:
+                proximo = len(self._transicoes)
+                self._transicoes[estado][caractere] = proximo
+                self._transicoes.append({})
+                self._falha.append(0)
+                self._saidas.append(())
+            estado = proximo
+        if padrao not in self._saidas[estado]:
+            self._saidas[estado] = self._saidas[estado] + (padrao,)
+        self._construido = False
+    
+    def construir(self):
+        """Calcula os links de falha (BFS); chamado automaticamente na primeira busca"""
+        fila = deque()
+        for estado in self._transicoes[0].values():
+            self._falha[estado] = 0
+            fila.append(estado)
+        
+        while fila:
+            atual = fila.popleft()
+            for caractere, proximo in self._transicoes[atual].items():
+                fila.append(proximo)
+                falha = self._falha[atual]
+                while falha and caractere not in self._transicoes[falha]:
+                    falha = self._falha[falha]
+                destino = self._transicoes[falha].get(caractere, 0)
+                self._falha[proximo] = destino if destino != proximo else 0
+                # Padrões que terminam no estado de falha também terminam aqui
+                self._saidas[proximo] = self._saidas[proximo] + self._saidas[self._falha[proximo]]
+        
+        self._construido = True
+    
+    def buscar(self, texto):
+        """Retorna o conjunto de padrões que ocorrem em `texto`"""
+        if not self._construido:
+            self.construir()
+        
+        transicoes = self._transicoes
+        falha = self._falha
+        saidas = self._saidas
+        encontrados = set()
+        estado = 0
+        for caractere in texto:
+            while estado and caractere not in transicoes[estado]:
+                estado = falha[estado]
+            estado = transicoes[estado].get(caractere, 0)
+            if saidas[estado]:
+                encontrados.update(saidas[estado])
+        return encontrados
@@ -0,0 +1,156 @@
+"""
+Acesso ao banco SQLite compartilhado pelo Flask e pelos módulos de ML
+Sistema Web de Controle de Gastos Pessoais
+
+Centraliza três coisas que antes cada módulo fazia por conta própria:
+- resolução do caminho do banco (sempre absoluto, independente do diretório atual);
+- PRAGMAs de desempenho (WAL, synchronous=NORMAL, mmap e cache);
+- um pool pequeno de conexões sqlite3 já configuradas, em vez de um connect() por chamada.
+
+O servidor do Werkzeug atende cada requisição numa thread nova, então guardar
+a conexão só na thread não a reaproveitaria. A thread pega uma conexão do
+pool no primeiro obter_conexao() e a usa até devolver_conexoes(), chamado no
+fim de cada requisição (teardown do backend) e de cada job; se a thread
+terminar antes disso, a conexão volta ao pool sozinha.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+
+RAIZ_PROJETO = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Onde o backend sempre gravou o banco: 'sqlite:///database/controle_gastos.db'
+# era resolvido pelo Flask-SQLAlchemy a partir da pasta instance do backend
+CAMINHO_PADRAO = os.path.join(RAIZ_PROJETO, 'backend', 'instance', 'database', 'controle_gastos.db')
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',       # leitores não bloqueiam o escritor
+    'PRAGMA synchronous = NORMAL',     # seguro com WAL e bem menos fsyncs
+    'PRAGMA mmap_size = 268435456',    # 256 MB mapeados em memória
+    'PRAGMA cache_size = -32000',      # ~32 MB de cache de páginas
+    'PRAGMA busy_timeout = 5000',
+)
+
+# Conexões ociosas mantidas por banco; as que sobram são fechadas ao serem devolvidas
+TAMANHO_POOL = 8
+
+_local = threading.local()
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def resolver_caminho_db(caminho=None):
+    """Retorna o caminho absoluto do banco.
+    
+    Ordem: caminho explícito, variável DATABASE_URL (sqlite:///...) e o padrão
+    backend/instance/database/controle_gastos.db. Caminhos relativos são
+    resolvidos a partir da raiz do projeto, não do diretório de trabalho.
+    """
+    if caminho is None:
+        url = os.environ.get('DATABASE_URL', '')
+        caminho = url[len('sqlite:///'):] if url.startswith('sqlite:///') else CAMINHO_PADRAO
+    if caminho == ':memory:' or os.path.isabs(caminho):
+        return caminho
+    return os.path.join(RAIZ_PROJETO, caminho)
+
+
+def url_sqlalchemy(caminho=None):
+    """URL do SQLAlchemy para o mesmo banco usado pelos módulos de ML"""
+    return 'sqlite:///' + resolver_caminho_db(caminho).replace('\\', '/')
+
+
+def aplicar_pragmas(conn):
+    cursor = conn.cursor()
+    for pragma in PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _pool(caminho):
+    pool = _pools.get(caminho)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(caminho, queue.LifoQueue(maxsize=TAMANHO_POOL))
+    return pool
+
+
+def _emprestar(caminho):
+    if caminho != ':memory:':
+        try:
+            return _pool(caminho).get_nowait()
+        except queue.Empty:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    # check_same_thread=False: a conexão passa de uma thread para outra pelo
+    # pool, mas só uma thread a usa de cada vez
+    conn = sqlite3.connect(caminho, check_same_thread=False)
+    aplicar_pragmas(conn)
+    return conn
+
+
+def _devolver(caminho, conn):
+    try:
+        # Uma transação esquecida aberta não pode passar para o próximo usuário
+        if conn.in_transaction:
+            conn.rollback()
+        if caminho == ':memory:':
+            raise queue.Full
+        _pool(caminho).put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.close()
+
+
+class _ConexoesDaThread(dict):
+    """{caminho: conexão} emprestadas à thread; devolvidas ao pool se a thread terminar sem devolvê-las"""
+
+    def __del__(self):
+        try:
+            for caminho, conn in self.items():
+                _devolver(caminho, conn)
+        except Exception:
+            pass
+
+
+def obter_conexao(caminho=None):
+    """Conexão sqlite3 emprestada do pool para a thread atual; a mesma até devolver_conexoes().
+    
+    Não deve ser fechada por quem a usa. Escritas precisam de commit() explícito.
+    """
+    caminho = resolver_caminho_db(caminho)
+    conexoes = getattr(_local, 'conexoes', None)
+    if conexoes is None:
+        conexoes = _local.conexoes = _ConexoesDaThread()
+    
+    conn = conexoes.get(caminho)
+    if conn is None:
+        conn = conexoes[caminho] = _emprestar(caminho)
+    return conn
+
+
+def devolver_conexoes():
+    """Devolve ao pool as conexões da thread atual (fim de requisição ou de job)"""
+    conexoes = getattr(_local, 'conexoes', None)
+    while conexoes:
+        _devolver(*conexoes.popitem())
+
+
+def fechar_conexoes():
+    """Devolve as conexões da thread atual e fecha todas as ociosas (testes e encerramento)"""
+    devolver_conexoes()
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def configurar_engine(engine):
+    """Aplica os mesmos PRAGMAs a cada nova conexão de um engine SQLAlchemy"""
+    from sqlalchemy import event
+    
+    @event.listens_for(engine, 'connect')
+    def _ao_conectar(dbapi_conn, registro):
+        aplicar_pragmas(dbapi_conn)
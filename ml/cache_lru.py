@@ -0,0 +1,105 @@
+"""
+Cache LRU limitado para resultados de classificação
+Sistema Web de Controle de Gastos Pessoais
+
+Descrições bancárias se repetem muito ("UBER *TRIP", "IFOOD"); o cache guarda
+o resultado por descrição normalizada e descarta a menos usada quando enche.
+O tamanho pode ser ajustado pela variável de ambiente CLASSIFICACAO_CACHE_TAMANHO.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+TAMANHO_PADRAO = int(os.environ.get('CLASSIFICACAO_CACHE_TAMANHO', 4096))
+
+
+class CacheLRU:
+    """Cache chave -> valor com no máximo `capacidade` itens e contadores de uso.
+
+    `obter` calcula fora do lock; se o cache for limpo durante o cálculo, o
+    valor (possivelmente desatualizado) é devolvido mas não é guardado.
+    """
+
+    def __init__(self, capacidade=TAMANHO_PADRAO):
+        self.capacidade = capacidade
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._geracao = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+        self.invalidacoes = 0
+
+    def __len__(self):
+        return len(self._itens)
+
+    def obter(self, chave, calcular):
+        """Valor guardado para a chave; se não houver, `calcular(chave)` e guarda"""
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return self._itens[chave]
+            self.falhas += 1
+            geracao = self._geracao
+
+        valor = calcular(chave)
+
+        with self._lock:
+            self._guardar(chave, valor, geracao)
+        return valor
+
+    def obter_varios(self, chaves, calcular):
+        """{chave: valor} para chaves distintas; as que faltam são calculadas
+        numa única chamada `calcular(lista de chaves)`, que devolve os valores na mesma ordem"""
+        resultado = {}
+        faltando = []
+        with self._lock:
+            for chave in chaves:
+                if chave in self._itens:
+                    self._itens.move_to_end(chave)
+                    self.acertos += 1
+                    resultado[chave] = self._itens[chave]
+                else:
+                    self.falhas += 1
+                    faltando.append(chave)
+            geracao = self._geracao
+
+        if faltando:
+            valores = calcular(faltando)
+            with self._lock:
+                for chave, valor in zip(faltando, valores):
+                    self._guardar(chave, valor, geracao)
+                    resultado[chave] = valor
+        return resultado
+
+    def _guardar(self, chave, valor, geracao):
+        # Chamado com o lock; valores calculados antes de uma limpeza são descartados
+        if geracao != self._geracao or self.capacidade <= 0:
+            return
+        self._itens[chave] = valor
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.capacidade:
+            self._itens.popitem(last=False)
+            self.remocoes += 1
+
+    def limpar(self):
+        """Descarta tudo (categorias ou modelo mudaram); os contadores continuam"""
+        with self._lock:
+            self._itens.clear()
+            self._geracao += 1
+            self.invalidacoes += 1
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                'capacidade': self.capacidade,
+                'tamanho': len(self._itens),
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / consultas * 100, 2) if consultas else 0,
+                'remocoes': self.remocoes,
+                'invalidacoes': self.invalidacoes
+            }
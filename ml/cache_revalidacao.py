@@ -0,0 +1,117 @@
+"""
+Resultados de ML servidos do cache e recalculados em segundo plano
+Sistema Web de Controle de Gastos Pessoais
+
+Previsões e análises de padrões podem incluir um treino completo do modelo;
+calculadas dentro da requisição, prendem um worker do servidor. Aqui cada
+resultado fica guardado com a versão dos dados para a qual foi calculado
+(stale-while-revalidate):
+
+- versão igual à atual: o valor é devolvido direto;
+- versão antiga: o valor antigo é devolvido na hora e o recálculo é agendado
+  num pool de threads;
+- sem valor ainda: a requisição espera o primeiro cálculo.
+
+Há no máximo um cálculo em andamento por chave: requisições simultâneas
+compartilham o mesmo Future.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from banco import devolver_conexoes
+
+MAX_WORKERS = 2
+CAPACIDADE = 64
+
+
+class CacheRevalidacao:
+    """Cache chave -> resultado, revalidado quando `versao()` muda.
+
+    `obter(chave, calcular)` retorna (valor, idade em segundos, atualizado),
+    onde `atualizado` é False quando o valor é de uma versão anterior dos dados.
+    """
+
+    def __init__(self, versao, max_workers=MAX_WORKERS, capacidade=CAPACIDADE):
+        self._versao = versao
+        self.capacidade = capacidade
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='revalidacao')
+        self._lock = threading.Lock()
+        # chave -> (versão, valor, calculado_em em time.monotonic())
+        self._itens = OrderedDict()
+        # chave -> Future do cálculo em andamento
+        self._em_andamento = {}
+        self._geracao = 0
+        self.calculos = 0
+        self.erros = {}
+
+    def obter(self, chave, calcular):
+        versao = self._versao()
+        with self._lock:
+            guardado = self._itens.get(chave)
+            if guardado is not None:
+                self._itens.move_to_end(chave)
+            if guardado is None or guardado[0] != versao:
+                futuro = self._agendar(chave, calcular, versao)
+
+        if guardado is None:
+            # Nada para servir ainda: espera o cálculo (compartilhado com
+            # outras requisições da mesma chave); erros são propagados
+            guardado = futuro.result()
+
+        versao_valor, valor, calculado_em = guardado
+        return valor, time.monotonic() - calculado_em, versao_valor == versao
+
+    def _agendar(self, chave, calcular, versao):
+        """Agenda o cálculo se não houver um em andamento; chamar com o lock"""
+        futuro = self._em_andamento.get(chave)
+        if futuro is None:
+            futuro = self._executor.submit(self._calcular, chave, calcular, versao, self._geracao)
+            self._em_andamento[chave] = futuro
+        return futuro
+
+    def _calcular(self, chave, calcular, versao, geracao):
+        try:
+            valor = calcular()
+        except Exception as e:
+            # O valor antigo continua sendo servido; a próxima requisição tenta de novo
+            self.erros[chave] = str(e)
+            print(f"Erro ao recalcular {chave}: {e}")
+            raise
+        else:
+            self.erros.pop(chave, None)
+            guardado = (versao, valor, time.monotonic())
+            with self._lock:
+                self.calculos += 1
+                # Depois de limpar(), o resultado é devolvido a quem espera mas não é guardado
+                if geracao == self._geracao:
+                    self._itens[chave] = guardado
+                    self._itens.move_to_end(chave)
+                    while len(self._itens) > self.capacidade:
+                        self._itens.popitem(last=False)
+            return guardado
+        finally:
+            with self._lock:
+                if geracao == self._geracao:
+                    self._em_andamento.pop(chave, None)
+            # A conexão emprestada volta ao pool entre um cálculo e outro
+            devolver_conexoes()
+
+    def aguardar(self, timeout=None):
+        """Espera os cálculos em andamento (útil em testes e no encerramento)"""
+        with self._lock:
+            futuros = list(self._em_andamento.values())
+        for futuro in futuros:
+            try:
+                futuro.result(timeout)
+            except Exception:
+                pass
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._em_andamento.clear()
+            self._geracao += 1
+            self.erros.clear()
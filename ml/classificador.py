@@ -4,14 +4,44 @@ Sistema Web de Controle de Gastos Pessoais
 """
 
 import re
-import json
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from banco import obter_conexao, resolver_caminho_db, devolver_conexoes
+from automato import AutomatoAhoCorasick
+from indice_historico import IndiceHistorico, SIMILARIDADE_MINIMA
+from indice_similaridade import IndiceSimilaridade
+from cache_lru import CacheLRU
+from palavras_chave import carregar_palavras, adicionar_palavras, versao_categorias
 from difflib import SequenceMatcher
 
+def limpar_texto(texto):
+    """Limpa e normaliza o texto para classificação"""
+    # Converter para minúsculas
+    texto = texto.lower().strip()
+    
+    # Remover caracteres especiais, manter apenas letras, números e espaços
+    texto = re.sub(r'[^\w\s]', ' ', texto)
+    
+    # Remover espaços extras
+    texto = re.sub(r'\s+', ' ', texto)
+    
+    return texto
+
+class _IndiceBusca:
+    """Categorias e estruturas de busca derivadas delas, trocadas juntas numa única atribuição"""
+    
+    __slots__ = ('categorias', 'ocorrencias_banco', 'ocorrencias_especificas', 'id_por_nome',
+                 'indice_similaridade', 'padrao_vazio', 'automato')
+
+
 class ClassificadorCategorias:
-    def __init__(self, db_path='database/controle_gastos.db'):
-        self.db_path = db_path
-        self.categorias = self._carregar_categorias()
+    def __init__(self, db_path=None, cache=None):
+        self.db_path = resolver_caminho_db(db_path)
+        # Serializa as reconstruções do índice de busca (treinar_classificador)
+        self._lock = threading.Lock()
+        # Resultados por descrição limpa; compartilhado quando vem do ServicoClassificador
+        self._cache = cache if cache is not None else CacheLRU()
         
         # Palavras-chave mais específicas para melhorar a classificação
         self.palavras_especificas = {
@@ -84,24 +114,80 @@ class ClassificadorCategorias:
                 'bitcoin', 'criptomoeda', 'ethereum', 'exchange'
             ]
         }
+        
+        self._recarregar()
+    
+    def _recarregar(self):
+        """Relê as categorias do banco e reconstrói o automato.
+        
+        Tudo é montado à parte e publicado com uma única atribuição, sob o lock:
+        quem está classificando vê o índice antigo ou o novo, nunca uma mistura,
+        e duas recargas simultâneas não se sobrepõem."""
+        with self._lock:
+            self._busca = self._construir_automato(self._carregar_categorias())
+    
+    def _construir_automato(self, categorias):
+        """Compila as palavras-chave do banco e as específicas em um único automato,
+        e as do banco no índice de similaridade. Retorna um _IndiceBusca novo."""
+        busca = _IndiceBusca()
+        busca.categorias = categorias
+        # padrão (minúsculo) -> ocorrências nas listas originais, preservando ordem e índice
+        busca.ocorrencias_banco = {}
+        busca.ocorrencias_especificas = {}
+        busca.id_por_nome = {}
+        busca.indice_similaridade = IndiceSimilaridade()
+        
+        for ordem, (categoria_id, categoria_info) in enumerate(categorias.items()):
+            busca.id_por_nome.setdefault(categoria_info['nome'], categoria_id)
+            for indice, palavra in enumerate(categoria_info['palavras_chave']):
+                busca.ocorrencias_banco.setdefault(palavra.lower(), []).append(
+                    (ordem, categoria_id, indice, palavra)
+                )
+                busca.indice_similaridade.adicionar(palavra.lower(), categoria_id)
+        
+        for nome_categoria, palavras in self.palavras_especificas.items():
+            for indice, palavra in enumerate(palavras):
+                busca.ocorrencias_especificas.setdefault(palavra.lower(), []).append(
+                    (nome_categoria, indice, palavra)
+                )
+        
+        padroes = set(busca.ocorrencias_banco) | set(busca.ocorrencias_especificas)
+        # String vazia é substring de qualquer texto; tratada fora do automato
+        busca.padrao_vazio = '' in padroes
+        padroes.discard('')
+        busca.automato = AutomatoAhoCorasick(padroes)
+        return busca
+    
+    # Leituras sempre do _IndiceBusca publicado por último
+    categorias = property(lambda self: self._busca.categorias)
+    _ocorrencias_banco = property(lambda self: self._busca.ocorrencias_banco)
+    _ocorrencias_especificas = property(lambda self: self._busca.ocorrencias_especificas)
+    _id_por_nome = property(lambda self: self._busca.id_por_nome)
+    _indice_similaridade = property(lambda self: self._busca.indice_similaridade)
+    
+    def _buscar_ocorrencias(self, descricao):
+        """Uma única passada pela descrição limpa; retorna os padrões encontrados"""
+        busca = self._busca
+        encontrados = busca.automato.buscar(descricao)
+        if busca.padrao_vazio:
+            encontrados.add('')
+        return encontrados
     
     def _carregar_categorias(self):
         """Carrega categorias do banco de dados"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = obter_conexao(self.db_path)
             cursor = conn.cursor()
-            cursor.execute("SELECT id, nome, palavras_chave FROM categoria")
+            cursor.execute("SELECT id, nome FROM categoria")
             categorias = {}
+            palavras = carregar_palavras(conn)
             
-            for row in cursor.fetchall():
-                categoria_id, nome, palavras_chave_json = row
-                palavras_chave = json.loads(palavras_chave_json) if palavras_chave_json else []
+            for categoria_id, nome in cursor.fetchall():
                 categorias[categoria_id] = {
                     'nome': nome,
-                    'palavras_chave': palavras_chave
+                    'palavras_chave': palavras.get(categoria_id, [])
                 }
             
-            conn.close()
             return categorias
         except Exception as e:
             print(f"Erro ao carregar categorias: {e}")
@@ -115,10 +201,38 @@ class ClassificadorCategorias:
         if not descricao:
             return None
         
+        # Descrições repetidas não passam de novo pelos estágios de palavras-chave;
+        # o histórico muda a cada indexação e por isso não entra no cache
         descricao_limpa = self._limpar_texto(descricao)
+        categoria_id = self._cache.obter(descricao_limpa, self._classificar_por_palavras)
+        if categoria_id is None:
+            categoria_id = self._aprender_de_historico(descricao_limpa)
+        return categoria_id
+    
+    def classificar_lote(self, descricoes, historico=True):
+        """
+        Classifica várias descrições de uma vez; retorna os IDs na ordem de entrada.
+        Cada descrição limpa distinta passa uma única vez pelos estágios.
+        Com historico=False o estágio do histórico (o mais caro) é pulado.
+        """
+        limpas = [self._limpar_texto(descricao) if descricao else None for descricao in descricoes]
+        unicas = list(dict.fromkeys(texto for texto in limpas if texto is not None))
+        por_texto = self._cache.obter_varios(unicas, self._classificar_textos_por_palavras)
+        for texto in unicas:
+            if historico and por_texto[texto] is None:
+                por_texto[texto] = self._aprender_de_historico(texto)
+        return [por_texto[texto] if texto is not None else None for texto in limpas]
+    
+    def _classificar_textos_por_palavras(self, textos):
+        return [self._classificar_por_palavras(descricao_limpa) for descricao_limpa in textos]
+    
+    def _classificar_por_palavras(self, descricao_limpa):
+        """Estágios que só dependem das categorias, do mais barato ao mais caro.
+        O resultado (inclusive None) vale até a próxima recarga das categorias."""
+        ocorrencias = self._buscar_ocorrencias(descricao_limpa)
         
         # Buscar por correspondência exata de palavras-chave
-        categoria_id = self._buscar_correspondencia_exata(descricao_limpa)
+        categoria_id = self._buscar_correspondencia_exata(descricao_limpa, ocorrencias)
         if categoria_id:
             return categoria_id
         
@@ -128,115 +242,114 @@ class ClassificadorCategorias:
             return categoria_id
         
         # Usar palavras-chave específicas mais abrangentes
-        categoria_id = self._buscar_palavras_especificas(descricao_limpa)
+        categoria_id = self._buscar_palavras_especificas(descricao_limpa, ocorrencias)
         if categoria_id:
             return categoria_id
         
-        # Se não encontrou nada, tentar aprender com transações similares
-        categoria_id = self._aprender_de_historico(descricao_limpa)
-        if categoria_id:
-            return categoria_id
-        
-        return None  # Não classificado
+        return None
     
     def _limpar_texto(self, texto):
         """Limpa e normaliza o texto para classificação"""
-        # Converter para minúsculas
-        texto = texto.lower().strip()
-        
-        # Remover caracteres especiais, manter apenas letras, números e espaços
-        texto = re.sub(r'[^\w\s]', ' ', texto)
-        
-        # Remover espaços extras
-        texto = re.sub(r'\s+', ' ', texto)
-        
-        return texto
+        return limpar_texto(texto)
     
-    def _buscar_correspondencia_exata(self, descricao):
+    def _buscar_correspondencia_exata(self, descricao, ocorrencias=None):
         """Busca correspondência exata com palavras-chave das categorias"""
-        for categoria_id, categoria_info in self.categorias.items():
-            palavras_chave = categoria_info['palavras_chave']
-            
-            for palavra in palavras_chave:
-                if palavra.lower() in descricao:
-                    return categoria_id
+        if ocorrencias is None:
+            ocorrencias = self._buscar_ocorrencias(descricao)
         
-        return None
+        # Primeira categoria (na ordem do banco) com alguma palavra-chave presente
+        melhor = None
+        for padrao in ocorrencias:
+            for ordem, categoria_id, _, _ in self._ocorrencias_banco.get(padrao, ()):
+                if melhor is None or ordem < melhor[0]:
+                    melhor = (ordem, categoria_id)
+        
+        return melhor[1] if melhor else None
     
-    def _buscar_palavras_especificas(self, descricao):
+    def _buscar_palavras_especificas(self, descricao, ocorrencias=None):
         """Busca usando palavras-chave específicas mais abrangentes"""
-        pontuacoes = {}
+        if ocorrencias is None:
+            ocorrencias = self._buscar_ocorrencias(descricao)
         
-        for nome_categoria, palavras in self.palavras_especificas.items():
-            pontuacao = 0
-            palavras_encontradas = 0
-            
-            for palavra in palavras:
-                if palavra.lower() in descricao:
-                    pontuacao += len(palavra)  # Palavras maiores têm mais peso
-                    palavras_encontradas += 1
-            
-            if palavras_encontradas > 0:
-                # Normalizar pontuação pela quantidade de palavras encontradas
-                pontuacoes[nome_categoria] = pontuacao * palavras_encontradas
+        encontradas_por_categoria = {}
+        for padrao in ocorrencias:
+            for nome_categoria, _, palavra in self._ocorrencias_especificas.get(padrao, ()):
+                acumulado = encontradas_por_categoria.setdefault(nome_categoria, [0, 0])
+                acumulado[0] += len(palavra)  # Palavras maiores têm mais peso
+                acumulado[1] += 1
+        
+        # Normalizar pontuação pela quantidade de palavras encontradas;
+        # a ordem do dicionário decide empates, como antes
+        pontuacoes = {
+            nome_categoria: encontradas_por_categoria[nome_categoria][0] * encontradas_por_categoria[nome_categoria][1]
+            for nome_categoria in self.palavras_especificas
+            if nome_categoria in encontradas_por_categoria
+        }
         
         if pontuacoes:
             # Retornar categoria com maior pontuação
             melhor_categoria = max(pontuacoes, key=pontuacoes.get)
             
             # Encontrar ID da categoria pelo nome
-            for categoria_id, categoria_info in self.categorias.items():
-                if categoria_info['nome'] == melhor_categoria:
-                    return categoria_id
+            return self._id_por_nome.get(melhor_categoria)
         
         return None
     
     def _buscar_por_similaridade(self, descricao):
-        """Busca por similaridade de texto usando SequenceMatcher"""
-        melhor_similaridade = 0
-        melhor_categoria = None
-        
-        for categoria_id, categoria_info in self.categorias.items():
-            palavras_chave = categoria_info['palavras_chave']
-            
-            for palavra in palavras_chave:
-                similaridade = SequenceMatcher(None, descricao, palavra.lower()).ratio()
-                
-                if similaridade > melhor_similaridade and similaridade > 0.6:  # 60% de similaridade mínima
-                    melhor_similaridade = similaridade
-                    melhor_categoria = categoria_id
-        
-        return melhor_categoria
+        """Busca por similaridade de texto usando SequenceMatcher.
+        O índice descarta, sem comparar, as palavras-chave que não podem passar do mínimo."""
+        return self._indice_similaridade.melhor(descricao, 0.6)  # 60% de similaridade mínima
     
     def _aprender_de_historico(self, descricao):
-        """Aprende com transações similares do histórico"""
+        """Aprende com transações similares do histórico.
+        
+        Só compara com os candidatos que mais compartilham trigramas com a
+        descrição (índice da migração 4), em vez de todo o histórico. Só lê:
+        os trigramas são gravados por indexar_historico() depois das escritas."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Buscar transações com descrições similares que já foram categorizadas
-            cursor.execute("""
-                SELECT descricao, categoria_id, COUNT(*) as frequencia
-                FROM transacao 
-                WHERE categoria_id IS NOT NULL
-                GROUP BY descricao, categoria_id
-                ORDER BY frequencia DESC
-            """)
-            
-            transacoes_historico = cursor.fetchall()
-            conn.close()
+            conn = obter_conexao(self.db_path)
+            indice = IndiceHistorico(self._limpar_texto)
+            try:
+                candidatos = indice.candidatos(conn, descricao)
+            except sqlite3.OperationalError:
+                # Banco sem o índice de trigramas: compara com o histórico inteiro
+                candidatos = [
+                    (self._limpar_texto(descricao_historico), categoria_id, frequencia)
+                    for descricao_historico, categoria_id, frequencia in conn.execute("""
+                        SELECT descricao, categoria_id, COUNT(*) as frequencia
+                        FROM transacao 
+                        WHERE categoria_id IS NOT NULL
+                        GROUP BY descricao, categoria_id
+                        ORDER BY frequencia DESC
+                    """)
+                ]
             
             melhor_similaridade = 0
             melhor_categoria = None
             
-            for descricao_historico, categoria_id, frequencia in transacoes_historico:
-                descricao_historico_limpa = self._limpar_texto(descricao_historico)
-                similaridade = SequenceMatcher(None, descricao, descricao_historico_limpa).ratio()
+            # A mesma descrição aparece uma vez para cada categoria em que já foi usada
+            comparadores = {}
+            
+            for descricao_historico_limpa, categoria_id, frequencia in candidatos:
+                comparador = comparadores.get(descricao_historico_limpa)
+                if comparador is None:
+                    comparador = SequenceMatcher(None, descricao, descricao_historico_limpa)
+                    comparadores[descricao_historico_limpa] = comparador
+                bonus = 1 + frequencia * 0.1  # Bonus por frequência
+                
+                # real_quick_ratio() e quick_ratio() são limites superiores de ratio():
+                # descartam o candidato sem o cálculo completo
+                if comparador.real_quick_ratio() * bonus <= melhor_similaridade:
+                    continue
+                limite = comparador.quick_ratio()
+                if limite <= SIMILARIDADE_MINIMA or limite * bonus <= melhor_similaridade:
+                    continue
+                similaridade = comparador.ratio()
                 
                 # Considerar tanto similaridade quanto frequência
-                score = similaridade * (1 + frequencia * 0.1)  # Bonus por frequência
+                score = similaridade * bonus
                 
-                if score > melhor_similaridade and similaridade > 0.7:  # 70% de similaridade para histórico
+                if score > melhor_similaridade and similaridade > SIMILARIDADE_MINIMA:  # 70% de similaridade para histórico
                     melhor_similaridade = score
                     melhor_categoria = categoria_id
             
@@ -252,27 +365,34 @@ class ClassificadorCategorias:
             return []
         
         descricao_limpa = self._limpar_texto(descricao)
+        ocorrencias = self._buscar_ocorrencias(descricao_limpa)
         sugestoes = []
         
+        # Agrupar as ocorrências por categoria, na ordem original das listas
+        do_banco = {}
+        especificas = {}
+        for padrao in ocorrencias:
+            for _, categoria_id, indice, palavra in self._ocorrencias_banco.get(padrao, ()):
+                do_banco.setdefault(categoria_id, []).append((indice, palavra))
+            for nome_categoria, indice, palavra in self._ocorrencias_especificas.get(padrao, ()):
+                especificas.setdefault(nome_categoria, []).append((indice, palavra))
+        
         # Calcular score para cada categoria
         for categoria_id, categoria_info in self.categorias.items():
             score = 0
             palavras_encontradas = []
             
             # Verificar palavras-chave da categoria
-            for palavra in categoria_info['palavras_chave']:
-                if palavra.lower() in descricao_limpa:
-                    score += len(palavra)
-                    palavras_encontradas.append(palavra)
+            for _, palavra in sorted(do_banco.get(categoria_id, ())):
+                score += len(palavra)
+                palavras_encontradas.append(palavra)
             
             # Verificar palavras específicas
             nome_categoria = categoria_info['nome']
-            if nome_categoria in self.palavras_especificas:
-                for palavra in self.palavras_especificas[nome_categoria]:
-                    if palavra.lower() in descricao_limpa:
-                        score += len(palavra) * 1.5  # Peso maior para palavras específicas
-                        if palavra not in palavras_encontradas:
-                            palavras_encontradas.append(palavra)
+            for _, palavra in sorted(especificas.get(nome_categoria, ())):
+                score += len(palavra) * 1.5  # Peso maior para palavras específicas
+                if palavra not in palavras_encontradas:
+                    palavras_encontradas.append(palavra)
             
             if score > 0:
                 sugestoes.append({
@@ -289,6 +409,16 @@ class ClassificadorCategorias:
     
     def treinar_classificador(self, descricao, categoria_id):
         """Treina o classificador com uma nova associação"""
+        if not self._gravar_treino(descricao, categoria_id):
+            return False
+        
+        # Recarregar categorias
+        self._recarregar()
+        self._cache.limpar()
+        return True
+    
+    def _gravar_treino(self, descricao, categoria_id):
+        """Grava as palavras da descrição para a categoria (sem recarregar)"""
         try:
             # Extrair palavras importantes da descrição
             descricao_limpa = self._limpar_texto(descricao)
@@ -301,48 +431,28 @@ class ClassificadorCategorias:
             if not palavras_relevantes:
                 return False
             
-            # Atualizar palavras-chave da categoria no banco
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Buscar palavras-chave atuais
-            cursor.execute("SELECT palavras_chave FROM categoria WHERE id = ?", (categoria_id,))
-            resultado = cursor.fetchone()
+            # Cada palavra nova é uma linha; as já cadastradas são ignoradas pelo índice único
+            conn = obter_conexao(self.db_path)
             
-            if resultado:
-                palavras_atuais = json.loads(resultado[0]) if resultado[0] else []
-                
-                # Adicionar novas palavras relevantes (se não existirem)
-                for palavra in palavras_relevantes:
-                    if palavra not in palavras_atuais and len(palavra) > 3:
-                        palavras_atuais.append(palavra)
-                
-                # Limitar a 50 palavras-chave por categoria
-                if len(palavras_atuais) > 50:
-                    palavras_atuais = palavras_atuais[-50:]
-                
-                # Atualizar no banco
-                cursor.execute(
-                    "UPDATE categoria SET palavras_chave = ? WHERE id = ?",
-                    (json.dumps(palavras_atuais), categoria_id)
+            if conn.execute("SELECT 1 FROM categoria WHERE id = ?", (categoria_id,)).fetchone():
+                adicionar_palavras(
+                    conn, categoria_id,
+                    [p for p in dict.fromkeys(palavras_relevantes) if len(p) > 3]
                 )
                 conn.commit()
             
-            conn.close()
-            
-            # Recarregar categorias
-            self.categorias = self._carregar_categorias()
-            
             return True
             
         except Exception as e:
             print(f"Erro ao treinar classificador: {e}")
+            # A conexão é reaproveitada; não deixar uma escrita pela metade aberta
+            obter_conexao(self.db_path).rollback()
             return False
     
     def obter_estatisticas_classificacao(self):
         """Obtém estatísticas sobre a classificação automática"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = obter_conexao(self.db_path)
             cursor = conn.cursor()
             
             # Total de transações
@@ -363,7 +473,6 @@ class ClassificadorCategorias:
             """)
             
             por_categoria = cursor.fetchall()
-            conn.close()
             
             taxa_classificacao = (transacoes_classificadas / total_transacoes * 100) if total_transacoes > 0 else 0
             
@@ -372,20 +481,162 @@ class ClassificadorCategorias:
                 'transacoes_classificadas': transacoes_classificadas,
                 'transacoes_nao_classificadas': total_transacoes - transacoes_classificadas,
                 'taxa_classificacao': round(taxa_classificacao, 2),
-                'por_categoria': [{'categoria': cat[0], 'quantidade': cat[1]} for cat in por_categoria]
+                'por_categoria': [{'categoria': cat[0], 'quantidade': cat[1]} for cat in por_categoria],
+                'cache': self._cache.estatisticas()
             }
             
         except Exception as e:
             print(f"Erro ao obter estatísticas: {e}")
             return None
 
+class ServicoClassificador:
+    """Mantém um único ClassificadorCategorias carregado por processo.
+    
+    A cada uso lê o carimbo `versao_categorias` (mantido por triggers nas
+    tabelas categoria e categoria_palavra) e só recria o classificador quando
+    ele muda. A instância em uso nunca é alterada; uma recarga troca a
+    referência inteira, então várias threads podem classificar ao mesmo tempo. O cache de classificações é do
+    serviço (os contadores sobrevivem às recargas) e é limpo a cada recarga.
+    """
+    
+    def __init__(self, db_path=None):
+        self.db_path = resolver_caminho_db(db_path)
+        self._lock = threading.Lock()
+        # (versão, classificador) trocados juntos, numa única atribuição
+        self._atual = (None, None)
+        self.cache = CacheLRU()
+        self.construcoes = 0
+    
+    def obter(self):
+        # Sem o carimbo (banco não migrado) a versão é None e a instância é mantida
+        versao = versao_categorias(obter_conexao(self.db_path))
+        versao_atual, classificador = self._atual
+        if classificador is not None and versao == versao_atual:
+            return classificador
+        
+        # Uma única construção por troca de versão, mesmo com várias requisições esperando
+        with self._lock:
+            versao_atual, classificador = self._atual
+            if classificador is None or versao != versao_atual:
+                if classificador is not None:
+                    self.cache.limpar()
+                classificador = ClassificadorCategorias(self.db_path, cache=self.cache)
+                self._atual = (versao, classificador)
+                self.construcoes += 1
+            return classificador
+    
+    def treinar(self, descricao, categoria_id):
+        """Treina a instância compartilhada e atualiza o carimbo junto.
+        
+        Sem isso o commit do treino muda `versao_categorias` e a próxima
+        requisição reconstruiria o classificador do zero.
+        """
+        classificador = self.obter()
+        with self._lock:
+            if not classificador._gravar_treino(descricao, categoria_id):
+                return False
+            # Carimbo lido antes da recarga: uma escrita de outro processo
+            # depois daqui muda a versão e provoca a reconstrução normal
+            versao = versao_categorias(obter_conexao(self.db_path))
+            classificador._recarregar()
+            self.cache.limpar()
+            self._atual = (versao, classificador)
+            return True
+
+
+_servicos = {}
+_servicos_lock = threading.Lock()
+
+def _obter_servico(db_path=None):
+    caminho = resolver_caminho_db(db_path)
+    servico = _servicos.get(caminho)
+    if servico is None:
+        with _servicos_lock:
+            servico = _servicos.setdefault(caminho, ServicoClassificador(caminho))
+    return servico
+
+def obter_classificador(db_path=None):
+    """Classificador compartilhado do processo para o banco informado (ou o configurado)"""
+    return _obter_servico(db_path).obter()
+
+def treinar_categoria(descricao, categoria_id, db_path=None):
+    """Associa as palavras da descrição à categoria no classificador compartilhado"""
+    return _obter_servico(db_path).treinar(descricao, categoria_id)
+
+def indexar_historico(db_path=None):
+    """Grava os trigramas pendentes do histórico; retorna quantas linhas foram indexadas.
+    Síncrona: usada na inicialização e nos testes; as rotas usam agendar_indexacao_historico()."""
+    classificador = obter_classificador(db_path)
+    indice = IndiceHistorico(classificador._limpar_texto)
+    return indice.atualizar(obter_conexao(classificador.db_path))
+
+
+class IndexacaoEmSegundoPlano:
+    """Indexa o histórico numa thread própria, fora das requisições de escrita.
+    
+    Agendamentos seguidos para o mesmo banco se juntam numa única rodada
+    enquanto ela não começou; um agendamento feito durante a rodada garante
+    outra logo depois, para as linhas gravadas depois do início dela.
+    """
+    
+    def __init__(self, indexar=indexar_historico):
+        self._indexar = indexar
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='indexacao')
+        self._lock = threading.Lock()
+        # caminho do banco -> Future da rodada que ainda não começou
+        self._agendadas = {}
+        self.rodadas = 0
+    
+    def agendar(self, db_path=None):
+        caminho = resolver_caminho_db(db_path)
+        with self._lock:
+            futuro = self._agendadas.get(caminho)
+            if futuro is None:
+                futuro = self._executor.submit(self._rodar, caminho)
+                self._agendadas[caminho] = futuro
+            return futuro
+    
+    def _rodar(self, caminho):
+        with self._lock:
+            self._agendadas.pop(caminho, None)
+            self.rodadas += 1
+        try:
+            return self._indexar(caminho)
+        except Exception as e:
+            # As linhas continuam pendentes e entram na próxima rodada
+            print(f"Erro ao indexar histórico: {e}")
+            return 0
+        finally:
+            devolver_conexoes()
+    
+    def aguardar(self, timeout=None):
+        """Espera as rodadas já agendadas (útil em testes e no encerramento)"""
+        # Um único worker: a tarefa vazia só roda depois das anteriores
+        self._executor.submit(lambda: None).result(timeout)
+
+
+_indexacao = IndexacaoEmSegundoPlano()
+
+def agendar_indexacao_historico(db_path=None):
+    """Agenda a indexação do histórico; chamada por quem grava transações, logo após o commit"""
+    return _indexacao.agendar(db_path)
+
+def aguardar_indexacao_historico(timeout=None):
+    _indexacao.aguardar(timeout)
+
 # Função utilitária para usar nas rotas do Flask
 def classificar_automaticamente(descricao):
     """Função para ser chamada pelas rotas do Flask"""
-    classificador = ClassificadorCategorias()
-    return classificador.classificar_transacao(descricao)
+    return obter_classificador().classificar_transacao(descricao)
 
 def obter_sugestoes_categoria(descricao):
     """Função para obter sugestões de categoria"""
-    classificador = ClassificadorCategorias()
-    return classificador.sugerir_categoria_manual(descricao)
\ No newline at end of file
+    return obter_classificador().sugerir_categoria_manual(descricao)
+
+def classificar_lote(descricoes, historico=True):
+    """Classifica uma lista de descrições; retorna os IDs de categoria na mesma ordem"""
+    return obter_classificador().classificar_lote(descricoes, historico)
+
+def obter_estatisticas_classificacao():
+    """Estatísticas da classificação automática, incluindo o uso do cache"""
+    return obter_classificador().obter_estatisticas_classificacao()
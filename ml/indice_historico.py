@@ -0,0 +1,140 @@
+"""
+Índice de trigramas sobre o histórico de descrições categorizadas
+Sistema Web de Controle de Gastos Pessoais
+
+As tabelas historico_descricao e historico_trigrama vêm da migração 4
+(backend/migracoes.py). Triggers na tabela transacao mantêm a frequência de
+cada (descrição, categoria); os trigramas das linhas novas são gravados por
+`atualizar`, chamado por quem grava transações (não pela consulta), porque
+dependem da mesma limpeza de texto do classificador.
+"""
+
+import math
+import sqlite3
+from collections import Counter
+
+SIMILARIDADE_MINIMA = 0.7
+LIMITE_CANDIDATOS = 30
+LIMITE_POSTAGENS = 1000
+LOTE_INDEXACAO = 5000
+
+
+def trigramas(texto):
+    """Conjunto de trigramas de caracteres do texto, com as bordas marcadas por espaço"""
+    texto = f' {texto} '
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def faixa_tamanho(tamanho, similaridade=SIMILARIDADE_MINIMA):
+    """Tamanhos de texto que ainda podem passar da similaridade mínima.
+
+    SequenceMatcher.ratio() = 2*M / (a + b) e M <= min(a, b), então textos
+    muito mais curtos ou muito mais longos nunca chegam ao limite.
+    """
+    minimo = math.floor(tamanho * similaridade / (2 - similaridade))
+    maximo = math.ceil(tamanho * (2 - similaridade) / similaridade)
+    return minimo, maximo
+
+
+class IndiceHistorico:
+    """Consulta o índice de trigramas do histórico em uma conexão sqlite3.
+
+    `limpar` é a função de normalização usada pelo classificador; o texto
+    gravado em descricao_limpa é exatamente o que ele compararia.
+    """
+
+    def __init__(self, limpar):
+        self.limpar = limpar
+
+    def atualizar(self, conn):
+        """Grava os trigramas das linhas do histórico ainda não indexadas.
+        Retorna quantas linhas foram indexadas."""
+        total = 0
+        while True:
+            pendentes = conn.execute(
+                "SELECT id, descricao FROM historico_descricao WHERE descricao_limpa IS NULL LIMIT ?",
+                (LOTE_INDEXACAO,)
+            ).fetchall()
+            if not pendentes:
+                return total
+
+            postagens = []
+            linhas = []
+            documentos = Counter()
+            for historico_id, descricao in pendentes:
+                limpa = self.limpar(descricao)
+                tamanho = len(limpa)
+                grupo = trigramas(limpa)
+                postagens.extend((trigrama, tamanho, historico_id) for trigrama in grupo)
+                documentos.update(grupo)
+                linhas.append((limpa, tamanho, historico_id))
+
+            try:
+                conn.executemany(
+                    "INSERT INTO historico_trigrama (trigrama, tamanho, historico_id) VALUES (?, ?, ?)",
+                    postagens
+                )
+                conn.executemany(
+                    """INSERT INTO trigrama_frequencia (trigrama, documentos) VALUES (?, ?)
+                       ON CONFLICT (trigrama) DO UPDATE SET documentos = documentos + excluded.documentos""",
+                    documentos.items()
+                )
+                conn.executemany(
+                    "UPDATE historico_descricao SET descricao_limpa = ?, tamanho = ? WHERE id = ?",
+                    linhas
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                # Banco ocupado ou linhas já indexadas por outro processo:
+                # o que faltar fica para a próxima escrita
+                conn.rollback()
+                print(f"Erro ao indexar histórico: {e}")
+                return total
+            total += len(pendentes)
+
+    def candidatos(self, conn, descricao, limite=LIMITE_CANDIDATOS):
+        """Linhas (descricao_limpa, categoria_id, frequencia) mais parecidas com a
+        descrição já limpa, da mais para a menos frequente.
+
+        Lê do banco só as listas dos trigramas mais raros da consulta, até somar
+        LIMITE_POSTAGENS entradas: o custo não cresce com o histórico, e uma
+        descrição parecida quase sempre compartilha vários trigramas raros.
+        Ficam as `limite` linhas com mais trigramas raros em comum.
+        """
+        consulta = trigramas(descricao)
+        if not consulta:
+            return []
+
+        marcadores = ', '.join('?' * len(consulta))
+        documentos = dict(conn.execute(
+            f"SELECT trigrama, documentos FROM trigrama_frequencia WHERE trigrama IN ({marcadores})",
+            tuple(consulta)
+        ).fetchall())
+        # Do trigrama mais raro ao mais comum, até o limite de postagens lidas
+        raros = []
+        lidas = 0
+        for trigrama in sorted(documentos, key=documentos.get):
+            if documentos[trigrama] <= 0:
+                continue
+            if raros and lidas + documentos[trigrama] > LIMITE_POSTAGENS:
+                break
+            raros.append(trigrama)
+            lidas += documentos[trigrama]
+        if not raros:
+            return []
+
+        minimo, maximo = faixa_tamanho(len(descricao))
+        marcadores = ', '.join('?' * len(raros))
+        return conn.execute(f"""
+            SELECT h.descricao_limpa, h.categoria_id, h.frequencia
+            FROM (
+                SELECT historico_id, COUNT(*) AS comuns
+                FROM historico_trigrama
+                WHERE trigrama IN ({marcadores}) AND tamanho BETWEEN ? AND ?
+                GROUP BY historico_id
+                ORDER BY comuns DESC
+                LIMIT ?
+            ) c
+            JOIN historico_descricao h ON h.id = c.historico_id
+            ORDER BY h.frequencia DESC
+        """, (*raros, minimo, maximo, limite)).fetchall()
@@ -0,0 +1,84 @@
+"""
+Índice para busca aproximada de palavras-chave
+Sistema Web de Controle de Gastos Pessoais
+
+SequenceMatcher.ratio() não é uma métrica (não vale a desigualdade
+triangular), então uma BK-tree não serve. O índice usa dois limites superiores
+exatos de ratio() = 2*M / (a + b), do mais barato ao mais caro:
+
+- tamanho: M <= min(a, b); as palavras ficam agrupadas por tamanho e os grupos
+  que não podem passar do mínimo nem são visitados;
+- caracteres: M <= caracteres em comum, contados com repetição (o mesmo
+  limite de SequenceMatcher.quick_ratio()).
+
+Só as palavras que passam pelos dois limites são comparadas com ratio().
+"""
+
+from collections import Counter
+from difflib import SequenceMatcher
+
+
+def _razao(comuns, total):
+    # Mesma conta de difflib: dois textos vazios são idênticos
+    return 2.0 * comuns / total if total else 1.0
+
+
+class IndiceSimilaridade:
+    """Encontra, entre palavras indexadas, a de maior SequenceMatcher.ratio() com um texto.
+
+    Equivale a comparar o texto com cada palavra, na ordem em que foram
+    adicionadas, e ficar com a primeira de maior razão acima do mínimo.
+    """
+
+    def __init__(self, palavras=()):
+        # tamanho -> [(ordem, palavra, contagem de caracteres, valor)]
+        self._por_tamanho = {}
+        self._total = 0
+        for palavra, valor in palavras:
+            self.adicionar(palavra, valor)
+
+    def __len__(self):
+        return self._total
+
+    def adicionar(self, palavra, valor):
+        self._por_tamanho.setdefault(len(palavra), []).append(
+            (self._total, palavra, Counter(palavra), valor)
+        )
+        self._total += 1
+
+    def melhor(self, texto, minimo):
+        """Valor da primeira palavra de maior razão com o texto, se a razão passar de `minimo`"""
+        tamanho = len(texto)
+        contagem = None
+
+        # Grupos de tamanho do maior para o menor limite superior
+        grupos = sorted(
+            ((_razao(min(tamanho, outro), tamanho + outro), outro) for outro in self._por_tamanho),
+            reverse=True
+        )
+
+        melhor_razao = minimo
+        melhor_ordem = None
+        melhor_valor = None
+        for limite_tamanho, outro in grupos:
+            if limite_tamanho < melhor_razao or (limite_tamanho == melhor_razao and melhor_ordem is None):
+                break
+
+            for ordem, palavra, caracteres, valor in self._por_tamanho[outro]:
+                if melhor_ordem is not None and limite_tamanho == melhor_razao and ordem > melhor_ordem:
+                    break
+
+                if contagem is None:
+                    contagem = Counter(texto)
+                comuns = sum(min(quantidade, contagem[c]) for c, quantidade in caracteres.items())
+                limite = _razao(comuns, tamanho + outro)
+                if limite < melhor_razao or (limite == melhor_razao and (melhor_ordem is None or ordem > melhor_ordem)):
+                    continue
+
+                razao = SequenceMatcher(None, texto, palavra).ratio()
+                if razao > melhor_razao or (razao == melhor_razao and melhor_ordem is not None and ordem < melhor_ordem):
+                    melhor_razao = razao
+                    melhor_ordem = ordem
+                    melhor_valor = valor
+
+        return melhor_valor
@@ -0,0 +1,51 @@
+"""
+Modelo treinado mantido em memória, recarregado só quando o arquivo muda
+Sistema Web de Controle de Gastos Pessoais
+"""
+
+import os
+import threading
+
+
+class ModeloEmCache:
+    """Carrega o modelo do disco uma vez e o reaproveita entre requisições.
+
+    `obter(caminho)` custa um os.stat(): o arquivo só é lido de novo quando o
+    caminho, o mtime ou o tamanho mudam. Quem grava o modelo deve fazê-lo de
+    forma atômica (arquivo temporário + os.replace) para nunca expor um
+    arquivo pela metade.
+    """
+
+    def __init__(self, carregar, ao_recarregar=None):
+        self._carregar = carregar
+        self._ao_recarregar = ao_recarregar
+        self._lock = threading.Lock()
+        # (assinatura do arquivo, modelo) trocados juntos, numa única atribuição
+        self._atual = (None, None)
+        self.recargas = 0
+
+    @staticmethod
+    def _assinatura(caminho):
+        try:
+            estado = os.stat(caminho)
+        except FileNotFoundError:
+            return None
+        return (caminho, estado.st_mtime_ns, estado.st_size)
+
+    def obter(self, caminho):
+        """Modelo carregado de `caminho`, ou None se o arquivo não existe"""
+        assinatura = self._assinatura(caminho)
+        if assinatura is None:
+            return None
+
+        atual_assinatura, modelo = self._atual
+        if assinatura == atual_assinatura:
+            return modelo
+
+        with self._lock:
+            if self._atual[0] != assinatura:
+                self._atual = (assinatura, self._carregar(caminho))
+                self.recargas += 1
+                if self._ao_recarregar:
+                    self._ao_recarregar()
+            return self._atual[1]
@@ -0,0 +1,91 @@
+"""
+Palavras-chave das categorias (tabela categoria_palavra, migração 6)
+Sistema Web de Controle de Gastos Pessoais
+
+Cada palavra é uma linha única por (categoria_id, palavra); a ordem de
+inserção (id) é a ordem usada na classificação. Aprender uma palavra é um
+INSERT OR IGNORE, sem ler e regravar a lista inteira da categoria.
+"""
+
+import sqlite3
+import threading
+
+from banco import obter_conexao, resolver_caminho_db
+
+LIMITE_POR_CATEGORIA = 50
+
+
+def versao_categorias(conn):
+    """Carimbo mantido por triggers nas tabelas categoria e categoria_palavra"""
+    try:
+        linha = conn.execute("SELECT versao FROM versao_categorias WHERE id = 1").fetchone()
+        return linha[0] if linha else None
+    except sqlite3.Error:
+        # Banco sem a migração do carimbo
+        return None
+
+
+def carregar_palavras(conn):
+    """{categoria_id: [palavras]} na ordem em que foram cadastradas"""
+    palavras = {}
+    for categoria_id, palavra in conn.execute(
+        "SELECT categoria_id, palavra FROM categoria_palavra ORDER BY categoria_id, id"
+    ):
+        palavras.setdefault(categoria_id, []).append(palavra)
+    return palavras
+
+
+def adicionar_palavras(conn, categoria_id, palavras, limite=LIMITE_POR_CATEGORIA):
+    """Acrescenta as palavras que a categoria ainda não tem e mantém só as
+    `limite` mais recentes. Não faz commit. Retorna quantas foram inseridas."""
+    inseridas = 0
+    for palavra in palavras:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO categoria_palavra (categoria_id, palavra) VALUES (?, ?)",
+            (categoria_id, palavra)
+        )
+        inseridas += cursor.rowcount
+    if inseridas and limite is not None:
+        conn.execute(
+            """DELETE FROM categoria_palavra WHERE categoria_id = ? AND id NOT IN (
+                   SELECT id FROM categoria_palavra WHERE categoria_id = ? ORDER BY id DESC LIMIT ?
+               )""",
+            (categoria_id, categoria_id, limite)
+        )
+    return inseridas
+
+
+class EspelhoPalavrasChave:
+    """Cópia em memória das palavras-chave, relida só quando o carimbo
+    `versao_categorias` muda. Os valores devolvidos não devem ser alterados."""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # (versão, {categoria_id: [palavras]}, [(categoria_id, [minúsculas])]) trocados juntos
+        self._atual = (None, None, None)
+
+    def _carregar(self):
+        conn = obter_conexao(resolver_caminho_db(self.db_path))
+        versao = versao_categorias(conn)
+        atual = self._atual
+        if atual[1] is not None and versao == atual[0]:
+            return atual
+
+        with self._lock:
+            if self._atual[1] is None or versao != self._atual[0]:
+                palavras = carregar_palavras(conn)
+                para_busca = [
+                    (categoria_id, [p.lower() for p in lista])
+                    for categoria_id, lista in palavras.items()
+                ]
+                self._atual = (versao, palavras, para_busca)
+            return self._atual
+
+    def obter(self):
+        """{categoria_id: [palavras]}"""
+        return self._carregar()[1]
+
+    def obter_para_busca(self):
+        """[(categoria_id, [palavras em minúsculas])], na ordem das categorias"""
+        return self._carregar()[2]
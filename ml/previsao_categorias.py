@@ -0,0 +1,170 @@
+"""
+Previsão de gastos do próximo mês para todas as categorias de uma vez
+Sistema Web de Controle de Gastos Pessoais
+
+Uma consulta agregada traz o total de cada (categoria, mês). Com ela é
+montado um array (categoria, mês, feature) com os três meses anteriores de
+cada mês, e os mínimos quadrados de todas as categorias são resolvidos numa
+única chamada vetorizada (np.linalg.pinv sobre a pilha de matrizes), sem um
+modelo do sklearn por categoria.
+
+Meses anteriores ao primeiro gasto de uma categoria não existem para ela e
+ficam mascarados (linhas zeradas não mudam a solução de mínimos quadrados).
+Categorias com histórico curto demais para a regressão usam a média dos
+últimos meses.
+"""
+
+import threading
+
+import numpy as np
+
+from banco import obter_conexao, resolver_caminho_db
+from previsao_gastos import impressao_dados
+
+DEFASAGENS = 3
+# Meses de treino (com as três defasagens disponíveis) exigidos para a regressão
+MINIMO_MESES_REGRESSAO = 6
+MARGEM_MEDIA = 0.15
+
+# Série mensal por banco: caminho -> (impressão digital dos dados, série)
+_series = {}
+_series_lock = threading.Lock()
+
+
+def _indice_mes(ano_mes):
+    ano, mes = ano_mes.split('-')
+    return int(ano) * 12 + int(mes) - 1
+
+
+def _ano_mes(indice):
+    return f'{indice // 12:04d}-{indice % 12 + 1:02d}'
+
+
+def carregar_serie_mensal(conn):
+    """Totais das despesas por categoria e mês, numa única consulta agregada.
+
+    Retorna (ids, nomes, primeiro_mes, totais, inicio): `totais` é um array
+    (categoria, mês) com zero nos meses sem gasto; `inicio` é o índice do
+    primeiro mês com gasto de cada categoria. Sem despesas, retorna None.
+    """
+    linhas = conn.execute("""
+        SELECT IFNULL(categoria_id, 0), strftime('%Y-%m', data) AS ano_mes, SUM(valor)
+        FROM transacao
+        WHERE tipo = 'despesa'
+        GROUP BY IFNULL(categoria_id, 0), strftime('%Y-%m', data)
+        HAVING ano_mes IS NOT NULL
+    """).fetchall()
+    if not linhas:
+        return None
+
+    nomes = dict(conn.execute("SELECT id, nome FROM categoria").fetchall())
+    ids = sorted({categoria_id for categoria_id, _, _ in linhas})
+    posicao = {categoria_id: i for i, categoria_id in enumerate(ids)}
+    meses = [_indice_mes(ano_mes) for _, ano_mes, _ in linhas]
+    primeiro_mes = min(meses)
+
+    totais = np.zeros((len(ids), max(meses) - primeiro_mes + 1))
+    linhas_categoria = np.array([posicao[categoria_id] for categoria_id, _, _ in linhas])
+    colunas_mes = np.array(meses) - primeiro_mes
+    totais[linhas_categoria, colunas_mes] = [total or 0 for _, _, total in linhas]
+
+    inicio = np.full(len(ids), totais.shape[1])
+    np.minimum.at(inicio, linhas_categoria, colunas_mes)
+
+    return ids, [nomes.get(categoria_id, 'Sem categoria') for categoria_id in ids], primeiro_mes, totais, inicio
+
+
+def prever_em_lote(totais, inicio, minimo_meses=MINIMO_MESES_REGRESSAO):
+    """Previsão do mês seguinte ao último para cada linha de `totais` (categoria, mês).
+
+    Modelo por categoria: total[m] ~ b0 + b1*total[m-1] + b2*total[m-2] + b3*total[m-3].
+    Retorna arrays (previsao, margem, meses_treino, usa_regressao), um valor por categoria.
+    """
+    categorias, meses = totais.shape
+    amostras = max(meses - DEFASAGENS, 0)
+
+    # X[c, m, :] = [1, total[m-1], total[m-2], total[m-3]] para m = DEFASAGENS..meses-1
+    X = np.ones((categorias, amostras, DEFASAGENS + 1))
+    for k in range(1, DEFASAGENS + 1):
+        X[:, :, k] = totais[:, DEFASAGENS - k:meses - k]
+    y = totais[:, DEFASAGENS:]
+
+    # Linha válida: as três defasagens estão dentro do histórico da categoria
+    alvo = np.arange(DEFASAGENS, meses)
+    mascara = alvo[None, :] - DEFASAGENS >= inicio[:, None]
+    meses_treino = mascara.sum(axis=1)
+
+    Xm = X * mascara[:, :, None]
+    ym = y * mascara
+    if amostras:
+        coeficientes = np.linalg.pinv(Xm) @ ym[:, :, None]  # (categoria, feature, 1)
+    else:
+        coeficientes = np.zeros((categorias, DEFASAGENS + 1, 1))
+
+    residuos = (Xm @ coeficientes)[:, :, 0] - ym
+    erro = np.sqrt((residuos ** 2).sum(axis=1) / np.maximum(meses_treino, 1))
+
+    # Próximo mês: as defasagens são os três últimos meses (zero antes do início da série)
+    preenchido = np.concatenate([np.zeros((categorias, DEFASAGENS)), totais], axis=1)
+    x_proximo = np.concatenate([np.ones((categorias, 1)), preenchido[:, :-DEFASAGENS - 1:-1]], axis=1)
+    previsao_regressao = (x_proximo[:, None, :] @ coeficientes)[:, 0, 0]
+
+    # Alternativa para históricos curtos: média dos últimos meses dentro do histórico
+    janela = np.arange(max(meses - DEFASAGENS, 0), meses)
+    na_janela = janela[None, :] >= inicio[:, None]
+    media = (totais[:, janela] * na_janela).sum(axis=1) / np.maximum(na_janela.sum(axis=1), 1)
+
+    usa_regressao = meses_treino >= minimo_meses
+    previsao = np.maximum(np.where(usa_regressao, previsao_regressao, media), 0)
+    margem = np.where(usa_regressao, erro, previsao * MARGEM_MEDIA)
+    return previsao, margem, meses_treino, usa_regressao
+
+
+def _serie_em_cache(conn, db_path):
+    impressao = impressao_dados(conn, db_path)
+    guardado = _series.get(db_path)
+    if guardado is not None and guardado[0] == impressao:
+        return guardado[1]
+    with _series_lock:
+        guardado = _series.get(db_path)
+        if guardado is None or guardado[0] != impressao:
+            guardado = (impressao, carregar_serie_mensal(conn))
+            _series[db_path] = guardado
+        return guardado[1]
+
+
+def prever_por_categoria(db_path=None):
+    """Previsão do próximo mês por categoria, da maior para a menor; None sem despesas"""
+    db_path = resolver_caminho_db(db_path)
+    serie = _serie_em_cache(obter_conexao(db_path), db_path)
+    if serie is None:
+        return None
+
+    ids, nomes, primeiro_mes, totais, inicio = serie
+    previsao, margem, meses_treino, usa_regressao = prever_em_lote(totais, inicio)
+    meses = totais.shape[1]
+
+    categorias = [
+        {
+            'categoria_id': categoria_id or None,
+            'categoria': nome,
+            'previsao': round(float(previsao[i]), 2),
+            'minimo': round(float(max(previsao[i] - margem[i], 0)), 2),
+            'maximo': round(float(previsao[i] + margem[i]), 2),
+            'meses_historico': int(meses - inicio[i]),
+            'metodo': 'regressao' if usa_regressao[i] else 'media'
+        }
+        for i, (categoria_id, nome) in enumerate(zip(ids, nomes))
+    ]
+    categorias.sort(key=lambda c: c['previsao'], reverse=True)
+    return {
+        'data_previsao': _ano_mes(primeiro_mes + meses),
+        'total_previsto': round(sum(c['previsao'] for c in categorias), 2),
+        'categorias': categorias
+    }
+
+
+# Função utilitária para usar nas rotas do Flask
+def obter_previsao_por_categoria():
+    """Função para ser chamada pelas rotas do Flask"""
+    return prever_por_categoria()
@@ -9,96 +9,143 @@ from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 from sklearn.preprocessing import LabelEncoder
-import joblib
+import sklearn
 import os
+import threading
 from datetime import datetime, timedelta
-import sqlite3
+from banco import obter_conexao, resolver_caminho_db
+from registro_modelos import RegistroModelos, impressao_treino
+
+# Features do modelo de previsão mensal (gravadas nos metadados de cada versão)
+FEATURES = [
+    'mes', 'qtd_transacoes', 'gastos_por_transacao',
+    'gastos_mes_anterior', 'gastos_2_meses_antes', 'gastos_3_meses_antes',
+    'media_3_meses'
+]
+
+# Versões do modelo em diretório absoluto (MODELOS_DIR), compartilhadas pelo processo
+registro_previsao = RegistroModelos('previsao_gastos')
+
+# Tabela mensal de features por banco: caminho -> (impressão digital dos dados, DataFrame)
+_dados_mensais = {}
+_dados_mensais_lock = threading.Lock()
+
+
+def impressao_dados(conn, db_path):
+    """Identificação barata do estado das transações: maior id, quantidade e a
+    última modificação dos arquivos do banco (o WAL muda a cada commit).
+    O id e a contagem cobrem sistemas de arquivos com mtime de baixa resolução."""
+    # Subconsultas separadas: juntas, MAX e COUNT perdem as otimizações do SQLite
+    # e viram uma varredura da tabela
+    maior_id, quantidade = conn.execute(
+        "SELECT (SELECT MAX(id) FROM transacao), (SELECT COUNT(*) FROM transacao)"
+    ).fetchone()
+    modificado = []
+    for caminho in (db_path, db_path + '-wal'):
+        try:
+            estado = os.stat(caminho)
+            modificado.append((estado.st_mtime_ns, estado.st_size))
+        except OSError:
+            modificado.append(None)
+    return maior_id, quantidade, tuple(modificado)
+
 
 class PrevisaoGastos:
-    def __init__(self, db_path='database/controle_gastos.db'):
-        self.db_path = db_path
+    def __init__(self, db_path=None, registro=None):
+        self.db_path = resolver_caminho_db(db_path)
+        self.registro = registro or registro_previsao
         self.modelo = LinearRegression()
         self.label_encoder = LabelEncoder()
         self.modelo_treinado = False
+        self.metadados_modelo = None
         
     def carregar_dados(self):
-        """Carrega dados do banco SQLite e prepara para ML"""
+        """Carrega dados do banco SQLite e prepara para ML.
+        
+        A tabela mensal é guardada por processo e reaproveitada (por treino,
+        previsão e tendência) enquanto `impressao_dados` não muda. O DataFrame
+        devolvido é compartilhado e não deve ser alterado.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            # Query para buscar transações com suas categorias
-            query = """
-            SELECT t.id, t.descricao, t.valor, t.data, t.tipo, c.nome as categoria
-            FROM transacao t
-            LEFT JOIN categoria c ON t.categoria_id = c.id
-            WHERE t.tipo = 'despesa'
-            ORDER BY t.data
-            """
-            
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            
-            if len(df) == 0:
-                return None
-            
-            # Converter data para datetime
-            df['data'] = pd.to_datetime(df['data'])
-            
-            # Criar features temporais
-            df['ano'] = df['data'].dt.year
-            df['mes'] = df['data'].dt.month
-            df['dia_semana'] = df['data'].dt.dayofweek
-            df['dia_mes'] = df['data'].dt.day
-            
-            # Agrupar por mês para previsão mensal
-            df_mensal = df.groupby([df['data'].dt.year, df['data'].dt.month]).agg({
-                'valor': 'sum',
-                'id': 'count'  # quantidade de transações
-            }).reset_index()
-            
-            df_mensal.columns = ['ano', 'mes', 'total_gastos', 'qtd_transacoes']
-            
-            # Criar uma coluna de data mensal
-            df_mensal['data_mensal'] = pd.to_datetime(df_mensal[['ano', 'mes']].assign(day=1))
-            
-            # Criar features adicionais
-            df_mensal['gastos_por_transacao'] = df_mensal['total_gastos'] / df_mensal['qtd_transacoes']
-            
-            # Criar lag features (valores dos meses anteriores)
-            df_mensal = df_mensal.sort_values('data_mensal')
-            df_mensal['gastos_mes_anterior'] = df_mensal['total_gastos'].shift(1)
-            df_mensal['gastos_2_meses_antes'] = df_mensal['total_gastos'].shift(2)
-            df_mensal['gastos_3_meses_antes'] = df_mensal['total_gastos'].shift(3)
-            
-            # Média móvel dos últimos 3 meses
-            df_mensal['media_3_meses'] = df_mensal['total_gastos'].rolling(window=3).mean()
-            
-            # Remover linhas com NaN (devido aos lags)
-            df_mensal = df_mensal.dropna()
-            
-            return df_mensal
+            conn = obter_conexao(self.db_path)
+            impressao = impressao_dados(conn, self.db_path)
+            guardado = _dados_mensais.get(self.db_path)
+            if guardado is not None and guardado[0] == impressao:
+                return guardado[1]
+            
+            with _dados_mensais_lock:
+                guardado = _dados_mensais.get(self.db_path)
+                if guardado is None or guardado[0] != impressao:
+                    guardado = (impressao, self._montar_dados_mensais(conn))
+                    _dados_mensais[self.db_path] = guardado
+                return guardado[1]
             
         except Exception as e:
             print(f"Erro ao carregar dados: {e}")
             return None
     
-    def treinar_modelo(self):
-        """Treina o modelo de previsão"""
-        df = self.carregar_dados()
+    def _montar_dados_mensais(self, conn):
+        """Totais mensais das despesas e features com lags e média móvel.
+        
+        A agregação por mês é feita no SQLite (índice (tipo, data)); só uma
+        linha por mês chega ao pandas.
+        """
+        query = """
+        SELECT strftime('%Y-%m', data) AS ano_mes,
+               SUM(valor) AS total_gastos,
+               COUNT(*) AS qtd_transacoes
+        FROM transacao
+        WHERE tipo = 'despesa'
+        GROUP BY strftime('%Y-%m', data)
+        HAVING ano_mes IS NOT NULL
+        ORDER BY ano_mes
+        """
+        
+        df_mensal = pd.read_sql_query(query, conn)
+        
+        if len(df_mensal) == 0:
+            return None
+        
+        # Criar uma coluna de data mensal
+        df_mensal['data_mensal'] = pd.to_datetime(df_mensal.pop('ano_mes'), format='%Y-%m')
+        df_mensal.insert(0, 'ano', df_mensal['data_mensal'].dt.year)
+        df_mensal.insert(1, 'mes', df_mensal['data_mensal'].dt.month)
+        
+        # Criar features adicionais
+        df_mensal['gastos_por_transacao'] = df_mensal['total_gastos'] / df_mensal['qtd_transacoes']
+        
+        # Criar lag features (valores dos meses anteriores)
+        df_mensal = df_mensal.sort_values('data_mensal')
+        df_mensal['gastos_mes_anterior'] = df_mensal['total_gastos'].shift(1)
+        df_mensal['gastos_2_meses_antes'] = df_mensal['total_gastos'].shift(2)
+        df_mensal['gastos_3_meses_antes'] = df_mensal['total_gastos'].shift(3)
+        
+        # Média móvel dos últimos 3 meses
+        df_mensal['media_3_meses'] = df_mensal['total_gastos'].rolling(window=3).mean()
+        
+        # Remover linhas com NaN (devido aos lags)
+        df_mensal = df_mensal.dropna()
+        
+        return df_mensal
+    
+    def _impressao_treino(self, df):
+        return impressao_treino(df[FEATURES].to_numpy(), df['total_gastos'].to_numpy())
+    
+    def treinar_modelo(self, df=None, forcar=False):
+        """Treina o modelo de previsão (com a tabela mensal já carregada, se informada).
+        Se a versão salva já foi treinada com os mesmos dados, apenas a carrega."""
+        if df is None:
+            df = self.carregar_dados()
         
         if df is None or len(df) < 4:  # Precisa de pelo menos 4 meses de dados
             print("Dados insuficientes para treinar o modelo (mínimo 4 meses)")
             return False
         
+        if not forcar and self.carregar_modelo(df):
+            return True
+        
         try:
-            # Features para o modelo
-            features = [
-                'mes', 'qtd_transacoes', 'gastos_por_transacao',
-                'gastos_mes_anterior', 'gastos_2_meses_antes', 'gastos_3_meses_antes',
-                'media_3_meses'
-            ]
-            
-            X = df[features]
+            X = df[FEATURES]
             y = df['total_gastos']
             
             # Dividir dados em treino e teste (80/20)
@@ -111,14 +158,17 @@ class PrevisaoGastos:
                 X_train, y_train = X, y
                 X_test, y_test = None, None
             
-            # Treinar modelo
+            # Treinar modelo (um objeto novo: o carregado do registro é compartilhado)
+            self.modelo = LinearRegression()
             self.modelo.fit(X_train, y_train)
+            metricas = {'meses_treino': len(X_train)}
             
             # Avaliar modelo se temos dados de teste
             if X_test is not None:
                 y_pred = self.modelo.predict(X_test)
                 mae = mean_absolute_error(y_test, y_pred)
                 rmse = np.sqrt(mean_squared_error(y_test, y_pred))
+                metricas.update({'mae': float(mae), 'rmse': float(rmse)})
                 
                 print(f"Modelo treinado com sucesso!")
                 print(f"MAE: R$ {mae:.2f}")
@@ -127,24 +177,29 @@ class PrevisaoGastos:
                 print("Modelo treinado com dados limitados")
             
             self.modelo_treinado = True
-            self.salvar_modelo()
+            self.salvar_modelo(self._impressao_treino(df), metricas)
             return True
             
         except Exception as e:
             print(f"Erro ao treinar modelo: {e}")
             return False
     
-    def prever_proximo_mes(self):
+    def prever_proximo_mes(self, df=None):
         """Faz previsão para o próximo mês"""
-        if not self.modelo_treinado:
-            if not self.carregar_modelo():
-                if not self.treinar_modelo():
-                    return None
+        if df is None:
+            df = self.carregar_dados()
         
-        df = self.carregar_dados()
         if df is None or len(df) == 0:
             return None
         
+        # O modelo em uso precisa ter sido treinado com os dados atuais
+        atualizado = (self.modelo_treinado and self.metadados_modelo is not None
+                      and self.metadados_modelo.get('impressao') == self._impressao_treino(df))
+        if not atualizado:
+            if not self.carregar_modelo(df):
+                if not self.treinar_modelo(df, forcar=True):
+                    return None
+        
         try:
             # Pegar dados do último mês para criar features
             ultimo_mes = df.iloc[-1]
@@ -159,7 +214,7 @@ class PrevisaoGastos:
             proximo_mes = proxima_data.month
             
             # Criar features para previsão
-            features_previsao = np.array([[
+            features_previsao = pd.DataFrame([[
                 proximo_mes,
                 media_qtd_transacoes,
                 media_gastos_por_transacao,
@@ -167,7 +222,7 @@ class PrevisaoGastos:
                 df.iloc[-2]['total_gastos'] if len(df) > 1 else ultimo_mes['total_gastos'],  # gastos_2_meses_antes
                 df.iloc[-3]['total_gastos'] if len(df) > 2 else ultimo_mes['total_gastos'],  # gastos_3_meses_antes
                 ultimo_mes['media_3_meses']
-            ]])
+            ]], columns=FEATURES)
             
             previsao = self.modelo.predict(features_previsao)[0]
             
@@ -189,20 +244,23 @@ class PrevisaoGastos:
     def prever_multiplos_meses(self, num_meses=3):
         """Faz previsão para múltiplos meses"""
         previsoes = []
+        # Uma única tabela mensal para o treino, a previsão e a tendência
+        df = self.carregar_dados()
+        tendencia = None
         
         for i in range(num_meses):
             if i == 0:
-                previsao = self.prever_proximo_mes()
+                previsao = self.prever_proximo_mes(df)
             else:
                 # Para meses futuros, usar uma abordagem mais simples
                 # baseada na tendência dos dados históricos
-                df = self.carregar_dados()
                 if df is None:
                     break
                 
                 # Calcular tendência dos últimos 6 meses
-                tendencia = self._calcular_tendencia(df)
-                previsao_base = previsoes[-1]['previsao'] if previsoes else self.prever_proximo_mes()['previsao']
+                if tendencia is None:
+                    tendencia = self._calcular_tendencia(df)
+                previsao_base = previsoes[-1]['previsao'] if previsoes else self.prever_proximo_mes(df)['previsao']
                 
                 if previsao_base:
                     previsao_ajustada = previsao_base * (1 + tendencia)
@@ -256,23 +314,41 @@ class PrevisaoGastos:
         
         return np.mean(diferencas) if diferencas else 0
     
-    def salvar_modelo(self):
-        """Salva o modelo treinado"""
+    def salvar_modelo(self, impressao=None, metricas=None):
+        """Grava o modelo treinado como nova versão no registro, com seus metadados"""
         try:
-            os.makedirs('ml/models', exist_ok=True)
-            joblib.dump(self.modelo, 'ml/models/modelo_previsao.pkl')
-            print("Modelo salvo com sucesso!")
+            self.metadados_modelo = self.registro.salvar(self.modelo, {
+                'impressao': impressao,
+                'features': FEATURES,
+                'sklearn': sklearn.__version__,
+                'metricas': metricas or {},
+                'treinado_em': datetime.now().isoformat(timespec='seconds')
+            })
+            print(f"Modelo salvo com sucesso! (versão {self.metadados_modelo['versao']})")
         except Exception as e:
             print(f"Erro ao salvar modelo: {e}")
     
-    def carregar_modelo(self):
-        """Carrega modelo previamente treinado"""
+    def carregar_modelo(self, df=None):
+        """Carrega a versão salva do modelo, se ela foi treinada com os dados atuais"""
         try:
-            if os.path.exists('ml/models/modelo_previsao.pkl'):
-                self.modelo = joblib.load('ml/models/modelo_previsao.pkl')
-                self.modelo_treinado = True
-                return True
-            return False
+            if df is None:
+                df = self.carregar_dados()
+            if df is None or len(df) == 0:
+                return False
+            
+            salvo = self.registro.carregar()
+            if salvo is None:
+                return False
+            modelo, metadados = salvo
+            # Pickles de outra versão do sklearn não são confiáveis: retreina
+            if (metadados.get('features') != FEATURES or metadados.get('sklearn') != sklearn.__version__
+                    or metadados.get('impressao') != self._impressao_treino(df)):
+                return False
+            
+            self.modelo = modelo
+            self.metadados_modelo = metadados
+            self.modelo_treinado = True
+            return True
         except Exception as e:
             print(f"Erro ao carregar modelo: {e}")
             return False
@@ -280,7 +356,7 @@ class PrevisaoGastos:
     def analisar_padroes_gastos(self):
         """Analisa padrões nos gastos para insights"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = obter_conexao(self.db_path)
             
             # Análise por categoria
             query_categoria = """
@@ -321,7 +397,6 @@ class PrevisaoGastos:
             """
             
             df_mes = pd.read_sql_query(query_mes, conn)
-            conn.close()
             
             return {
                 'por_categoria': df_categoria.to_dict('records'),
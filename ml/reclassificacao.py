@@ -0,0 +1,236 @@
+"""
+Reclassificação em segundo plano das transações sem categoria
+Sistema Web de Controle de Gastos Pessoais
+
+Percorre as transações com categoria_id IS NULL em lotes, na ordem do id,
+classifica cada lote de uma vez e grava o resultado com um único executemany.
+O checkpoint (tabela reclassificacao_checkpoint, migração 5) é gravado na
+mesma transação do lote: um job interrompido continua do último lote gravado.
+"""
+
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from banco import obter_conexao, devolver_conexoes, resolver_caminho_db
+
+TAMANHO_LOTE = 500
+
+# INDEXED BY: sem ANALYZE o SQLite prefere ix_transacao_categoria_data e
+# ordena todas as pendentes a cada lote; o índice parcial já vem na ordem do id
+SQL_PROXIMO_LOTE = """
+    SELECT id, descricao FROM transacao INDEXED BY ix_transacao_sem_categoria
+    WHERE categoria_id IS NULL AND id > ? ORDER BY id LIMIT ?
+"""
+
+
+def _classificar_padrao(descricoes):
+    from classificador import classificar_lote
+    return classificar_lote(descricoes)
+
+
+class JobReclassificacao:
+    """Um job de reclassificação por processo, com iniciar/status/cancelar.
+
+    `classificar` recebe uma lista de descrições e devolve os IDs de categoria
+    na mesma ordem (None quando não houver categoria). As linhas que continuam
+    sem categoria ficam para trás: só uma nova execução com `reiniciar` as revê.
+    `apos_lote`, se informado, é chamado depois de cada lote gravado que
+    classificou alguma linha (ex.: indexar o histórico).
+    """
+
+    def __init__(self, classificar=None, db_path=None, tamanho_lote=TAMANHO_LOTE, apos_lote=None):
+        self.classificar = classificar or _classificar_padrao
+        self.apos_lote = apos_lote
+        self.db_path = resolver_caminho_db(db_path)
+        self.tamanho_lote = tamanho_lote
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cancelar = threading.Event()
+        # Linhas novas avisadas durante a execução; _concluindo: o job já decidiu terminar
+        self._novas = threading.Event()
+        self._concluindo = False
+        self._erro = None
+
+    def em_execucao(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def iniciar(self, reiniciar=False, continuar=False):
+        """Dispara o job numa thread; False se já houver um em execução.
+        Continua do checkpoint, a menos que a última execução tenha terminado
+        ou que `reiniciar` seja pedido.
+        
+        Com `continuar` (quem acabou de gravar linhas sem categoria) também uma
+        execução terminada continua do último id, então só as linhas novas são
+        lidas; com o job em execução, ele as lê antes de terminar.
+        """
+        with self._lock:
+            if self.em_execucao():
+                if not continuar:
+                    return False
+                if not self._concluindo:
+                    self._novas.set()
+                    return True
+                # Já decidiu terminar: só falta gravar o checkpoint final
+                self._thread.join()
+            checkpoint = self._ler_checkpoint(obter_conexao(self.db_path))
+            if reiniciar or checkpoint is None or (checkpoint['estado'] == 'concluido' and not continuar):
+                checkpoint = {'ultimo_id': 0, 'processadas': 0, 'classificadas': 0}
+            self._cancelar.clear()
+            self._novas.clear()
+            self._concluindo = False
+            self._erro = None
+            self._thread = threading.Thread(target=self._executar, args=(checkpoint,), daemon=True)
+            self._thread.start()
+            return True
+
+    def cancelar(self):
+        """Pede a parada após o lote atual; False se não houver job em execução"""
+        if not self.em_execucao():
+            return False
+        self._cancelar.set()
+        return True
+
+    def aguardar(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def status(self):
+        conn = obter_conexao(self.db_path)
+        checkpoint = self._ler_checkpoint(conn) or {
+            'estado': 'ocioso', 'ultimo_id': 0, 'processadas': 0, 'classificadas': 0, 'atualizado_em': None
+        }
+        if self.em_execucao():
+            checkpoint['estado'] = 'cancelando' if self._cancelar.is_set() else 'executando'
+        elif checkpoint['estado'] == 'executando':
+            # Processo reiniciado no meio do job: iniciar() continua daqui
+            checkpoint['estado'] = 'interrompido'
+        checkpoint['pendentes'] = conn.execute(
+            "SELECT COUNT(*) FROM transacao WHERE categoria_id IS NULL AND id > ?",
+            (checkpoint['ultimo_id'],)
+        ).fetchone()[0]
+        checkpoint['erro'] = self._erro
+        return checkpoint
+
+    @staticmethod
+    def _ler_checkpoint(conn):
+        linha = conn.execute(
+            """SELECT estado, ultimo_id, processadas, classificadas, atualizado_em
+               FROM reclassificacao_checkpoint WHERE id = 1"""
+        ).fetchone()
+        if linha is None:
+            return None
+        return dict(zip(('estado', 'ultimo_id', 'processadas', 'classificadas', 'atualizado_em'), linha))
+
+    @staticmethod
+    def _gravar_checkpoint(conn, estado, checkpoint):
+        conn.execute(
+            """INSERT INTO reclassificacao_checkpoint
+                   (id, estado, ultimo_id, processadas, classificadas, atualizado_em)
+               VALUES (1, ?, ?, ?, ?, ?)
+               ON CONFLICT (id) DO UPDATE SET
+                   estado = excluded.estado, ultimo_id = excluded.ultimo_id,
+                   processadas = excluded.processadas, classificadas = excluded.classificadas,
+                   atualizado_em = excluded.atualizado_em""",
+            (estado, checkpoint['ultimo_id'], checkpoint['processadas'], checkpoint['classificadas'],
+             datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+
+    def _executar(self, checkpoint):
+        conn = obter_conexao(self.db_path)
+        estado = 'executando'
+        try:
+            self._gravar_checkpoint(conn, estado, checkpoint)
+            conn.commit()
+            while estado == 'executando':
+                if self._cancelar.is_set():
+                    estado = 'cancelado'
+                elif not self._processar_lote(conn, checkpoint):
+                    with self._lock:
+                        if self._novas.is_set():
+                            # Linhas gravadas durante a execução: mais uma volta
+                            self._novas.clear()
+                        else:
+                            self._concluindo = True
+                            estado = 'concluido'
+            self._gravar_checkpoint(conn, estado, checkpoint)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            self._erro = str(e)
+            print(f"Erro na reclassificação: {e}")
+            try:
+                self._gravar_checkpoint(conn, 'erro', checkpoint)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+        finally:
+            devolver_conexoes()
+
+    def _processar_lote(self, conn, checkpoint):
+        """Classifica e grava o próximo lote; False quando não há mais linhas"""
+        linhas = conn.execute(SQL_PROXIMO_LOTE, (checkpoint['ultimo_id'], self.tamanho_lote)).fetchall()
+        if not linhas:
+            return False
+
+        # Classificação fora da transação de escrita: o classificador usa a
+        # mesma conexão da thread e pode gravar (índice do histórico)
+        categorias = self.classificar([descricao or '' for _, descricao in linhas])
+        novas = {id_: categoria_id for (id_, _), categoria_id in zip(linhas, categorias) if categoria_id}
+
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            classificadas = 0
+            if novas:
+                # Só as linhas que continuam sem categoria: uma edição feita
+                # durante a classificação prevalece
+                marcadores = ', '.join('?' * len(novas))
+                atuais = conn.execute(
+                    f"""SELECT id, strftime('%Y-%m', data), tipo, valor FROM transacao
+                        WHERE categoria_id IS NULL AND id IN ({marcadores})""",
+                    tuple(novas)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE transacao SET categoria_id = ? WHERE id = ?",
+                    [(novas[id_], id_) for id_, _, _, _ in atuais]
+                )
+                self._mover_no_resumo(conn, [(ano_mes, tipo, novas[id_], valor)
+                                             for id_, ano_mes, tipo, valor in atuais])
+                classificadas = len(atuais)
+
+            checkpoint['ultimo_id'] = linhas[-1][0]
+            checkpoint['processadas'] += len(linhas)
+            checkpoint['classificadas'] += classificadas
+            self._gravar_checkpoint(conn, 'executando', checkpoint)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            checkpoint.update(self._ler_checkpoint(conn) or {})
+            raise
+
+        # A versão dos dados (ETags) sobe pelos triggers da migração 7 no UPDATE acima
+        if classificadas and self.apos_lote:
+            self.apos_lote()
+        return True
+
+    @staticmethod
+    def _mover_no_resumo(conn, linhas):
+        """Passa as transações reclassificadas de "sem categoria" (0) para a
+        categoria nova no resumo mensal, na mesma transação do UPDATE"""
+        deltas = defaultdict(lambda: [0.0, 0])
+        for ano_mes, tipo, categoria_id, valor in linhas:
+            for chave, sinal in (((ano_mes, tipo, 0), -1), ((ano_mes, tipo, categoria_id), 1)):
+                deltas[chave][0] += (valor or 0) * sinal
+                deltas[chave][1] += sinal
+        conn.executemany(
+            """INSERT INTO resumo_mensal (ano_mes, tipo, categoria_id, total, quantidade)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (ano_mes, tipo, categoria_id) DO UPDATE SET
+                   total = total + excluded.total, quantidade = quantidade + excluded.quantidade""",
+            [(*chave, total, quantidade) for chave, (total, quantidade) in deltas.items()]
+        )
+        conn.execute("DELETE FROM resumo_mensal WHERE categoria_id = 0 AND quantidade <= 0")
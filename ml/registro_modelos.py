@@ -0,0 +1,148 @@
+"""
+Registro versionado de modelos treinados
+Sistema Web de Controle de Gastos Pessoais
+
+Cada modelo fica em um diretório absoluto (variável MODELOS_DIR ou
+ml/models na raiz do projeto), independente do diretório atual:
+
+    <diretorio>/<nome>/v0007.pkl    artefato (nunca alterado depois de gravado)
+    <diretorio>/<nome>/v0007.json   metadados: impressão dos dados, features, métricas...
+    <diretorio>/<nome>/atual.json   versão em uso
+
+Uma versão nova é gravada inteira antes de `atual.json` ser trocado com
+os.replace, então quem carrega vê a versão anterior ou a nova, nunca uma
+mistura. A versão anterior é mantida para `reverter()`.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import joblib
+
+from banco import RAIZ_PROJETO
+from modelo_em_cache import ModeloEmCache
+
+DIRETORIO_PADRAO = os.path.abspath(os.environ.get('MODELOS_DIR') or os.path.join(RAIZ_PROJETO, 'ml', 'models'))
+
+
+def impressao_treino(*arrays):
+    """Impressão digital (sha256) dos dados de treino, para saber se um modelo salvo está atualizado"""
+    resumo = hashlib.sha256()
+    for array in arrays:
+        resumo.update(repr(array.shape).encode())
+        resumo.update(array.astype('float64').tobytes())
+    return resumo.hexdigest()
+
+
+def _gravar_atomico(caminho, gravar):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+    os.close(fd)
+    try:
+        gravar(tmp_path)
+        os.replace(tmp_path, caminho)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _gravar_json(caminho, dados):
+    def gravar(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, ensure_ascii=False, indent=2)
+    _gravar_atomico(caminho, gravar)
+
+
+def _ler_json(caminho):
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class RegistroModelos:
+    """Versões de um modelo com nome `nome`, guardadas em `diretorio`"""
+
+    def __init__(self, nome, diretorio=None):
+        self.nome = nome
+        self.diretorio = os.path.join(os.path.abspath(diretorio or DIRETORIO_PADRAO), nome)
+        self._lock = threading.Lock()
+        # Versões são imutáveis: o artefato só é lido de novo quando a versão em uso muda
+        self._modelos = ModeloEmCache(joblib.load)
+
+    def _caminho(self, versao, extensao):
+        return os.path.join(self.diretorio, f'v{versao:04d}.{extensao}')
+
+    def _versoes_em_disco(self):
+        try:
+            nomes = os.listdir(self.diretorio)
+        except FileNotFoundError:
+            return []
+        return sorted(int(n[1:-5]) for n in nomes if n.startswith('v') and n.endswith('.json') and n[1:-5].isdigit())
+
+    def versao_atual(self):
+        atual = _ler_json(os.path.join(self.diretorio, 'atual.json'))
+        return atual['versao'] if atual else None
+
+    def metadados(self, versao=None):
+        """Metadados da versão informada (ou da atual); None se não houver"""
+        versao = self.versao_atual() if versao is None else versao
+        return None if versao is None else _ler_json(self._caminho(versao, 'json'))
+
+    def versoes(self):
+        """Metadados das versões guardadas, da mais antiga para a mais nova"""
+        return [m for m in (self.metadados(v) for v in self._versoes_em_disco()) if m]
+
+    def salvar(self, modelo, metadados):
+        """Grava uma nova versão e passa a usá-la; retorna os metadados gravados"""
+        with self._lock:
+            os.makedirs(self.diretorio, exist_ok=True)
+            versoes = self._versoes_em_disco()
+            anterior = self.versao_atual()
+            versao = (versoes[-1] if versoes else 0) + 1
+            metadados = {**metadados, 'nome': self.nome, 'versao': versao}
+
+            _gravar_atomico(self._caminho(versao, 'pkl'), lambda caminho: joblib.dump(modelo, caminho))
+            _gravar_json(self._caminho(versao, 'json'), metadados)
+            _gravar_json(os.path.join(self.diretorio, 'atual.json'), {'versao': versao})
+
+            # Mantém só a versão nova e a que estava em uso (para reverter)
+            for antiga in versoes:
+                if antiga == anterior:
+                    continue
+                for extensao in ('json', 'pkl'):
+                    try:
+                        os.remove(self._caminho(antiga, extensao))
+                    except FileNotFoundError:
+                        pass
+            return metadados
+
+    def carregar(self):
+        """(modelo, metadados) da versão em uso, ou None se não houver modelo salvo"""
+        # Se uma versão for removida entre ler atual.json e abrir o artefato,
+        # lê atual.json de novo
+        for _ in range(3):
+            versao = self.versao_atual()
+            if versao is None:
+                return None
+            metadados = self.metadados(versao)
+            try:
+                modelo = self._modelos.obter(self._caminho(versao, 'pkl'))
+            except FileNotFoundError:
+                modelo = None
+            if modelo is not None and metadados is not None:
+                return modelo, metadados
+        return None
+
+    def reverter(self):
+        """Volta para a versão anterior à atual; retorna seus metadados ou None"""
+        with self._lock:
+            atual = self.versao_atual()
+            anteriores = [v for v in self._versoes_em_disco() if atual is None or v < atual]
+            if not anteriores:
+                return None
+            _gravar_json(os.path.join(self.diretorio, 'atual.json'), {'versao': anteriores[-1]})
+            return self.metadados(anteriores[-1])
@@ -0,0 +1,130 @@
+"""
+Versão dos dados e respostas condicionais (ETag / If-None-Match)
+Sistema Web de Controle de Gastos Pessoais
+
+Cada rota de escrita chama `incrementar()`; as rotas de leitura usam o
+decorador `condicional` para responder 304 sem montar a resposta quando o
+cliente já tem a versão atual.
+
+Com um banco (backend, migração 7) a versão é a linha da tabela
+versao_dados, incrementada por triggers em cada escrita de transacao,
+categoria e categoria_palavra: todos os processos que servem o mesmo banco
+enxergam a mesma versão. Sem banco (instância `versao_dados`, usada pelo
+app.py da raiz) o contador vive no processo, e só um processo servindo os
+dados é suportado.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+from functools import wraps
+
+
+class VersaoDados:
+    """Versão global dos dados, segura entre threads.
+    
+    No modo em memória, o token de início faz com que ETags emitidas antes de
+    um reinício nunca sejam aceitas depois dele. No modo banco, o token é
+    gravado junto com o contador, então é o mesmo em todos os processos.
+    """
+    
+    def __init__(self, db_path=None):
+        self._lock = threading.Lock()
+        self._numero = 0
+        self._modificado_em = datetime.now(timezone.utc).replace(microsecond=0)
+        self._token = f"{os.getpid():x}{int(time.time()):x}"
+        # Banco com a tabela versao_dados; None mantém o contador só no processo
+        self._db_path = db_path
+    
+    def _ler_banco(self):
+        """(token, número, modificado_em) da tabela versao_dados; None sem banco ou sem a migração"""
+        if self._db_path is None:
+            return None
+        from banco import obter_conexao
+        try:
+            linha = obter_conexao(self._db_path).execute(
+                "SELECT token, versao, modificado_em FROM versao_dados WHERE id = 1"
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if linha is None:
+            return None
+        token, numero, modificado_em = linha
+        return token, numero, datetime.fromisoformat(modificado_em).replace(tzinfo=timezone.utc)
+    
+    @property
+    def numero(self):
+        linha = self._ler_banco()
+        return self._numero if linha is None else linha[1]
+    
+    @property
+    def modificado_em(self):
+        linha = self._ler_banco()
+        return self._modificado_em if linha is None else linha[2]
+    
+    def incrementar(self):
+        """Registra uma escrita nos dados.
+        No modo banco as escritas em transacao, categoria e categoria_palavra
+        já sobem a versão pelos triggers (no mesmo commit); chamar só para
+        escritas fora dessas tabelas, pois aqui é aberta outra transação."""
+        if self._db_path is not None:
+            from banco import obter_conexao
+            conn = obter_conexao(self._db_path)
+            try:
+                conn.execute(
+                    "UPDATE versao_dados SET versao = versao + 1, modificado_em = datetime('now') WHERE id = 1"
+                )
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+        with self._lock:
+            self._numero += 1
+            self._modificado_em = datetime.now(timezone.utc).replace(microsecond=0)
+            return self._numero
+    
+    def estado(self):
+        """(ETag, modificado_em) lidos de uma só vez"""
+        linha = self._ler_banco()
+        if linha is None:
+            linha = (self._token, self._numero, self._modificado_em)
+        token, numero, modificado_em = linha
+        # A data entra na ETag porque resumos do "mês atual" mudam na virada do dia/mês
+        return f"{token}-{numero}-{date.today().isoformat()}", modificado_em
+    
+    def etag(self):
+        return self.estado()[0]
+    
+    def condicional(self, view):
+        """Decorador para rotas de leitura: envia ETag/Last-Modified e responde 304 quando possível"""
+        from flask import request, make_response
+    
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # ETag calculada antes da leitura: se houver escrita no meio, o cliente revalida depois
+            etag, modificado_em = self.estado()
+        
+            if request.if_none_match.contains_weak(etag):
+                resposta = make_response('', 304)
+            else:
+                resposta = make_response(view(*args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+                # Resultado de uma versão anterior (ver cache_revalidacao): sem ETag,
+                # para o cliente não guardá-lo como se fosse o da versão atual
+                if 'X-Resultado-Desatualizado' in resposta.headers:
+                    resposta.headers['Cache-Control'] = 'no-cache'
+                    return resposta
+        
+            resposta.set_etag(etag, weak=True)
+            resposta.last_modified = modificado_em
+            resposta.headers['Cache-Control'] = 'no-cache'
+            return resposta
+    
+        return wrapper
+
+
+# Instância em memória compartilhada pelo processo
+versao_dados = VersaoDados()
+condicional = versao_dados.condicional
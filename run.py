@@ -89,6 +89,45 @@ def executar_aplicacao():
         print(f"\n❌ Erro ao executar aplicação: {e}")
         return False
 
+def migrar_banco():
+    """Aplica as migrações pendentes e confere os planos das consultas frequentes"""
+    backend_dir = Path(__file__).parent / 'backend'
+    os.chdir(backend_dir)
+    sys.path.insert(0, str(backend_dir))
+    
+    from app import app, init_database, db
+    from migracoes import versao_esquema, verificar_planos_consulta
+    
+    with app.app_context():
+        init_database()
+        with db.engine.connect() as conn:
+            print(f"✓ Esquema do banco na versão {versao_esquema(conn)}")
+        
+        problemas = verificar_planos_consulta(db.engine)
+    
+    if problemas:
+        for problema in problemas:
+            print(f"✗ Varredura completa em '{problema['consulta']}': {problema['plano']}")
+        return False
+    
+    print("✓ Todas as consultas frequentes usam índices")
+    return True
+
+def reconstruir_resumo():
+    """Recalcula o resumo mensal do dashboard a partir das transações"""
+    backend_dir = Path(__file__).parent / 'backend'
+    os.chdir(backend_dir)
+    sys.path.insert(0, str(backend_dir))
+    
+    from app import app, init_database, reconstruir_resumo_mensal
+    
+    with app.app_context():
+        init_database()
+        reconstruir_resumo_mensal()
+    
+    print("✓ Resumo mensal reconstruído")
+    return True
+
 def mostrar_ajuda():
     """Mostra informações de ajuda"""
     print("""
@@ -102,6 +141,8 @@ Opções:
   --setup        Instala dependências
   --test         Executa testes
   --docs         Gera documentação
+  --migrar       Aplica migrações do banco e verifica índices
+  --reconstruir-resumo  Recalcula o resumo mensal do dashboard
 
 Sem argumentos: Executa a aplicação
 
@@ -147,6 +188,10 @@ if __name__ == '__main__':
             instalar_dependencias()
         elif arg == '--test':
             executar_testes()
+        elif arg == '--migrar':
+            sys.exit(0 if migrar_banco() else 1)
+        elif arg == '--reconstruir-resumo':
+            reconstruir_resumo()
         elif arg == '--docs':
             print("📚 Documentação em desenvolvimento...")
         else:
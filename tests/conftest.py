@@ -0,0 +1,74 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..', 'backend')
+BACKEND_APP = os.path.join(BACKEND_DIR, 'app.py')
+
+# Módulos auxiliares do backend (migracoes etc.); append para não esconder o app.py da raiz
+sys.path.append(BACKEND_DIR)
+
+# (valor anterior de DADOS_DIR, diretório temporário da sessão)
+_dados_dir = (None, None)
+
+
+def pytest_configure(config):
+    # O app.py da raiz liga o engine ao importar: DADOS_DIR precisa estar
+    # definido antes da coleta, para os testes nunca tocarem em data/financas.db
+    global _dados_dir
+    _dados_dir = (os.environ.get('DADOS_DIR'), tempfile.mkdtemp(prefix='dados_testes_'))
+    os.environ['DADOS_DIR'] = _dados_dir[1]
+
+
+def pytest_unconfigure(config):
+    anterior, temporario = _dados_dir
+    if temporario is None:
+        return
+    shutil.rmtree(temporario, ignore_errors=True)
+    if anterior is None:
+        os.environ.pop('DADOS_DIR', None)
+    else:
+        os.environ['DADOS_DIR'] = anterior
+
+
+@pytest.fixture(scope='session')
+def backend_modulo(tmp_path_factory):
+    # backend/app.py tem o mesmo nome do app.py da raiz, então é carregado com outro nome
+    db_path = tmp_path_factory.mktemp('backend') / 'controle_gastos.db'
+    # DATABASE_URL só vale durante a sessão: restaurado no fim para não vazar
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('DATABASE_URL', f'sqlite:///{db_path}')
+        spec = importlib.util.spec_from_file_location('backend_app', BACKEND_APP)
+        modulo = importlib.util.module_from_spec(spec)
+        sys.modules['backend_app'] = modulo
+        spec.loader.exec_module(modulo)
+        modulo.app.config['TESTING'] = True
+        yield modulo
+
+
+@pytest.fixture
+def backend(backend_modulo):
+    from classificador import aguardar_indexacao_historico
+
+    # Job e indexação disparados pelo teste anterior não podem rodar durante o drop_all
+    backend_modulo.job_reclassificacao.aguardar()
+    aguardar_indexacao_historico()
+    with backend_modulo.app.app_context():
+        backend_modulo.db.drop_all()
+        # drop_all não zera a versão do esquema; sem isso as migrações não rodariam de novo
+        with backend_modulo.db.engine.begin() as conn:
+            conn.exec_driver_sql('PRAGMA user_version = 0')
+        backend_modulo.init_database()
+    # O banco foi recriado sem passar pelas rotas de escrita: descarta previsões guardadas
+    backend_modulo.resultados_ml.limpar()
+    yield backend_modulo
+
+
+@pytest.fixture
+def backend_client(backend):
+    with backend.app.test_client() as client:
+        yield client
@@ -1,23 +1,26 @@
 import os
-import tempfile
 import pytest
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.engine import CursorResult
 
-from app import app, db, Transacao
+from app import app, db, Transacao, aguardar_treino, CSV_LINHAS_POR_BLOCO
 
 
 @pytest.fixture
-def client(tmp_path):
-    db_fd, db_path = tempfile.mkstemp(suffix='.db')
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+def client():
+    # O banco fica em DADOS_DIR (diretório temporário definido no conftest);
+    # cada teste começa com as tabelas vazias
     app.config['TESTING'] = True
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
 
     with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
         yield client
 
-    os.close(db_fd)
-    os.remove(db_path)
+    # um treino disparado pelo teste não pode continuar no teste seguinte
+    aguardar_treino()
 
 
 def test_index(client):
@@ -50,3 +53,204 @@ def test_classify_endpoint(client):
     if rv.status_code == 200:
         j = rv.get_json()
         assert 'categoria' in j
+
+
+def test_etag_e_304_em_leitura(client):
+    rv = client.get('/transacoes_json')
+    assert rv.status_code == 200
+    etag = rv.headers['ETag']
+    assert rv.headers.get('Last-Modified')
+
+    rv = client.get('/transacoes_json', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+
+    # uma escrita muda a versão dos dados e invalida a ETag
+    client.post('/adicionar', data={'tipo': 'Despesa', 'categoria': '', 'valor': '1.00',
+                                    'data': '2025-01-10', 'descricao': 'etag teste'})
+    rv = client.get('/transacoes_json', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+
+
+def test_exportar_csv_com_filtros(client):
+    with app.app_context():
+        db.session.add(Transacao('Receita', 'Salário', 10.0, datetime(2031, 5, 1), 'export receita'))
+        db.session.add(Transacao('Despesa', 'Lazer', 4.0, datetime(2031, 5, 2), 'export despesa'))
+        db.session.commit()
+    rv = client.get('/exportar_csv?tipo=Despesa&data_inicio=2031-05-01&data_fim=2031-05-31')
+    assert rv.status_code == 200
+    linhas = rv.get_data(as_text=True).strip().splitlines()
+    assert linhas[0] == 'id,tipo,categoria,valor,data,descricao'
+    assert len(linhas) == 2
+    assert linhas[1].endswith('Despesa,Lazer,4.0,2031-05-02,export despesa')
+
+
+def test_exportar_csv_busca_linhas_em_blocos(client, monkeypatch):
+    # Memória constante = nunca mais que um bloco de linhas buscado do cursor por vez
+    buscas = []
+    fetchmany = CursorResult.fetchmany
+    def fetchmany_contado(self, size=None):
+        linhas = fetchmany(self, size)
+        buscas.append(len(linhas))
+        return linhas
+    def sem_carga_completa(self):
+        raise AssertionError('exportação carregou todas as linhas de uma vez')
+    monkeypatch.setattr(CursorResult, 'fetchmany', fetchmany_contado)
+    monkeypatch.setattr(CursorResult, '_raw_all_tuples', sem_carga_completa)
+    monkeypatch.setattr(CursorResult, 'fetchall', sem_carga_completa)
+
+    quantidade = CSV_LINHAS_POR_BLOCO * 5 + 7
+    with app.app_context():
+        db.session.execute(insert(Transacao), [
+            {'tipo': 'Despesa', 'categoria': 'Teste', 'valor': float(i),
+             'data': datetime(2030, 1, 1).date(), 'descricao': f'bloco {i}'}
+            for i in range(quantidade)
+        ])
+        db.session.commit()
+
+    rv = client.get('/exportar_csv?data_inicio=2030-01-01&data_fim=2030-01-01')
+    blocos = list(rv.response)
+    assert sum(bloco.count(b'\n') for bloco in blocos) == quantidade + 1
+    assert sum(buscas) == quantidade
+    assert max(buscas) <= CSV_LINHAS_POR_BLOCO
+    # A resposta também sai em blocos, não num único corpo
+    assert len(blocos) > quantidade // CSV_LINHAS_POR_BLOCO
+
+
+def test_importar_csv_relatorio(client):
+    import io
+
+    conteudo = (
+        'tipo,categoria,valor,data,descricao\n'
+        'Despesa,Lazer,10.5,15/03/2032,importado cinema\n'
+        'Despesa,Lazer,abc,16/03/2032,importado valor ruim\n'
+        'Receita,Salário,100,2032-03-20,importado salario\n'
+        'Despesa,Lazer,3,31/02/2032,importado data ruim\n'
+    ).encode('utf-8')
+    rv = client.post('/importar_csv', data={'file': (io.BytesIO(conteudo), 'extrato.csv')},
+                     headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+    assert rv.status_code == 200
+    relatorio = rv.get_json()
+    assert relatorio['aceitas'] == 2
+    assert relatorio['rejeitadas'] == 2
+    assert relatorio['erros'] == [
+        {'linha': 3, 'motivo': "valor inválido: 'abc'"},
+        {'linha': 5, 'motivo': "data inválida: '31/02/2032'"},
+    ]
+
+    with app.app_context():
+        t = Transacao.query.filter_by(descricao='importado cinema').first()
+        assert t.data.strftime('%Y-%m-%d') == '2032-03-15'
+        Transacao.query.filter(Transacao.descricao.like('importado %')).delete(synchronize_session=False)
+        db.session.commit()
+
+    # Arquivo que não é UTF-8: nada é importado e o relatório mantém as mesmas chaves
+    rv = client.post('/importar_csv', data={'file': (io.BytesIO(b'tipo,valor\n\xff\xfe,1\n'), 'ruim.csv')},
+                     headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+    assert rv.status_code == 400
+    relatorio = rv.get_json()
+    assert (relatorio['aceitas'], relatorio['rejeitadas'], relatorio['erros']) == (0, 0, [])
+    assert relatorio['message'].startswith('arquivo inválido')
+
+
+def test_detector_formato_data_reaproveita_formato():
+    from app import DetectorFormatoData
+
+    detector = DetectorFormatoData()
+    assert detector.converter('05/01/2024') == datetime(2024, 1, 5)
+    assert detector.formato == '%d/%m/%Y'
+    assert detector.converter('2024-01-06') == datetime(2024, 1, 6)
+
+
+def test_cache_de_previsoes_por_descricao_normalizada(client):
+    from app import cache_previsoes
+    antes = client.get('/classificar_stats').get_json()
+    client.post('/classificar', json={'descricao': 'UBER *TRIP centro'})
+    client.post('/classificar', json={'descricao': 'uber trip  centro'})
+    depois = client.get('/classificar_stats').get_json()
+    assert depois['falhas'] - antes['falhas'] == 1
+    assert depois['acertos'] - antes['acertos'] == 1
+    assert depois['capacidade'] == cache_previsoes.capacidade
+
+
+def test_classificar_lote_com_modelo(client, tmp_path, monkeypatch):
+    import app as modulo
+    monkeypatch.setattr(modulo, 'data_dir', str(tmp_path))
+    with app.app_context():
+        for descricao, categoria in [('uber centro', 'Transporte'), ('uber aeroporto', 'Transporte'),
+                                     ('taxi rodoviaria', 'Transporte'), ('mercado extra', 'Alimentação'),
+                                     ('mercado dia', 'Alimentação'), ('padaria pao', 'Alimentação')]:
+            db.session.add(Transacao('Despesa', categoria, 10, datetime(2025, 1, 1), descricao))
+        db.session.commit()
+    assert client.get('/treinar_classificador').get_json()['status'] == 'ok'
+
+    descricoes = ['UBER centro', 'mercado  dia', 'uber centro!', 'padaria']
+    rv = client.post('/classificar_lote', json={'descricoes': descricoes})
+    assert rv.status_code == 200
+    categorias = rv.get_json()['categorias']
+    assert categorias[0] == categorias[2] == 'Transporte'
+    assert categorias == [modulo.predict_with_model(d) for d in descricoes]
+    assert client.post('/classificar_lote', json={'descricoes': 'uber'}).status_code == 400
+
+
+def test_previsao_sem_modelo_treina_fora_da_requisicao(client, tmp_path, monkeypatch):
+    import app as modulo
+    from versao_dados import versao_dados
+    monkeypatch.setattr(modulo, 'data_dir', str(tmp_path))
+    with app.app_context():
+        for descricao, categoria in [('zqxmob corrida', 'Mobilidade'), ('zqxmob aeroporto', 'Mobilidade'),
+                                     ('zqxmob centro', 'Mobilidade'), ('wvkfeira livre', 'Feira'),
+                                     ('wvkfeira domingo', 'Feira'), ('wvkfeira bairro', 'Feira')]:
+            db.session.add(Transacao('Despesa', categoria, 10, datetime(2025, 1, 1), descricao))
+        db.session.commit()
+    versao_dados.incrementar()
+
+    # Sem modelo salvo: responde na hora com a heurística e treina em segundo plano
+    assert modulo.predict_with_model('zqxmob noite') == 'Outros'
+    aguardar_treino()
+    _, model_path = modulo.get_model_paths()
+    assert os.path.exists(model_path)
+
+    # O novo arquivo é carregado uma vez e invalida as previsões heurísticas guardadas
+    recargas = modulo.modelo_em_cache.recargas
+    assert modulo.predict_with_model('zqxmob noite') == 'Mobilidade'
+    assert modulo.predict_with_model('wvkfeira noite') == 'Feira'
+    assert modulo.modelo_em_cache.recargas == recargas + 1
+
+
+def test_treino_incremental_consome_so_transacoes_novas(client, tmp_path, monkeypatch):
+    import json
+    import app as modulo
+    monkeypatch.setattr(modulo, 'data_dir', str(tmp_path))
+
+    def adicionar(linhas):
+        with app.app_context():
+            for descricao, categoria in linhas:
+                db.session.add(Transacao('Despesa', categoria, 10, datetime(2025, 1, 1), descricao))
+            db.session.commit()
+
+    adicionar([('qzkbike aluguel', 'Bicicleta'), ('qzkbike pedal', 'Bicicleta'), ('qzkbike oficina', 'Bicicleta'),
+               ('wqmcafe expresso', 'Alimentação'), ('wqmcafe pingado', 'Alimentação')])
+    primeiro = client.get('/treinar_classificador?modo=incremental').get_json()
+    assert primeiro['status'] == 'ok' and primeiro['reconstruido']
+
+    adicionar([('qzkbike corrente', 'Bicicleta'), ('qzkbike pneu', 'Bicicleta')])
+    res = client.get('/treinar_classificador?modo=incremental').get_json()
+    assert res['novas_amostras'] == 2 and not res['reconstruido']
+    assert res['n_samples'] == primeiro['n_samples'] + 2
+    with app.app_context():
+        ultimo_id = db.session.query(db.func.max(Transacao.id)).scalar()
+    with open(modulo.get_checkpoint_path()) as f:
+        assert json.load(f)['ultimo_id'] == ultimo_id
+    assert modulo.predict_with_model('qzkbike freio') == 'Bicicleta'
+
+    assert client.get('/treinar_classificador?modo=incremental').get_json()['novas_amostras'] == 0
+
+    # Categoria nova não cabe no partial_fit: o modelo incremental é refeito
+    adicionar([('jvxbarco marina', 'Nautica')])
+    res = client.get('/treinar_classificador?modo=incremental').get_json()
+    assert res['reconstruido'] and res['n_samples'] == primeiro['n_samples'] + 3
+
+    # O treino completo continua disponível e descarta o checkpoint
+    assert client.get('/treinar_classificador').get_json()['status'] == 'ok'
+    assert not os.path.exists(modulo.get_checkpoint_path())
@@ -0,0 +1,484 @@
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+
+def inserir_transacoes(backend, quantidade, tipo='despesa'):
+    with backend.app.app_context():
+        inicio = date(2025, 1, 1)
+        for i in range(quantidade):
+            backend.db.session.add(backend.Transacao(
+                descricao=f'compra {i}',
+                valor=float(i + 1),
+                data=inicio + timedelta(days=i // 3),
+                tipo=tipo
+            ))
+        backend.db.session.commit()
+
+
+def test_listagem_sem_paginacao_mantem_formato(backend, backend_client):
+    inserir_transacoes(backend, 3)
+    rv = backend_client.get('/api/transacoes')
+    assert rv.status_code == 200
+    assert isinstance(rv.get_json(), list)
+    assert len(rv.get_json()) == 3
+
+
+def test_paginacao_por_cursor_percorre_todas_as_linhas(backend, backend_client):
+    inserir_transacoes(backend, 25)
+    vistos = []
+    cursor = None
+    while True:
+        url = '/api/transacoes?limite=10' + (f'&cursor={cursor}' if cursor else '')
+        pagina = backend_client.get(url).get_json()
+        vistos.extend(t['id'] for t in pagina['transacoes'])
+        cursor = pagina['next_cursor']
+        if not cursor:
+            break
+    assert len(vistos) == 25
+    assert len(set(vistos)) == 25
+
+
+def test_filtros_no_servidor(backend, backend_client):
+    inserir_transacoes(backend, 9)
+    inserir_transacoes(backend, 2, tipo='receita')
+    rv = backend_client.get('/api/transacoes?limite=50&tipo=despesa&valor_min=3&valor_max=6'
+                            '&data_inicio=2025-01-01&data_fim=2025-01-02')
+    transacoes = rv.get_json()['transacoes']
+    assert [t['valor'] for t in transacoes] == [6.0, 5.0, 4.0, 3.0]
+    assert all(t['tipo'] == 'despesa' for t in transacoes)
+
+
+def test_cursor_invalido(backend_client):
+    rv = backend_client.get('/api/transacoes?cursor=invalido')
+    assert rv.status_code == 400
+
+
+def contar_consultas(backend, func):
+    from sqlalchemy import event
+
+    consultas = []
+
+    def registrar(conn, cursor, statement, *args):
+        consultas.append(statement)
+
+    with backend.app.app_context():
+        engine = backend.db.engine
+    event.listen(engine, 'before_cursor_execute', registrar)
+    try:
+        func()
+    finally:
+        event.remove(engine, 'before_cursor_execute', registrar)
+    return len(consultas)
+
+
+def categorizar_todas(backend):
+    with backend.app.app_context():
+        categorias = backend.Categoria.query.all()
+        for i, t in enumerate(backend.Transacao.query.all()):
+            t.categoria_id = categorias[i % len(categorias)].id
+        backend.db.session.commit()
+
+
+def test_listagem_com_numero_constante_de_consultas(backend, backend_client):
+    inserir_transacoes(backend, 5)
+    categorizar_todas(backend)
+    poucas = contar_consultas(backend, lambda: backend_client.get('/api/transacoes'))
+
+    inserir_transacoes(backend, 40)
+    categorizar_todas(backend)
+    muitas = contar_consultas(backend, lambda: backend_client.get('/api/transacoes'))
+
+    assert poucas == muitas
+
+
+def test_serializacao_igual_ao_to_dict(backend, backend_client):
+    inserir_transacoes(backend, 6)
+    categorizar_todas(backend)
+    with backend.app.app_context():
+        esperado = [t.to_dict() for t in backend.Transacao.query.order_by(
+            backend.Transacao.data.desc(), backend.Transacao.id.desc())]
+    assert backend_client.get('/api/transacoes').get_json() == esperado
+
+
+def test_migracoes_criam_indices_sem_perder_dados(tmp_path):
+    import sqlite3
+    from sqlalchemy import create_engine
+    from migracoes import MIGRACOES, aplicar_migracoes, versao_esquema
+
+    # banco no formato antigo, sem índices além da chave primária
+    db_path = tmp_path / 'antigo.db'
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE categoria (id INTEGER PRIMARY KEY, nome VARCHAR(80) NOT NULL, palavras_chave TEXT);
+        CREATE TABLE transacao (id INTEGER PRIMARY KEY, descricao VARCHAR(200) NOT NULL, valor FLOAT NOT NULL,
+                                data DATE NOT NULL, tipo VARCHAR(10) NOT NULL, categoria_id INTEGER);
+        INSERT INTO transacao (descricao, valor, data, tipo) VALUES ('mercado', 10.0, '2025-01-01', 'despesa');
+    """)
+    conn.close()
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    assert aplicar_migracoes(engine) == [v for v, _, _ in MIGRACOES]
+    assert aplicar_migracoes(engine) == []
+
+    with engine.connect() as conn:
+        assert versao_esquema(conn) == MIGRACOES[-1][0]
+        indices = {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert conn.exec_driver_sql('SELECT COUNT(*) FROM transacao').scalar() == 1
+    assert {'ix_transacao_tipo_data', 'ix_transacao_categoria_data', 'ix_transacao_descricao_categoria'} <= indices
+
+
+def test_consultas_frequentes_nao_varrem_a_tabela(backend):
+    from migracoes import verificar_planos_consulta
+
+    with backend.app.app_context():
+        assert verificar_planos_consulta(backend.db.engine) == []
+
+
+def test_lote_da_reclassificacao_usa_o_indice_parcial(backend):
+    from reclassificacao import SQL_PROXIMO_LOTE
+
+    with backend.app.app_context(), backend.db.engine.connect() as conn:
+        plano = [linha[-1] for linha in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {SQL_PROXIMO_LOTE}', (0, 500))]
+    assert plano == ['SEARCH transacao USING INDEX ix_transacao_sem_categoria (id>?)']
+
+
+def resumo_atual(backend):
+    with backend.app.app_context():
+        return sorted(
+            (r.ano_mes, r.tipo, r.categoria_id, round(r.total, 2), r.quantidade)
+            for r in backend.ResumoMensal.query.all()
+        )
+
+
+def test_resumo_mensal_acompanha_crud(backend, backend_client):
+    hoje = date.today().strftime('%Y-%m-%d')
+    ids = []
+    for valor, tipo in [(100.0, 'despesa'), (50.0, 'despesa'), (300.0, 'receita')]:
+        rv = backend_client.post('/api/transacoes', json={
+            'descricao': 'supermercado', 'valor': valor, 'data': hoje, 'tipo': tipo
+        })
+        ids.append(rv.get_json()['id'])
+
+    backend_client.put(f'/api/transacoes/{ids[0]}', json={
+        'descricao': 'supermercado', 'valor': 80.0, 'data': '2024-05-10', 'tipo': 'despesa'
+    })
+    backend_client.delete(f'/api/transacoes/{ids[1]}')
+
+    incremental = resumo_atual(backend)
+    with backend.app.app_context():
+        backend.reconstruir_resumo_mensal()
+    assert incremental == resumo_atual(backend)
+
+    resumo = backend_client.get('/api/dashboard/resumo').get_json()
+    assert resumo == {'receitas_mes': 300.0, 'despesas_mes': 0, 'saldo_mes': 300.0}
+
+
+def test_reconstruir_resumo_corrige_divergencia(backend, backend_client):
+    # inserções diretas no banco não passam pelo resumo
+    inserir_transacoes(backend, 6)
+    assert resumo_atual(backend) == []
+    with backend.app.app_context():
+        backend.reconstruir_resumo_mensal()
+    assert resumo_atual(backend) == [('2025-01', 'despesa', 0, 21.0, 6)]
+
+
+def test_snapshot_do_dashboard(backend, backend_client):
+    hoje = date.today().strftime('%Y-%m-%d')
+    for descricao, valor, data_str, tipo in [
+        ('salario', 1000.0, hoje, 'receita'),
+        ('supermercado', 200.0, hoje, 'despesa'),
+        ('uber', 30.0, '2024-03-02', 'despesa'),
+    ]:
+        backend_client.post('/api/transacoes', json={
+            'descricao': descricao, 'valor': valor, 'data': data_str, 'tipo': tipo
+        })
+
+    snapshot = backend_client.get('/api/dashboard/snapshot?ultimas=2').get_json()
+
+    assert snapshot['resumo'] == backend_client.get('/api/dashboard/resumo').get_json()
+    assert snapshot['gastos_por_categoria'] == backend_client.get('/api/dashboard/gastos-por-categoria').get_json()
+    assert [t['descricao'] for t in snapshot['ultimas_transacoes']] == ['supermercado', 'salario']
+    assert snapshot['gastos_mensais'] == [
+        {'mes': '2024-03', 'total': 30.0},
+        {'mes': date.today().strftime('%Y-%m'), 'total': 200.0},
+    ]
+
+
+def test_etag_e_304_sem_consultar_o_banco(backend, backend_client):
+    rv = backend_client.get('/api/dashboard/snapshot')
+    etag = rv.headers['ETag']
+
+    def revalidar():
+        rv = backend_client.get('/api/dashboard/snapshot', headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+
+    assert contar_consultas(backend, revalidar) == 0
+
+    backend_client.post('/api/transacoes', json={
+        'descricao': 'padaria', 'valor': 10.0, 'data': '2025-01-01', 'tipo': 'despesa'
+    })
+    rv = backend_client.get('/api/dashboard/snapshot', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+
+
+def test_etag_muda_com_escrita_de_outro_processo(backend, backend_client):
+    import sqlite3
+    from banco import resolver_caminho_db
+
+    etag = backend_client.get('/api/categorias').headers['ETag']
+    assert backend_client.get('/api/categorias', headers={'If-None-Match': etag}).status_code == 304
+
+    # Outro worker grava direto no banco, sem passar pelo contador deste processo
+    outro = sqlite3.connect(resolver_caminho_db())
+    outro.execute("INSERT INTO categoria (nome) VALUES ('Pets')")
+    outro.commit()
+    outro.close()
+
+    rv = backend_client.get('/api/categorias', headers={'If-None-Match': etag})
+    assert rv.status_code == 200 and rv.headers['ETag'] != etag
+    assert 'Pets' in [c['nome'] for c in rv.get_json()]
+
+
+def test_criacao_em_lote(backend, backend_client):
+    itens = [
+        {'descricao': 'supermercado extra', 'valor': 10, 'data': '2025-02-01', 'tipo': 'despesa'},
+        {'descricao': 'sem valor', 'data': '2025-02-01', 'tipo': 'despesa'},
+        {'descricao': 'supermercado extra', 'valor': 5.5, 'data': '2025-02-03', 'tipo': 'despesa'},
+        {'descricao': 'salario', 'valor': 1000, 'data': '2025-02-05', 'tipo': 'outro'},
+        {'descricao': 'uber centro', 'valor': 20, 'data': '2025-03-01', 'tipo': 'despesa'},
+    ]
+    rv = backend_client.post('/api/transacoes/lote', json=itens)
+    assert rv.status_code == 201
+    corpo = rv.get_json()
+    assert corpo['inseridas'] == 3
+    assert corpo['rejeitadas'] == 2
+    assert [('id' in r, 'erro' in r) for r in corpo['resultados']] == [
+        (True, False), (False, True), (True, False), (False, True), (True, False)
+    ]
+
+    with backend.app.app_context():
+        for item, resultado in zip(itens, corpo['resultados']):
+            if 'id' in resultado:
+                t = backend.db.session.get(backend.Transacao, resultado['id'])
+                assert t.descricao == item['descricao']
+                assert t.valor == float(item['valor'])
+
+    incremental = resumo_atual(backend)
+    with backend.app.app_context():
+        backend.reconstruir_resumo_mensal()
+    assert incremental == resumo_atual(backend)
+
+
+def test_lote_deixa_o_historico_para_o_job(backend, backend_client):
+    job = backend.job_reclassificacao
+    with backend.app.app_context():
+        backend.db.session.add(backend.Transacao(descricao='ZZQW Kmbr', valor=99.0, data=date(2025, 1, 5),
+                                                 tipo='despesa', categoria_id=4))
+        backend.db.session.commit()
+        backend.reconstruir_resumo_mensal()
+    backend.indexar_historico()
+
+    itens = [{'descricao': descricao, 'valor': 10, 'data': '2025-02-01', 'tipo': 'despesa'}
+             for descricao in ['zzqw kmbr', 'uber centro']]
+    corpo = backend_client.post('/api/transacoes/lote', json=itens).get_json()
+    assert corpo['inseridas'] == 2
+    # Só a descrição que depende do histórico passou pelo job, em segundo plano
+    job.aguardar(5)
+    status = job.status()
+    assert (status['estado'], status['processadas'], status['classificadas']) == ('concluido', 1, 1)
+    with backend.app.app_context():
+        categorias = [backend.db.session.get(backend.Transacao, r['id']).categoria_id for r in corpo['resultados']]
+    assert categorias[0] == 4 and categorias[1] is not None
+
+    # Um novo lote continua do último id, sem reler as linhas já vistas
+    backend_client.post('/api/transacoes/lote', json=itens[:1])
+    job.aguardar(5)
+    assert job.status()['processadas'] == 2
+    incremental = resumo_atual(backend)
+    with backend.app.app_context():
+        backend.reconstruir_resumo_mensal()
+    assert incremental == resumo_atual(backend)
+
+
+def test_job_ve_linhas_gravadas_durante_a_execucao(backend, monkeypatch):
+    job = backend.job_reclassificacao
+    with backend.app.app_context():
+        backend.db.session.add(backend.Transacao(descricao='zzz', valor=1.0, data=date(2025, 1, 1), tipo='despesa'))
+        backend.db.session.commit()
+
+    # O job para logo depois de ver que não há mais linhas, antes de decidir terminar
+    sem_linhas, liberar = threading.Event(), threading.Event()
+    processar_lote = job._processar_lote
+    def processar_e_esperar(conn, checkpoint):
+        if processar_lote(conn, checkpoint):
+            return True
+        if not sem_linhas.is_set():
+            sem_linhas.set()
+            liberar.wait(5)
+        return False
+    monkeypatch.setattr(job, '_processar_lote', processar_e_esperar)
+
+    assert job.iniciar()
+    assert sem_linhas.wait(5)
+    with backend.app.app_context():
+        backend.db.session.add(backend.Transacao(descricao='uber centro', valor=2.0, data=date(2025, 1, 2),
+                                                 tipo='despesa'))
+        backend.db.session.commit()
+    # Já em execução: sem continuar recusa; com continuar o job dá mais uma volta
+    assert not job.iniciar()
+    assert job.iniciar(continuar=True)
+    liberar.set()
+    job.aguardar(5)
+    status = job.status()
+    assert (status['estado'], status['processadas'], status['classificadas'], status['pendentes']) == \
+        ('concluido', 2, 1, 0)
+
+
+def test_lote_invalido(backend_client):
+    assert backend_client.post('/api/transacoes/lote', json={'x': 1}).status_code == 400
+
+
+def test_estatisticas_classificacao_expoem_cache(backend, backend_client):
+    backend_client.post('/api/transacoes', json={'descricao': 'Uber centro', 'valor': 10,
+                                                 'data': '2025-01-05', 'tipo': 'despesa'})
+    backend_client.post('/api/transacoes', json={'descricao': 'UBER  centro!', 'valor': 12,
+                                                 'data': '2025-01-06', 'tipo': 'despesa'})
+    resposta = backend_client.get('/api/ml/estatisticas-classificacao')
+    assert resposta.status_code == 200
+    cache = resposta.get_json()['cache']
+    assert cache['acertos'] >= 1
+    assert set(cache) >= {'capacidade', 'tamanho', 'falhas', 'taxa_acerto', 'remocoes', 'invalidacoes'}
+
+
+def test_classificar_lote_endpoint(backend_client):
+    descricoes = ['Uber centro', 'Aluguel', 'uber  centro', 'zzz']
+    resposta = backend_client.post('/api/ml/classificar-lote', json={'descricoes': descricoes})
+    assert resposta.status_code == 200
+    resultados = resposta.get_json()['resultados']
+    assert [r['descricao'] for r in resultados] == descricoes
+    individuais = [backend_client.post('/api/ml/classificar-lote', json=[d]).get_json()['resultados'][0]
+                   for d in descricoes]
+    assert resultados == individuais
+    assert resultados[0]['categoria_id'] == resultados[2]['categoria_id'] is not None
+
+    assert backend_client.post('/api/ml/classificar-lote', json={'descricoes': 'Uber'}).status_code == 400
+
+
+def test_historico_indexado_fora_da_requisicao(backend, backend_client):
+    from classificador import aguardar_indexacao_historico
+
+    with backend.app.app_context():
+        backend.db.session.add(backend.Transacao(descricao='ZZQW Kmbr', valor=99.0, data=date(2025, 1, 5),
+                                                 tipo='despesa', categoria_id=4))
+        backend.db.session.commit()
+    # A escrita pela rota agenda a indexação de todas as linhas pendentes
+    resposta = backend_client.post('/api/transacoes', json={'descricao': 'Uber centro', 'valor': 10,
+                                                            'data': '2025-01-06', 'tipo': 'despesa'})
+    assert resposta.status_code == 201
+    aguardar_indexacao_historico(5)
+    with backend.app.app_context():
+        pendentes = backend.db.session.execute(backend.db.text(
+            'SELECT COUNT(*) FROM historico_descricao WHERE descricao_limpa IS NULL')).scalar()
+    assert pendentes == 0
+    resultado = backend_client.post('/api/ml/classificar-lote', json=['zzqw kmbr']).get_json()
+    assert resultado['resultados'][0]['categoria_id'] == 4
+
+
+def test_treinar_categoria_usa_classificador_compartilhado(backend_client):
+    import classificador
+
+    descricao = {'descricoes': ['assinatura zzfitness']}
+    assert backend_client.post('/api/ml/classificar-lote', json=descricao).get_json()['resultados'][0]['categoria_id'] is None
+    servico = classificador._obter_servico()
+    construcoes = servico.construcoes
+
+    resposta = backend_client.post('/api/categorias/3/treinar', json={'descricao': 'assinatura zzfitness'})
+    assert resposta.status_code == 200
+    assert backend_client.post('/api/ml/classificar-lote', json=descricao).get_json()['resultados'][0]['categoria_id'] == 3
+    assert servico.construcoes == construcoes
+
+
+def test_reclassificacao_em_segundo_plano_retoma_do_checkpoint(backend, backend_client, monkeypatch):
+    job = backend.job_reclassificacao
+    monkeypatch.setattr(job, 'tamanho_lote', 2)
+    with backend.app.app_context():
+        for i, descricao in enumerate(['Uber centro', 'zzz', 'Aluguel maio', 'uber aeroporto', 'zzz']):
+            backend.db.session.add(backend.Transacao(descricao=descricao, valor=float(i + 1),
+                                                     data=date(2025, 1, 1), tipo='despesa'))
+        backend.db.session.commit()
+        backend.reconstruir_resumo_mensal()
+
+    # O primeiro lote pede o cancelamento: o job para depois de gravá-lo
+    classificar = job.classificar
+    def classificar_e_cancelar(descricoes):
+        job.cancelar()
+        return classificar(descricoes)
+    monkeypatch.setattr(job, 'classificar', classificar_e_cancelar)
+    assert backend_client.post('/api/ml/reclassificacao').status_code == 202
+    job.aguardar()
+    status = backend_client.get('/api/ml/reclassificacao').get_json()
+    assert (status['estado'], status['processadas'], status['classificadas']) == ('cancelado', 2, 1)
+    assert backend_client.delete('/api/ml/reclassificacao').status_code == 409
+
+    monkeypatch.setattr(job, 'classificar', classificar)
+    assert backend_client.post('/api/ml/reclassificacao').status_code == 202
+    job.aguardar()
+    status = backend_client.get('/api/ml/reclassificacao').get_json()
+    assert (status['estado'], status['processadas'], status['classificadas'], status['pendentes']) == \
+        ('concluido', 5, 3, 0)
+
+    with backend.app.app_context():
+        sem_categoria = [t.descricao for t in backend.Transacao.query.filter_by(categoria_id=None)]
+    assert sem_categoria == ['zzz', 'zzz']
+    # O resumo mensal acompanhou as reclassificações
+    incremental = resumo_atual(backend)
+    with backend.app.app_context():
+        backend.reconstruir_resumo_mensal()
+    assert incremental == resumo_atual(backend)
+
+
+def test_previsao_por_categoria(backend, backend_client):
+    with backend.app.app_context():
+        for mes in range(1, 13):
+            for categoria_id, valor in [(1, 300 + mes * 10), (2, 100.0)]:
+                backend.db.session.add(backend.Transacao(descricao='gasto', valor=valor, data=date(2024, mes, 10),
+                                                         tipo='despesa', categoria_id=categoria_id))
+        # Categoria com histórico curto: só dois meses
+        for mes in (11, 12):
+            backend.db.session.add(backend.Transacao(descricao='curso', valor=80.0, data=date(2024, mes, 3),
+                                                     tipo='despesa', categoria_id=6))
+        backend.db.session.commit()
+
+    corpo = backend_client.get('/api/ml/previsao-por-categoria').get_json()
+    assert corpo['data_previsao'] == '2025-01'
+    por_id = {c['categoria_id']: c for c in corpo['categorias']}
+    assert por_id[1]['metodo'] == 'regressao' and por_id[1]['previsao'] == pytest.approx(430, abs=1)
+    assert por_id[2]['previsao'] == pytest.approx(100)
+    assert (por_id[6]['metodo'], por_id[6]['meses_historico'], por_id[6]['previsao']) == ('media', 2, 80.0)
+    assert [c['categoria_id'] for c in corpo['categorias']] == [1, 2, 6]
+
+
+def test_padroes_servidos_do_cache_e_revalidados_em_segundo_plano(backend, backend_client):
+    def criar(valor):
+        assert backend_client.post('/api/transacoes', json={
+            'descricao': 'mercado', 'valor': valor, 'data': '2024-03-10', 'tipo': 'despesa', 'categoria_id': 1
+        }).status_code == 201
+
+    criar(100.0)
+    resposta = backend_client.get('/api/ml/padroes')
+    assert resposta.get_json()['por_categoria'][0]['gasto_total'] == 100.0
+    assert 'Age' in resposta.headers and 'X-Resultado-Desatualizado' not in resposta.headers
+    etag = resposta.headers['ETag']
+
+    # Escrita nova: o valor anterior é devolvido na hora, sem ETag, e recalculado em segundo plano
+    criar(50.0)
+    resposta = backend_client.get('/api/ml/padroes')
+    assert resposta.headers['X-Resultado-Desatualizado'] == '1' and 'ETag' not in resposta.headers
+    assert resposta.get_json()['por_categoria'][0]['gasto_total'] == 100.0
+
+    backend.resultados_ml.aguardar(10)
+    resposta = backend_client.get('/api/ml/padroes')
+    assert 'X-Resultado-Desatualizado' not in resposta.headers and resposta.headers['ETag'] != etag
+    assert resposta.get_json()['por_categoria'][0]['gasto_total'] == 150.0
@@ -0,0 +1,589 @@
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+from difflib import SequenceMatcher
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'ml'))
+
+import banco
+import previsao_gastos
+from automato import AutomatoAhoCorasick
+from cache_lru import CacheLRU
+from cache_revalidacao import CacheRevalidacao
+from classificador import ClassificadorCategorias, IndexacaoEmSegundoPlano, ServicoClassificador, indexar_historico
+from indice_similaridade import IndiceSimilaridade
+from migracoes import aplicar_migracoes
+from modelo_em_cache import ModeloEmCache
+from palavras_chave import EspelhoPalavrasChave, adicionar_palavras
+from previsao_categorias import prever_em_lote
+from previsao_gastos import FEATURES, PrevisaoGastos
+from registro_modelos import RegistroModelos
+
+
+def test_caminho_relativo_resolvido_pela_raiz_do_projeto(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    caminho = banco.resolver_caminho_db('database/controle_gastos.db')
+    assert caminho == os.path.join(banco.RAIZ_PROJETO, 'database', 'controle_gastos.db')
+
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path / "outro.db"}')
+    assert banco.resolver_caminho_db() == str(tmp_path / 'outro.db')
+
+    # Sem DATABASE_URL: o mesmo arquivo que o backend sempre usou (pasta instance do Flask)
+    monkeypatch.delenv('DATABASE_URL')
+    assert banco.resolver_caminho_db() == os.path.join(
+        banco.RAIZ_PROJETO, 'backend', 'instance', 'database', 'controle_gastos.db')
+
+
+def test_conexao_por_thread_com_pragmas(tmp_path):
+    caminho = str(tmp_path / 'pragmas.db')
+    conn = banco.obter_conexao(caminho)
+    assert banco.obter_conexao(caminho) is conn
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+    outras = []
+    thread = threading.Thread(target=lambda: outras.append(banco.obter_conexao(caminho)))
+    thread.start()
+    thread.join()
+    assert outras[0] is not conn
+    banco.fechar_conexoes()
+
+
+def test_pool_reaproveita_conexoes_entre_threads(tmp_path):
+    caminho = str(tmp_path / 'pool.db')
+    # Uma thread por requisição, como no servidor do Werkzeug
+    usadas = []
+
+    def requisicao():
+        conn = banco.obter_conexao(caminho)
+        conn.execute('BEGIN')
+        conn.execute('CREATE TABLE IF NOT EXISTS t (x)')
+        usadas.append(conn)
+        banco.devolver_conexoes()
+
+    for _ in range(5):
+        thread = threading.Thread(target=requisicao)
+        thread.start()
+        thread.join()
+    assert all(conn is usadas[0] for conn in usadas)
+    # A transação deixada aberta foi desfeita na devolução
+    assert not usadas[0].in_transaction
+
+    # Thread que termina sem devolver: a conexão volta ao pool mesmo assim
+    esquecida = []
+    thread = threading.Thread(target=lambda: esquecida.append(banco.obter_conexao(caminho)))
+    thread.start()
+    thread.join()
+    del thread
+    assert banco.obter_conexao(caminho) is esquecida[0]
+    banco.fechar_conexoes()
+
+
+CATEGORIAS_TESTE = [
+    ('Alimentação', ['supermercado', 'restaurante', 'lanche', 'Padaria', 'bar']),
+    ('Transporte', ['uber', 'taxi', 'combustível', 'ônibus', 'uber']),
+    ('Moradia', ['aluguel', 'luz', 'internet', 'gás']),
+    ('Lazer', ['cinema', 'show', 'viagem', 'bar']),
+    ('Outros', []),
+]
+
+
+@pytest.fixture
+def db_categorias(tmp_path):
+    caminho = str(tmp_path / 'classificador.db')
+    conn = sqlite3.connect(caminho)
+    conn.executescript("""
+        CREATE TABLE categoria (id INTEGER PRIMARY KEY, nome VARCHAR(80) NOT NULL, palavras_chave TEXT);
+        CREATE TABLE transacao (id INTEGER PRIMARY KEY, descricao VARCHAR(200) NOT NULL, valor FLOAT NOT NULL,
+                                data DATE NOT NULL, tipo VARCHAR(10) NOT NULL, categoria_id INTEGER);
+    """)
+    conn.executemany('INSERT INTO categoria (nome, palavras_chave) VALUES (?, ?)',
+                     [(nome, json.dumps(palavras)) for nome, palavras in CATEGORIAS_TESTE])
+    conn.commit()
+    conn.close()
+    # As palavras-chave saem do JSON para a tabela categoria_palavra na migração 6
+    aplicar_migracoes(create_engine(f'sqlite:///{caminho}'))
+    yield caminho
+    banco.fechar_conexoes()
+
+
+def test_automato_equivale_a_busca_por_substring():
+    padroes = ['he', 'she', 'his', 'hers', 'a', 'ab', 'bab', 'bc', 'bca', 'c', 'caa']
+    automato = AutomatoAhoCorasick(padroes)
+    aleatorio = random.Random(7)
+    for _ in range(500):
+        texto = ''.join(aleatorio.choice('abcehirs ') for _ in range(aleatorio.randint(0, 20)))
+        assert automato.buscar(texto) == {p for p in padroes if p in texto}
+
+
+def _exata_antiga(c, descricao):
+    for categoria_id, info in c.categorias.items():
+        for palavra in info['palavras_chave']:
+            if palavra.lower() in descricao:
+                return categoria_id
+    return None
+
+
+def _especificas_antiga(c, descricao):
+    pontuacoes = {}
+    for nome, palavras in c.palavras_especificas.items():
+        encontradas = [p for p in palavras if p.lower() in descricao]
+        if encontradas:
+            pontuacoes[nome] = sum(len(p) for p in encontradas) * len(encontradas)
+    if pontuacoes:
+        melhor = max(pontuacoes, key=pontuacoes.get)
+        for categoria_id, info in c.categorias.items():
+            if info['nome'] == melhor:
+                return categoria_id
+    return None
+
+
+def test_estagios_com_automato_mantem_resultados(db_categorias):
+    c = ClassificadorCategorias(db_path=db_categorias)
+    vocabulario = ['uber', 'eats', 'bar', 'padaria', 'pão de açúcar', 'viagem', 'trabalho', 'netflix',
+                   'cinema', 'livro', 'caneta', 'farmácia', 'extra', 'xyz', 'show', 'gás', '99', 'café']
+    aleatorio = random.Random(11)
+    for _ in range(300):
+        texto = ' '.join(aleatorio.choice(vocabulario) for _ in range(aleatorio.randint(1, 5)))
+        limpo = c._limpar_texto(texto)
+        assert c._buscar_correspondencia_exata(limpo) == _exata_antiga(c, limpo)
+        assert c._buscar_palavras_especificas(limpo) == _especificas_antiga(c, limpo)
+
+    sugestoes = c.sugerir_categoria_manual('Bar e Padaria do centro')
+    assert sugestoes[0]['nome'] == 'Alimentação'
+    assert sugestoes[0]['palavras_encontradas'] == ['Padaria', 'bar', 'padaria']
+    assert sugestoes[0]['score'] == 7 + 3 + (7 + 3) * 1.5
+
+
+def test_servico_recarrega_so_quando_categorias_mudam(db_categorias):
+    aplicar_migracoes(create_engine(f'sqlite:///{db_categorias}'))
+    servico = ServicoClassificador(db_categorias)
+
+    primeiro = servico.obter()
+    assert servico.obter() is primeiro
+    assert primeiro.classificar_transacao('assinatura zzfitness') is None
+
+    assert primeiro.treinar_classificador('assinatura zzfitness', 3)
+    segundo = servico.obter()
+    assert segundo is not primeiro
+    assert segundo.classificar_transacao('assinatura zzfitness') == 3
+    assert servico.obter() is segundo
+
+
+def test_servico_treina_sem_reconstruir(db_categorias):
+    aplicar_migracoes(create_engine(f'sqlite:///{db_categorias}'))
+    servico = ServicoClassificador(db_categorias)
+    classificador = servico.obter()
+    assert classificador.classificar_transacao('assinatura zzfitness') is None
+
+    assert servico.treinar('assinatura zzfitness', 3)
+    assert servico.obter() is classificador and servico.construcoes == 1
+    assert classificador.classificar_transacao('assinatura zzfitness') == 3
+    assert not servico.treinar('de a o', 3)
+
+
+def test_classificador_construido_uma_vez_e_trocado_inteiro(db_categorias):
+    servico = ServicoClassificador(db_categorias)
+    largada = threading.Barrier(8)
+    obtidos, erros = [], []
+
+    def primeira_requisicao():
+        largada.wait()
+        obtidos.append(servico.obter())
+        banco.devolver_conexoes()
+
+    threads = [threading.Thread(target=primeira_requisicao) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert servico.construcoes == 1 and all(c is obtidos[0] for c in obtidos)
+
+    # Recargas do índice (treinar) durante classificações: cada leitura vê um índice completo
+    classificador = obtidos[0]
+    parar = threading.Event()
+
+    def classificar():
+        try:
+            while not parar.is_set():
+                assert classificador.classificar_lote(['uber centro', 'cinema shopping']) == [2, 4]
+        except Exception as e:
+            erros.append(e)
+        finally:
+            banco.devolver_conexoes()
+
+    leitores = [threading.Thread(target=classificar) for _ in range(4)]
+    for thread in leitores:
+        thread.start()
+    for i in range(20):
+        classificador.treinar_classificador(f'zqkloja{i:02d} presente', 5)
+    parar.set()
+    for thread in leitores:
+        thread.join()
+    assert erros == []
+    assert 'zqkloja19' in classificador.categorias[5]['palavras_chave']
+
+
+def _similaridade_antiga(palavras, descricao, minimo=0.6):
+    melhor_razao, melhor = 0, None
+    for palavra, valor in palavras:
+        razao = SequenceMatcher(None, descricao, palavra).ratio()
+        if razao > melhor_razao and razao > minimo:
+            melhor_razao, melhor = razao, valor
+    return melhor
+
+
+def test_indice_similaridade_equivale_a_varredura(db_categorias):
+    aleatorio = random.Random(5)
+    palavras = [(''.join(aleatorio.choice('abcde ') for _ in range(aleatorio.randint(0, 12))), i % 7)
+                for i in range(300)]
+    indice = IndiceSimilaridade(palavras)
+    for _ in range(150):
+        texto = ''.join(aleatorio.choice('abcdef ') for _ in range(aleatorio.randint(0, 16)))
+        assert indice.melhor(texto, 0.6) == _similaridade_antiga(palavras, texto)
+
+    c = ClassificadorCategorias(db_path=db_categorias)
+    do_banco = [(p.lower(), categoria_id) for categoria_id, info in c.categorias.items() for p in info['palavras_chave']]
+    for texto in ['uberr', 'tax', 'aluguel', 'padarias', 'cinemas', 'bar', 'xyz', '']:
+        assert c._buscar_por_similaridade(texto) == _similaridade_antiga(do_banco, texto)
+
+
+def _historico_antigo(c, conn, descricao):
+    melhor_score, melhor = 0, None
+    for desc, categoria_id, freq in conn.execute(
+            """SELECT descricao, categoria_id, COUNT(*) AS f FROM transacao WHERE categoria_id IS NOT NULL
+               GROUP BY descricao, categoria_id ORDER BY f DESC"""):
+        similaridade = SequenceMatcher(None, descricao, c._limpar_texto(desc)).ratio()
+        score = similaridade * (1 + freq * 0.1)
+        if score > melhor_score and similaridade > 0.7:
+            melhor_score, melhor = score, categoria_id
+    return melhor
+
+
+def test_historico_por_trigramas_equivale_a_varredura(db_categorias):
+    aplicar_migracoes(create_engine(f'sqlite:///{db_categorias}'))
+    conn = sqlite3.connect(db_categorias)
+    aleatorio = random.Random(3)
+    lojas = ['mercadinho sao jose', 'posto shell centro', 'academia smartfit', 'loja americanas',
+             'drogasil av paulista', 'pet shop amigo', 'barbearia do ze', 'livraria cultura']
+    inserir = 'INSERT INTO transacao (descricao, valor, data, tipo, categoria_id) VALUES (?, 1, ?, ?, ?)'
+    for _ in range(300):
+        loja = aleatorio.choice(lojas)
+        conn.execute(inserir, (f'{loja} {aleatorio.randint(1, 40)}', '2025-01-01', 'despesa',
+                               lojas.index(loja) % 5 + 1))
+    conn.commit()
+
+    c = ClassificadorCategorias(db_path=db_categorias)
+    pendentes = 'SELECT COUNT(*) FROM historico_descricao WHERE descricao_limpa IS NULL'
+    # A consulta só lê: as linhas novas esperam a indexação feita por quem grava
+    assert c._aprender_de_historico('mercadinho sao jose 1') is None
+    assert conn.execute(pendentes).fetchone()[0] > 0
+    indexar_historico(db_categorias)
+    assert conn.execute(pendentes).fetchone()[0] == 0
+
+    consultas = [c._limpar_texto(f'{aleatorio.choice(lojas)[:-2]} {aleatorio.randint(1, 60)}') for _ in range(100)]
+    for consulta in consultas + ['xyz', 'a']:
+        assert c._aprender_de_historico(consulta) == _historico_antigo(c, conn, consulta)
+
+    # Inserções e exclusões entram no índice sem reconstrução
+    assert c._aprender_de_historico('clinica veterinaria bicho') is None
+    conn.execute(inserir, ('Clínica Veterinária Bicho', '2025-01-02', 'despesa', 4))
+    conn.commit()
+    indexar_historico(db_categorias)
+    assert c._aprender_de_historico('clinica veterinaria bichos') == 4
+    conn.execute("UPDATE transacao SET categoria_id = 2 WHERE descricao = 'Clínica Veterinária Bicho'")
+    conn.commit()
+    indexar_historico(db_categorias)
+    assert c._aprender_de_historico('clinica veterinaria bichos') == 2
+    conn.execute("DELETE FROM transacao WHERE descricao = 'Clínica Veterinária Bicho'")
+    conn.commit()
+    assert c._aprender_de_historico('clinica veterinaria bichos') is None
+    assert conn.execute('SELECT COUNT(*) FROM historico_trigrama WHERE historico_id NOT IN '
+                        '(SELECT id FROM historico_descricao)').fetchone()[0] == 0
+    conn.close()
+
+
+def test_cache_lru_limita_e_conta():
+    calculos = []
+    def calcular(chave):
+        calculos.append(chave)
+        return chave.upper()
+
+    cache = CacheLRU(capacidade=2)
+    assert cache.obter('a', calcular) == 'A'
+    assert cache.obter('b', calcular) == 'B'
+    assert cache.obter('a', calcular) == 'A'
+    cache.obter('c', calcular)  # 'b' é o menos usado e sai
+    cache.obter('b', calcular)
+    assert calculos == ['a', 'b', 'c', 'b']
+
+    cache.limpar()
+    assert len(cache) == 0
+    assert cache.estatisticas() == {'capacidade': 2, 'tamanho': 0, 'acertos': 1, 'falhas': 4,
+                                    'taxa_acerto': 20.0, 'remocoes': 2, 'invalidacoes': 1}
+
+
+def test_classificacao_usa_cache_por_texto_limpo(db_categorias):
+    c = ClassificadorCategorias(db_path=db_categorias)
+    assert c.classificar_transacao('UBER *TRIP') == c.classificar_transacao('uber trip') == 2
+    estatisticas = c.obter_estatisticas_classificacao()['cache']
+    assert (estatisticas['acertos'], estatisticas['falhas']) == (1, 1)
+
+    # Treinar muda as palavras-chave: o resultado guardado não vale mais
+    assert c.classificar_transacao('assinatura zzfitness') is None
+    assert c.treinar_classificador('assinatura zzfitness', 3)
+    assert c.classificar_transacao('assinatura zzfitness') == 3
+
+
+def test_classificar_lote_equivale_ao_individual(db_categorias):
+    c = ClassificadorCategorias(db_path=db_categorias)
+    descricoes = ['UBER *TRIP', 'aluguel casa', '', 'uber trip', 'xyz qualquer', None, 'Cinema!!', 'aluguel  casa']
+    resultados = c.classificar_lote(descricoes)
+
+    individual = ClassificadorCategorias(db_path=db_categorias)
+    assert resultados == [individual.classificar_transacao(d) for d in descricoes]
+    # 4 textos normalizados distintos (vazios não contam)
+    assert c.obter_estatisticas_classificacao()['cache']['falhas'] == 4
+
+
+def test_historico_indexado_depois_do_cache_e_considerado(db_categorias):
+    c = ClassificadorCategorias(db_path=db_categorias)
+    descricao = 'Mensalidade ZZFIT jardins'
+    assert c.classificar_transacao(descricao) is None
+    assert c.classificar_lote([descricao]) == [None]
+
+    conn = sqlite3.connect(db_categorias)
+    conn.execute("INSERT INTO transacao (descricao, valor, data, tipo, categoria_id) "
+                 "VALUES ('mensalidade zzfit jardins', 99.0, '2025-01-05', 'despesa', 4)")
+    conn.commit()
+    conn.close()
+    assert indexar_historico(db_categorias) == 1
+
+    # O "não classificado" anterior não fica preso no cache
+    assert c.classificar_transacao(descricao) == 4
+    assert c.classificar_lote([descricao, 'uber centro']) == [4, 2]
+
+
+def test_indexacao_em_segundo_plano_junta_agendamentos(tmp_path):
+    comecou, liberar = threading.Event(), threading.Event()
+    rodadas = []
+    def indexar(caminho):
+        comecou.set()
+        liberar.wait(5)
+        rodadas.append(caminho)
+        return 1
+
+    indexacao = IndexacaoEmSegundoPlano(indexar)
+    caminho = str(tmp_path / 'historico.db')
+    primeira = indexacao.agendar(caminho)
+    assert comecou.wait(5)
+    # Durante uma rodada, vários agendamentos viram uma única rodada seguinte
+    seguintes = [indexacao.agendar(caminho) for _ in range(5)]
+    assert all(f is seguintes[0] for f in seguintes) and seguintes[0] is not primeira
+    liberar.set()
+    indexacao.aguardar(5)
+    assert rodadas == [caminho, caminho] and indexacao.rodadas == 2
+
+
+def test_modelo_em_cache_recarrega_so_quando_o_arquivo_muda(tmp_path):
+    leituras = []
+    recargas = []
+    def carregar(caminho):
+        leituras.append(caminho)
+        with open(caminho) as arquivo:
+            return arquivo.read()
+
+    cache = ModeloEmCache(carregar, ao_recarregar=lambda: recargas.append(1))
+    caminho = str(tmp_path / 'modelo.joblib')
+    assert cache.obter(caminho) is None
+
+    with open(caminho, 'w') as arquivo:
+        arquivo.write('v1')
+    assert cache.obter(caminho) == 'v1'
+    assert cache.obter(caminho) == 'v1'
+    assert len(leituras) == 1
+
+    with open(caminho, 'w') as arquivo:
+        arquivo.write('versao 2')
+    assert cache.obter(caminho) == 'versao 2'
+    assert len(leituras) == 2 and len(recargas) == 2
+
+
+def test_palavras_chave_em_tabela_com_espelho_em_memoria(db_categorias):
+    # A migração copia as listas JSON na ordem original, sem repetições
+    c = ClassificadorCategorias(db_path=db_categorias)
+    assert c.categorias[2]['palavras_chave'] == ['uber', 'taxi', 'combustível', 'ônibus']
+    espelho = EspelhoPalavrasChave(db_categorias)
+    antes = espelho.obter()
+    assert antes[1] == ['supermercado', 'restaurante', 'lanche', 'Padaria', 'bar']
+    assert espelho.obter() is antes
+
+    assert c.treinar_classificador('assinatura da zzfitness', 3)
+    assert c.treinar_classificador('assinatura da zzfitness', 3)
+    depois = espelho.obter()
+    assert depois is not antes
+    assert depois[3] == ['aluguel', 'luz', 'internet', 'gás', 'assinatura', 'zzfitness']
+    assert espelho.obter_para_busca()[0] == (1, ['supermercado', 'restaurante', 'lanche', 'padaria', 'bar'])
+
+    # Só as mais recentes ficam quando a categoria passa do limite
+    conn = banco.obter_conexao(db_categorias)
+    assert adicionar_palavras(conn, 5, [f'palavra{i}' for i in range(60)], limite=50) == 60
+    conn.commit()
+    assert espelho.obter()[5] == [f'palavra{i}' for i in range(10, 60)]
+
+
+def test_tabela_mensal_reaproveitada_ate_os_dados_mudarem(db_categorias, monkeypatch, tmp_path):
+    monkeypatch.setattr(previsao_gastos, 'registro_previsao', RegistroModelos('previsao_gastos', str(tmp_path)))
+    monkeypatch.setattr(previsao_gastos, '_dados_mensais', {})
+    conn = banco.obter_conexao(db_categorias)
+    conn.executemany(
+        "INSERT INTO transacao (descricao, valor, data, tipo) VALUES ('compra', ?, ?, 'despesa')",
+        [(100.0 + mes * 10 + dia, f'2024-{mes:02d}-{dia:02d}') for mes in range(1, 11) for dia in (5, 20)]
+    )
+    conn.commit()
+
+    montagens = []
+    montar = PrevisaoGastos._montar_dados_mensais
+    def contar(self, conexao):
+        montagens.append(1)
+        return montar(self, conexao)
+    monkeypatch.setattr(PrevisaoGastos, '_montar_dados_mensais', contar)
+
+    previsoes = PrevisaoGastos(db_categorias).prever_multiplos_meses(3)
+    assert len(previsoes) == 3
+    assert len(montagens) == 1
+    assert PrevisaoGastos(db_categorias).prever_multiplos_meses(3) == previsoes
+    assert len(montagens) == 1
+
+    conn.execute("UPDATE transacao SET valor = valor * 2 WHERE data >= '2024-10-01'")
+    conn.commit()
+    assert PrevisaoGastos(db_categorias).prever_multiplos_meses(3) != previsoes
+    assert len(montagens) == 2
+
+
+def test_agregacao_mensal_no_sql_equivale_ao_pandas(db_categorias):
+    aleatorio = random.Random(3)
+    linhas = [(round(aleatorio.uniform(1, 500), 2), f'20{aleatorio.randint(22, 24)}-{aleatorio.randint(1, 12):02d}-'
+               f'{aleatorio.randint(1, 28):02d}', aleatorio.choice(['despesa', 'despesa', 'receita']))
+              for _ in range(400)]
+    conn = banco.obter_conexao(db_categorias)
+    conn.executemany("INSERT INTO transacao (descricao, valor, data, tipo) VALUES ('x', ?, ?, ?)", linhas)
+    conn.commit()
+
+    # Referência: linha a linha no pandas, como antes da agregação no SQL
+    df = pd.DataFrame([(v, d) for v, d, t in linhas if t == 'despesa'], columns=['valor', 'data'])
+    df['data'] = pd.to_datetime(df['data'])
+    esperado = df.groupby([df['data'].dt.year.rename('ano'), df['data'].dt.month.rename('mes')])['valor'] \
+        .agg(['sum', 'count']).reset_index()
+    esperado['media_3_meses'] = esperado['sum'].rolling(window=3).mean()
+    esperado = esperado.iloc[3:]
+
+    obtido = PrevisaoGastos(db_categorias)._montar_dados_mensais(conn)
+    assert obtido['ano'].tolist() == esperado['ano'].tolist()
+    assert obtido['mes'].tolist() == esperado['mes'].tolist()
+    assert obtido['qtd_transacoes'].tolist() == esperado['count'].tolist()
+    assert obtido['total_gastos'].tolist() == pytest.approx(esperado['sum'].tolist())
+    assert obtido['media_3_meses'].tolist() == pytest.approx(esperado['media_3_meses'].tolist())
+    assert (obtido['data_mensal'].dt.day == 1).all()
+
+
+def test_previsao_por_categoria_em_lote_equivale_a_uma_regressao_por_categoria():
+    aleatorio = np.random.default_rng(8)
+    totais = aleatorio.uniform(50, 500, size=(12, 30))
+    inicio = np.array([0, 0, 3, 10, 20, 24, 25, 26, 27, 29, 5, 15])
+    totais[np.arange(30)[None, :] < inicio[:, None]] = 0
+
+    previsao, margem, meses_treino, usa_regressao = prever_em_lote(totais, inicio)
+    for c in range(len(totais)):
+        serie = totais[c, inicio[c]:]
+        assert meses_treino[c] == max(len(serie) - 3, 0)
+        if meses_treino[c] >= 6:
+            X = np.column_stack([np.ones(len(serie) - 3)] + [serie[3 - k:len(serie) - k] for k in (1, 2, 3)])
+            beta = np.linalg.lstsq(X, serie[3:], rcond=None)[0]
+            esperado = beta @ [1, serie[-1], serie[-2], serie[-3]]
+            assert usa_regressao[c]
+            assert previsao[c] == pytest.approx(max(esperado, 0))
+        else:
+            assert not usa_regressao[c]
+            assert previsao[c] == pytest.approx(serie[-3:].mean())
+
+
+def test_registro_de_modelos_versionado(db_categorias, tmp_path, monkeypatch):
+    registro = RegistroModelos('previsao_gastos', str(tmp_path / 'modelos'))
+    conn = banco.obter_conexao(db_categorias)
+    conn.executemany(
+        "INSERT INTO transacao (descricao, valor, data, tipo) VALUES ('compra', ?, ?, 'despesa')",
+        [(100.0 + mes * 7, f'2024-{mes:02d}-10') for mes in range(1, 13)]
+    )
+    conn.commit()
+
+    # O diretório é absoluto: mudar o diretório atual não muda onde o modelo fica
+    monkeypatch.chdir(tmp_path)
+    previsao = PrevisaoGastos(db_categorias, registro=registro).prever_proximo_mes()
+    assert previsao is not None
+    metadados = registro.metadados()
+    assert metadados['versao'] == 1 and metadados['features'] == FEATURES
+    assert set(metadados) >= {'impressao', 'sklearn', 'metricas', 'treinado_em'}
+
+    # Mesmos dados: outra instância reaproveita a versão salva sem treinar de novo
+    treinos = []
+    monkeypatch.setattr(PrevisaoGastos, 'salvar_modelo', lambda self, *a, **k: treinos.append(1))
+    assert PrevisaoGastos(db_categorias, registro=registro).prever_proximo_mes() == previsao
+    assert PrevisaoGastos(db_categorias, registro=registro).treinar_modelo()
+    assert treinos == []
+    monkeypatch.undo()
+
+    # Dados novos: o modelo salvo fica desatualizado e uma nova versão é gravada
+    conn.execute("INSERT INTO transacao (descricao, valor, data, tipo) VALUES ('compra', 900, '2025-01-10', 'despesa')")
+    conn.commit()
+    assert PrevisaoGastos(db_categorias, registro=registro).prever_proximo_mes()['data_previsao'] == '2025-02'
+    assert [m['versao'] for m in registro.versoes()] == [1, 2]
+    assert registro.metadados()['impressao'] != metadados['impressao']
+
+    assert registro.reverter()['versao'] == 1
+    assert registro.carregar()[1]['versao'] == 1
+
+
+def test_cache_revalidacao_serve_valor_antigo_e_recalcula_uma_vez():
+    versao = [1]
+    liberar = threading.Event()
+    chamadas = []
+
+    def calcular():
+        chamadas.append(versao[0])
+        if len(chamadas) > 1:
+            liberar.wait(5)
+        return f'v{versao[0]}'
+
+    cache = CacheRevalidacao(lambda: versao[0])
+    # Sem valor guardado: a primeira requisição espera o cálculo
+    assert cache.obter('previsao', calcular)[::2] == ('v1', True)
+    assert cache.obter('previsao', calcular)[::2] == ('v1', True)
+    assert chamadas == [1]
+
+    # Dados mudaram: várias requisições simultâneas recebem o valor antigo na
+    # hora e disparam um único recálculo
+    versao[0] = 2
+    respostas = []
+    threads = [threading.Thread(target=lambda: respostas.append(cache.obter('previsao', calcular)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert [(valor, atualizado) for valor, _, atualizado in respostas] == [('v1', False)] * 8
+    assert all(idade >= 0 for _, idade, _ in respostas)
+
+    liberar.set()
+    cache.aguardar(5)
+    assert chamadas == [1, 2]
+    valor, idade, atualizado = cache.obter('previsao', calcular)
+    assert (valor, atualizado) == ('v2', True) and idade < 5